@@ -0,0 +1,147 @@
+import os
+import pickle
+import pandas as pd
+import polars as pl
+from cache_excel import ruta_parquet
+from almacen_series import almacen_desde_ancho
+
+# Refresco nocturno de SC_COTIZACIONES en una sola pasada.
+# Antes contar_segmentos_polars, contar_segmentos_polars_tuplas, cotizaciones_promedio,
+# procesar_datos_segmentos y procesar_y_exportar leían el archivo completo cada una.
+# Aquí se hace un solo scan lazy del Parquet (ver cache_excel) y todos los agregados
+# salen del mismo collect.
+
+def _fecha_como_datetime(schema):
+    """Expresión que lleva FECHA_COTIZACION a Datetime sin importar cómo se leyó"""
+    tipo = schema['FECHA_COTIZACION']
+    if tipo == pl.String:
+        return pl.col('FECHA_COTIZACION').str.to_datetime(strict=False)
+    return pl.col('FECHA_COTIZACION').cast(pl.Datetime)
+
+def calcular_agregados_sc(file_path, sheet_name=None, output_path='agregados_sc.pkl'):
+    """
+    Calcula todos los agregados de SC_COTIZACIONES leyendo el archivo una sola vez.
+
+    Args:
+        file_path (str): Ruta a SC_COTIZACIONES.xlsx
+        sheet_name (str, opcional): Nombre de la hoja a leer
+        output_path (str, opcional): Donde guardar el artefacto (None para no guardar)
+
+    Returns:
+        dict: Tablas polars con los agregados
+            'conteo_segmentos': NOMBRE_SEGMENTO, cantidad
+            'max_cotizacion': COTIZANTE, MAX_COTIZACIONES
+            'conteo_segmento_fecha': NOMBRE_SEGMENTO, fecha, conteo
+            'cotizantes_fecha_segmento': FECHA_COTIZACION, NOMBRE_SEGMENTO, cotizantes
+    """
+    lf = pl.scan_parquet(ruta_parquet(file_path, sheet_name=sheet_name))
+    schema = lf.collect_schema()
+
+    columnas_requeridas = ['FECHA_COTIZACION', 'COTIZANTE', 'COTIZACION', 'NOMBRE_SEGMENTO']
+    for col in columnas_requeridas:
+        if col not in schema:
+            raise ValueError(f"El archivo debe contener la columna: {col}")
+
+    lf = lf.select(columnas_requeridas).with_columns(_fecha_como_datetime(schema))
+
+    conteo_segmentos = (
+        lf.group_by('NOMBRE_SEGMENTO')
+        .agg(pl.len().alias('cantidad'))
+    )
+    max_cotizacion = (
+        lf.group_by('COTIZANTE')
+        .agg(pl.max('COTIZACION').alias('MAX_COTIZACIONES'))
+        .sort('COTIZANTE')
+    )
+    con_fecha_y_segmento = lf.drop_nulls(['FECHA_COTIZACION', 'NOMBRE_SEGMENTO'])
+    conteo_segmento_fecha = (
+        con_fecha_y_segmento
+        .with_columns(pl.col('FECHA_COTIZACION').dt.date().alias('fecha'))
+        .group_by(['NOMBRE_SEGMENTO', 'fecha'])
+        .agg(pl.len().alias('conteo'))
+        .sort(['NOMBRE_SEGMENTO', 'fecha'])
+    )
+    cotizantes_fecha_segmento = (
+        con_fecha_y_segmento
+        .drop_nulls('COTIZANTE')
+        .group_by(['FECHA_COTIZACION', 'NOMBRE_SEGMENTO'])
+        .agg(pl.col('COTIZANTE').n_unique().cast(pl.Int64).alias('cotizantes'))
+        .sort(['FECHA_COTIZACION', 'NOMBRE_SEGMENTO'])
+    )
+
+    # Un solo collect: polars comparte el scan entre los cuatro planes
+    tablas = pl.collect_all([conteo_segmentos, max_cotizacion, conteo_segmento_fecha, cotizantes_fecha_segmento])
+    agregados = dict(zip(
+        ['conteo_segmentos', 'max_cotizacion', 'conteo_segmento_fecha', 'cotizantes_fecha_segmento'],
+        tablas
+    ))
+
+    if output_path:
+        with open(output_path, 'wb') as f:
+            pickle.dump(agregados, f)
+    return agregados
+
+def cargar_agregados(path='agregados_sc.pkl'):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+# Vistas con la misma forma que las funciones originales
+
+def conteo_como_dict(agregados):
+    """Igual que segmentosid.contar_segmentos_polars"""
+    conteo = agregados['conteo_segmentos'].to_dict(as_series=False)
+    return dict(zip(conteo['NOMBRE_SEGMENTO'], conteo['cantidad']))
+
+def conteo_como_tuplas(agregados):
+    """Igual que segmentosid.contar_segmentos_polars_tuplas"""
+    return agregados['conteo_segmentos'].rows()
+
+def promedio_cotizaciones(agregados):
+    """Igual que segmentosid.cotizaciones_promedio"""
+    return agregados['max_cotizacion'].mean()
+
+def segmentos_data(agregados):
+    """Igual que modelo_ces.procesar_datos_segmentos: (dict segmento -> fecha -> conteo, min_date, max_date)"""
+    datos = {}
+    for segmento, fecha, conteo in agregados['conteo_segmento_fecha'].iter_rows():
+        datos.setdefault(segmento, {})[fecha] = conteo
+    fechas = agregados['conteo_segmento_fecha']['fecha']
+    return datos, fechas.min(), fechas.max()
+
+def series_por_segmento(agregados):
+    """Igual que modelo_ces.procesar_y_exportar: fechas x segmentos con cotizantes únicos"""
+    largo = agregados['cotizantes_fecha_segmento'].to_pandas()
+    return largo.pivot(index='FECHA_COTIZACION', columns='NOMBRE_SEGMENTO', values='cotizantes')
+
+def refrescar_agregados(file_path, directorio_salida='.', sheet_name=None):
+    """
+    Refresco nocturno: lee SC_COTIZACIONES una vez y deja todos los archivos derivados.
+
+    Escribe agregados_sc.pkl, segmentos_data.pkl, series_por_segmento.pkl (y su
+    version series_por_segmento_store) y conteo_segmentos.txt en directorio_salida.
+    """
+    os.makedirs(directorio_salida, exist_ok=True)
+    agregados = calcular_agregados_sc(
+        file_path,
+        sheet_name=sheet_name,
+        output_path=os.path.join(directorio_salida, 'agregados_sc.pkl')
+    )
+
+    with open(os.path.join(directorio_salida, 'segmentos_data.pkl'), 'wb') as f:
+        pickle.dump(segmentos_data(agregados), f)
+
+    series = series_por_segmento(agregados)
+    series.to_pickle(os.path.join(directorio_salida, 'series_por_segmento.pkl'))
+    almacen_desde_ancho(series, os.path.join(directorio_salida, 'series_por_segmento_store'))
+
+    with open(os.path.join(directorio_salida, 'conteo_segmentos.txt'), 'w') as f:
+        for segmento, cantidad in conteo_como_dict(agregados).items():
+            f.write(f"{segmento}: {cantidad}\n")
+
+    return agregados
+
+if __name__ == "__main__":
+    agregados = refrescar_agregados('BBDD/SC_COTIZACIONES.xlsx')
+    print('promedio cotizaciones por cotizante')
+    print(promedio_cotizaciones(agregados))
+    print(f"segmentos unicos {agregados['conteo_segmentos'].height}")
@@ -0,0 +1,100 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# Almacen denso de series por segmento.
+# Un directorio con:
+#   matriz.npy     (segmentos x fechas), una fila contigua por segmento
+#   fechas.npy     eje de fechas ordenado (datetime64)
+#   segmentos.json nombres de los segmentos en el orden de las filas
+# Al cargar se usa memory map: pedir una serie o un rango de fechas es una vista,
+# no se lee ni se copia el resto del archivo.
+# Cada archivo se escribe aparte y se reemplaza con os.replace (segmentos.json al final),
+# asi un AlmacenSeries abierto sigue leyendo los archivos anteriores sin ver uno a medio escribir.
+
+def _reemplazar(ruta, escribir):
+    """Escribe en un temporal del mismo directorio y lo pone en ruta de una vez"""
+    tmp = ruta + '.tmp'
+    with open(tmp, 'wb') as f:
+        escribir(f)
+    os.replace(tmp, ruta)
+
+def guardar_almacen(directorio, matriz, fechas, segmentos):
+    """Guarda matriz (segmentos x fechas), fechas y nombres de segmentos en directorio"""
+    fechas = np.asarray(fechas)
+    if matriz.shape != (len(segmentos), len(fechas)):
+        raise ValueError(f"La matriz {matriz.shape} no calza con {len(segmentos)} segmentos y {len(fechas)} fechas")
+    if len(fechas) > 1 and not (fechas[1:] > fechas[:-1]).all():
+        raise ValueError("Las fechas deben venir ordenadas y sin repetir")
+
+    os.makedirs(directorio, exist_ok=True)
+    _reemplazar(os.path.join(directorio, 'matriz.npy'), lambda f: np.save(f, np.ascontiguousarray(matriz)))
+    _reemplazar(os.path.join(directorio, 'fechas.npy'), lambda f: np.save(f, fechas))
+    nombres = json.dumps([str(s) for s in segmentos], ensure_ascii=False).encode('utf-8')
+    _reemplazar(os.path.join(directorio, 'segmentos.json'), lambda f: f.write(nombres))
+
+def almacen_desde_conteos(conteos, directorio, col_segmento='NOMBRE_SEGMENTO', col_fecha='fecha', col_valor='conteo'):
+    """
+    Construye el almacen a partir de conteos en formato largo (segmento, fecha, conteo).
+    El eje de fechas es diario y continuo entre la primera y la última fecha; los días
+    sin registros quedan en 0. Los conteos se guardan como int32.
+    """
+    fechas_largo = pd.to_datetime(conteos[col_fecha]).to_numpy().astype('datetime64[D]')
+    fechas = np.arange(fechas_largo.min(), fechas_largo.max() + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+    codigos, segmentos = pd.factorize(conteos[col_segmento], sort=True)
+
+    matriz = np.zeros((len(segmentos), len(fechas)), dtype=np.int32)
+    columnas = (fechas_largo - fechas[0]).astype(np.int64)
+    np.add.at(matriz, (codigos, columnas), conteos[col_valor].to_numpy(dtype=np.int32))
+
+    guardar_almacen(directorio, matriz, fechas, list(segmentos))
+    return AlmacenSeries(directorio)
+
+def almacen_desde_ancho(df, directorio, dtype=np.float64):
+    """Construye el almacen desde un DataFrame ancho (fechas x segmentos), ej. series_por_segmento.pkl"""
+    df = df.sort_index()
+    guardar_almacen(directorio, df.to_numpy(dtype=dtype).T, df.index.to_numpy(), list(df.columns))
+    return AlmacenSeries(directorio)
+
+class AlmacenSeries:
+    """Lectura con memory map del almacen guardado por guardar_almacen"""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.matriz = np.load(os.path.join(directorio, 'matriz.npy'), mmap_mode='r')
+        self.fechas = np.load(os.path.join(directorio, 'fechas.npy'), mmap_mode='r')
+        with open(os.path.join(directorio, 'segmentos.json'), 'r', encoding='utf-8') as f:
+            self.segmentos = json.load(f)
+        if self.matriz.shape != (len(self.segmentos), len(self.fechas)):
+            # se abrio mientras guardar_almacen reemplazaba los archivos
+            raise ValueError(f"Almacen incompleto en {directorio}: vuelva a abrirlo")
+        self.indice = {s: i for i, s in enumerate(self.segmentos)}
+
+    def __contains__(self, segmento):
+        return segmento in self.indice
+
+    def _rango(self, fecha_inicio, fecha_fin):
+        """Búsqueda binaria de las posiciones [inicio, fin) en el eje de fechas"""
+        tipo = self.fechas.dtype
+        inicio = 0 if fecha_inicio is None else np.searchsorted(self.fechas, np.datetime64(pd.Timestamp(fecha_inicio)).astype(tipo), side='left')
+        fin = len(self.fechas) if fecha_fin is None else np.searchsorted(self.fechas, np.datetime64(pd.Timestamp(fecha_fin)).astype(tipo), side='right')
+        return inicio, fin
+
+    def vista(self, segmento, fecha_inicio=None, fecha_fin=None):
+        """Valores de un segmento entre dos fechas (incluidas) como vista sin copia"""
+        if segmento not in self.indice:
+            raise ValueError(f"Segmento no encontrado: {segmento}")
+        inicio, fin = self._rango(fecha_inicio, fecha_fin)
+        return self.matriz[self.indice[segmento], inicio:fin]
+
+    def serie(self, segmento, fecha_inicio=None, fecha_fin=None):
+        """Igual que vista pero como pd.Series indexada por fecha"""
+        inicio, fin = self._rango(fecha_inicio, fecha_fin)
+        valores = self.vista(segmento, fecha_inicio, fecha_fin)
+        return pd.Series(valores, index=pd.DatetimeIndex(self.fechas[inicio:fin]), name=segmento, copy=False)
+
+    def corte(self, fecha_inicio=None, fecha_fin=None):
+        """Todos los segmentos en un rango de fechas (vista segmentos x fechas)"""
+        inicio, fin = self._rango(fecha_inicio, fecha_fin)
+        return self.matriz[:, inicio:fin]
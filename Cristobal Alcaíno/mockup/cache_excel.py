@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+import warnings
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Cache en Parquet de los Excel de BBDD.
+# La primera lectura de cada libro/hoja se convierte a Parquet; las siguientes
+# se leen desde ahí con memory map. La entrada se invalida sola si el Excel cambia.
+# Cada libro/hoja se convierte una sola vez (con pd.read_excel) y del mismo Parquet
+# salen tanto el DataFrame de pandas como el de polars.
+
+MANIFIESTO = 'manifiesto.json'
+
+def _hash_archivo(ruta, bloque=1 << 20):
+    """sha256 del contenido del archivo"""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for trozo in iter(lambda: f.read(bloque), b''):
+            h.update(trozo)
+    return h.hexdigest()
+
+def _directorio_cache(ruta_excel, cache_dir):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(ruta_excel), '.cache_parquet')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def _leer_manifiesto(cache_dir):
+    ruta = os.path.join(cache_dir, MANIFIESTO)
+    if not os.path.exists(ruta):
+        return {}
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Manifiesto corrupto: se reconstruye desde cero
+        return {}
+
+def _guardar_manifiesto(cache_dir, manifiesto):
+    ruta = os.path.join(cache_dir, MANIFIESTO)
+    tmp = ruta + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2)
+    os.replace(tmp, ruta)
+
+def tabla_desde_pandas(df, origen=None):
+    """
+    Convierte un DataFrame de pandas a tabla Arrow.
+
+    Arrow exige un tipo por columna, así que una columna object con tipos mezclados
+    (p.ej. números y texto) se guarda como texto y se avisa con el nombre de la columna.
+    Es la única diferencia con df: esos valores vuelven como texto al leer el Parquet.
+
+    Args:
+        origen (str, opcional): Nombre del archivo u objeto, para el aviso
+    """
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            warnings.warn(f"{origen or 'DataFrame'}: la columna '{col}' mezcla tipos y se guarda como texto", stacklevel=2)
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def _convertir(ruta_excel, sheet_name, kwargs_lectura, destino):
+    df = pd.read_excel(ruta_excel, sheet_name=sheet_name or 0, **kwargs_lectura)
+    tabla = tabla_desde_pandas(df, origen=os.path.basename(ruta_excel))
+
+    tmp = destino + '.tmp'
+    pq.write_table(tabla, tmp)
+    os.replace(tmp, destino)
+
+def ruta_parquet(ruta_excel, sheet_name=None, cache_dir=None, **kwargs_lectura):
+    """
+    Devuelve la ruta del Parquet equivalente a una hoja de un Excel, creándolo si hace falta.
+
+    La entrada del cache se identifica por ruta, hoja y argumentos de lectura.
+    Si cambia el mtime o el tamaño del Excel se recalcula el hash del contenido, y sólo
+    si el hash cambió se vuelve a convertir.
+
+    Args:
+        ruta_excel (str): Ruta al archivo Excel
+        sheet_name (str, opcional): Hoja a leer (por defecto la primera)
+        cache_dir (str, opcional): Directorio del cache (por defecto BBDD/.cache_parquet)
+        **kwargs_lectura: Argumentos extra para pd.read_excel (ej. skiprows)
+
+    Returns:
+        str: Ruta al archivo Parquet
+    """
+    ruta_abs = os.path.abspath(ruta_excel)
+    cache_dir = _directorio_cache(ruta_abs, cache_dir)
+    manifiesto = _leer_manifiesto(cache_dir)
+
+    clave = json.dumps([ruta_abs, sheet_name, sorted(kwargs_lectura.items())], default=str)
+    estado = os.stat(ruta_abs)
+    entrada = manifiesto.get(clave)
+
+    if entrada and os.path.exists(entrada['parquet']):
+        if entrada['mtime'] == estado.st_mtime and entrada['tamano'] == estado.st_size:
+            return entrada['parquet']
+        contenido = _hash_archivo(ruta_abs)
+        if entrada['hash'] == contenido:
+            # Sólo cambió el mtime (copia, touch): el Parquet sigue siendo válido
+            entrada.update(mtime=estado.st_mtime, tamano=estado.st_size)
+            _guardar_manifiesto(cache_dir, manifiesto)
+            return entrada['parquet']
+    else:
+        contenido = _hash_archivo(ruta_abs)
+
+    nombre = hashlib.sha1(clave.encode('utf-8')).hexdigest()[:16]
+    destino = os.path.join(cache_dir, f"{nombre}_{contenido[:16]}.parquet")
+    _convertir(ruta_abs, sheet_name, kwargs_lectura, destino)
+
+    if entrada and entrada['parquet'] != destino and os.path.exists(entrada['parquet']):
+        os.remove(entrada['parquet'])
+    manifiesto[clave] = {
+        'parquet': destino,
+        'mtime': estado.st_mtime,
+        'tamano': estado.st_size,
+        'hash': contenido
+    }
+    _guardar_manifiesto(cache_dir, manifiesto)
+    return destino
+
+def leer_excel(ruta_excel, sheet_name=None, motor='pandas', columnas=None, cache_dir=None, **kwargs_lectura):
+    """
+    Reemplazo de pd.read_excel / pl.read_excel que lee desde el cache Parquet.
+
+    Los datos son los de pd.read_excel con ambos motores (la inferencia de tipos es la de
+    pandas). Difiere de pd.read_excel sólo en columnas con tipos mezclados, que vuelven como
+    texto (ver tabla_desde_pandas, que avisa al convertir).
+
+    Args:
+        ruta_excel (str): Ruta al archivo Excel
+        sheet_name (str, opcional): Hoja a leer (por defecto la primera)
+        motor (str): 'pandas' devuelve pd.DataFrame, 'polars' devuelve pl.DataFrame
+        columnas (list, opcional): Sólo lee estas columnas del Parquet
+        cache_dir (str, opcional): Directorio del cache
+        **kwargs_lectura: Argumentos extra para la lectura del Excel (ej. skiprows)
+
+    Returns:
+        pd.DataFrame o pl.DataFrame
+    """
+    if motor not in ('pandas', 'polars'):
+        raise ValueError(f"Motor no soportado: {motor}")
+    ruta = ruta_parquet(ruta_excel, sheet_name=sheet_name, cache_dir=cache_dir, **kwargs_lectura)
+    tabla = pq.read_table(ruta, columns=columnas, memory_map=True)
+    if motor == 'polars':
+        return pl.from_arrow(tabla)
+    return tabla.to_pandas()
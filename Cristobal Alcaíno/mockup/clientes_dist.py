@@ -2,17 +2,19 @@ import numpy as np
 import pandas as pd
 import joblib
 import os
-import matplotlib.pyplot as plt
+import copy
+from collections import OrderedDict
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.compose import ColumnTransformer
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.mixture import BayesianGaussianMixture
 from sklearn.pipeline import Pipeline
-from scipy.stats import ks_2samp, chi2_contingency, wasserstein_distance
+from scipy.stats import chi2_contingency, kstwobign
 import warnings
 warnings.filterwarnings('ignore')
 
 from functions import cargar_desde_pickle
+from segmentosid import IndiceSegmentos
 
 def aprender_distribucion(df, features_numericas, features_categoricas, model_path):
     df = df[features_numericas + features_categoricas].copy()
@@ -45,137 +47,559 @@ def aprender_distribucion(df, features_numericas, features_categoricas, model_pa
     joblib.dump(modelo, model_path)
     return modelo
 
-def samplear_distribucion(modelo, n_muestras=int):
-    if isinstance(modelo, str):
-        modelo = joblib.load(modelo)
-    
-    pipeline = modelo['pipeline']
+# Entrenamiento incremental
+# El modelo guarda, ademas del pipeline, el estado para actualizarlo mes a mes:
+#   ipca        IncrementalPCA con todas las componentes (el paso 'pca' es una copia truncada)
+#   reservorio  muestra uniforme y acotada de las filas vistas (Algorithm R)
+#   n_vistos    filas vistas en total
+# Asi actualizar con un mes nuevo sólo necesita las filas de ese mes y el reservorio.
+
+def _truncar_pca(ipca, n_componentes):
+    """Copia de un IncrementalPCA quedandose con las primeras n_componentes"""
+    pca = copy.deepcopy(ipca)
+    pca.components_ = ipca.components_[:n_componentes]
+    pca.explained_variance_ = ipca.explained_variance_[:n_componentes]
+    pca.explained_variance_ratio_ = ipca.explained_variance_ratio_[:n_componentes]
+    pca.singular_values_ = ipca.singular_values_[:n_componentes]
+    pca.n_components = pca.n_components_ = n_componentes
+    return pca
+
+def _bloques(df, tamano_bloque, minimo):
+    """Particiona df en bloques de ~tamano_bloque filas, ninguno con menos de minimo filas"""
+    n_bloques = max(1, min(int(np.ceil(len(df) / tamano_bloque)), len(df) // max(minimo, 1)))
+    for filas in np.array_split(np.arange(len(df)), n_bloques):
+        yield df.iloc[filas]
+
+def _ajustar_ipca(ipca, preprocessor, df, tamano_bloque):
+    minimo = ipca.n_components or 1
+    if len(df) < minimo:
+        print(f"Advertencia: {len(df)} filas no alcanzan para actualizar el PCA ({minimo} columnas)")
+        return
+    for bloque in _bloques(df, tamano_bloque, minimo):
+        ipca.partial_fit(preprocessor.transform(bloque))
+
+def _actualizar_reservorio(reservorio, nuevos, n_vistos, capacidad, rng):
+    """Reservoir sampling: tras agregar nuevos, reservorio es una muestra uniforme de todas las filas vistas"""
+    faltan = max(capacidad - len(reservorio), 0)
+    if faltan:
+        reservorio = pd.concat([reservorio, nuevos.iloc[:faltan]], ignore_index=True)
+        n_vistos += min(faltan, len(nuevos))
+        nuevos = nuevos.iloc[faltan:]
+    if len(nuevos):
+        t = n_vistos + np.arange(len(nuevos))
+        posiciones = rng.integers(0, t + 1)
+        acepta = np.flatnonzero(posiciones < capacidad)
+        # si dos filas caen en la misma posicion se queda la ultima, como en el algoritmo secuencial
+        reemplazos = pd.Series(acepta, index=posiciones[acepta])
+        reemplazos = reemplazos[~reemplazos.index.duplicated(keep='last')]
+        reservorio = reservorio.copy()
+        destino, origen = reemplazos.index.to_numpy(), reemplazos.to_numpy()
+        # por columna, para no pasar por un arreglo object que cambie los dtypes del reservorio
+        for j in range(reservorio.shape[1]):
+            reservorio.iloc[destino, j] = nuevos.iloc[origen, j].to_numpy()
+        n_vistos += len(nuevos)
+    return reservorio, n_vistos
+
+def aprender_distribucion_incremental(df, features_numericas, features_categoricas, model_path,
+                                      tamano_bloque=50000, capacidad_reservorio=100000, varianza=0.95,
+                                      categorias=None, semilla=42):
+    """
+    Igual que aprender_distribucion pero deja el modelo listo para actualizar_distribucion.
+
+    El PCA se ajusta por bloques (IncrementalPCA) y el GMM sobre una muestra uniforme de a lo
+    mas capacidad_reservorio filas, asi la memoria no crece con el historial.
+    El StandardScaler, el numero de componentes del PCA (varianza explicada) y las categorias
+    quedan fijos desde aqui; categorias que aparezcan despues se ignoran como en handle_unknown='ignore'.
+
+    Args:
+        categorias (dict, opcional): {columna: lista de categorias} si se conocen de antemano
+    """
+    df = df[features_numericas + features_categoricas]
+    rng = np.random.default_rng(semilla)
+    ohe_categorias = 'auto' if categorias is None else [list(categorias[c]) for c in features_categoricas]
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), features_numericas),
+            ('cat', OneHotEncoder(categories=ohe_categorias, sparse_output=False, handle_unknown='ignore'), features_categoricas)
+        ],
+        remainder = 'drop'
+    ).fit(df)
+
+    n_columnas = len(preprocessor.get_feature_names_out())
+    ipca = IncrementalPCA(n_components=n_columnas)
+    _ajustar_ipca(ipca, preprocessor, df, max(tamano_bloque, n_columnas))
+    n_componentes = int(np.searchsorted(np.cumsum(ipca.explained_variance_ratio_), varianza) + 1)
+    pca = _truncar_pca(ipca, min(n_componentes, n_columnas))
+
+    reservorio, n_vistos = _actualizar_reservorio(df.iloc[:0], df, 0, capacidad_reservorio, rng)
+    gmm = BayesianGaussianMixture(
+        n_components=min(50, len(df)//200),
+        covariance_type='diag',
+        max_iter=500,
+        random_state=42,
+        warm_start=True,
+        verbose=1
+    ).fit(pca.transform(preprocessor.transform(reservorio)))
+
+    modelo = {
+        'pipeline': Pipeline([('preprocessor', preprocessor), ('pca', pca), ('gmm', gmm)]),
+        'features_numericas': features_numericas,
+        'features_categoricas': features_categoricas,
+        'incremental': {
+            'ipca': ipca,
+            'n_componentes': pca.n_components_,
+            'reservorio': reservorio,
+            'capacidad_reservorio': capacidad_reservorio,
+            'n_vistos': n_vistos,
+            'tamano_bloque': tamano_bloque,
+            'rng': rng
+        }
+    }
+    joblib.dump(modelo, model_path)
+    return modelo
 
-    samplear_embeddings, _ = pipeline.named_steps['gmm'].sample(n_muestras)
+def actualizar_distribucion(df_nuevo, model_path, modelo=None):
+    """
+    Actualiza modelo_distribucion.pkl con las filas de un mes nuevo sin reentrenar desde cero.
 
-    pca = pipeline.named_steps['pca']
-    sampled_pca = pca.inverse_transform(samplear_embeddings)
+    IncrementalPCA con partial_fit por bloques y GMM reajustado con warm start (parte de la
+    solucion anterior) sobre el reservorio actualizado. El StandardScaler no se actualiza: la
+    media, componentes y varianza del PCA y el ajuste previo del GMM estan en su escala, y
+    cambiarla dejaria ese estado inconsistente con los bloques nuevos.
 
+    Args:
+        df_nuevo (pd.DataFrame): Filas nuevas (p.ej. las cotizaciones del ultimo mes)
+        model_path (str): Modelo a actualizar; se sobreescribe
+        modelo (dict, opcional): Modelo ya cargado (si no, se lee de model_path)
+    """
+    if modelo is None:
+        modelo = joblib.load(model_path)
+    if 'incremental' not in modelo:
+        raise ValueError("El modelo no se entreno con aprender_distribucion_incremental; no se puede actualizar")
+
+    estado = modelo['incremental']
+    pipeline = modelo['pipeline']
     preprocessor = pipeline.named_steps['preprocessor']
-    df_sampled = pd.DataFrame(
-        sampled_pca,
-        columns = preprocessor.get_feature_names_out()
+    df_nuevo = df_nuevo[modelo['features_numericas'] + modelo['features_categoricas']]
+    if len(df_nuevo) == 0:
+        return modelo
+
+    _ajustar_ipca(estado['ipca'], preprocessor, df_nuevo, max(estado['tamano_bloque'], estado['ipca'].n_components))
+    pca = _truncar_pca(estado['ipca'], estado['n_componentes'])
+
+    estado['reservorio'], estado['n_vistos'] = _actualizar_reservorio(
+        estado['reservorio'], df_nuevo, estado['n_vistos'], estado['capacidad_reservorio'], estado['rng']
     )
+    gmm = pipeline.named_steps['gmm']
+    gmm.set_params(warm_start=True)
+    gmm.fit(pca.transform(preprocessor.transform(estado['reservorio'])))
+
+    modelo['pipeline'] = Pipeline([('preprocessor', preprocessor), ('pca', pca), ('gmm', gmm)])
+    joblib.dump(modelo, model_path)
+    return modelo
+
+class ClientSampler:
+    """
+    Sampleo de cotizantes sinteticos desde el modelo de aprender_distribucion.
+
+    El modelo se carga una sola vez y la vuelta desde el espacio PCA al espacio original
+    (inverse PCA + inverse StandardScaler + columnas one-hot) queda precalculada como una
+    sola transformacion afin Z @ A + b. Las categorias se decodifican con argmax sobre
+    tramos fijos de columnas, sin armar DataFrames intermedios.
+    """
+
+    def __init__(self, modelo, semilla=None, tamano_bloque=262144):
+        if isinstance(modelo, str):
+            modelo = joblib.load(modelo)
+        self.modelo = modelo
+        self.rng = np.random.default_rng(semilla)
+        self.tamano_bloque = tamano_bloque
+
+        pipeline = modelo['pipeline']
+        preprocessor = pipeline.named_steps['preprocessor']
+        pca = pipeline.named_steps['pca']
+        gmm = pipeline.named_steps['gmm']
+
+        # Inverse PCA: Z @ componentes + media (con whiten los componentes van escalados)
+        A = pca.components_.astype(float).copy()
+        if getattr(pca, 'whiten', False):
+            A *= np.sqrt(pca.explained_variance_)[:, None]
+        b = pca.mean_.astype(float).copy()
+
+        # Inverse StandardScaler sobre las columnas numericas
+        self.features_numericas = list(modelo['features_numericas'])
+        tramo_num = preprocessor.output_indices_['num']
+        scaler = preprocessor.named_transformers_['num']
+        escala = scaler.scale_ if scaler.scale_ is not None else np.ones(len(self.features_numericas))
+        A[:, tramo_num] *= escala
+        b[tramo_num] = b[tramo_num] * escala + scaler.mean_
+        self.pos_numericas = np.arange(tramo_num.start, tramo_num.stop)
+
+        # Tramos one-hot de cada categorica y la tabla codigo -> categoria
+        self.features_categoricas = list(modelo['features_categoricas'])
+        tramo_cat = preprocessor.output_indices_['cat']
+        ohe = preprocessor.named_transformers_['cat']
+        self.tramos_categoricas = []
+        inicio = tramo_cat.start
+        for categorias in ohe.categories_:
+            etiquetas = np.array([str(c) for c in categorias])
+            self.tramos_categoricas.append((inicio, inicio + len(etiquetas), etiquetas))
+            inicio += len(etiquetas)
+
+        self.A, self.b = A, b
+
+        # Mezcla: pesos, medias y factor de covarianza por componente
+        self.pesos = gmm.weights_ / gmm.weights_.sum()
+        self.medias = gmm.means_
+        self.tipo_covarianza = gmm.covariance_type
+        if self.tipo_covarianza == 'diag':
+            self.desv = np.sqrt(gmm.covariances_)
+        elif self.tipo_covarianza == 'spherical':
+            self.desv = np.sqrt(gmm.covariances_)[:, None]
+        else:
+            # 'tied' (una matriz) o 'full' (una por componente)
+            self.chol = np.linalg.cholesky(gmm.covariances_)
+
+        campos = [(col, 'f8') for col in self.features_numericas]
+        campos += [(col, etiquetas.dtype) for col, (_, _, etiquetas) in zip(self.features_categoricas, self.tramos_categoricas)]
+        self.dtype = np.dtype(campos)
+
+    def _samplear_embeddings(self, n, rng):
+        """Muestras de la mezcla en el espacio PCA, en orden aleatorio"""
+        componentes = rng.choice(len(self.pesos), size=n, p=self.pesos)
+        ruido = rng.standard_normal((n, self.medias.shape[1]))
+        if self.tipo_covarianza in ('diag', 'spherical'):
+            return self.medias[componentes] + ruido * self.desv[componentes]
+        if self.tipo_covarianza == 'tied':
+            return self.medias[componentes] + ruido @ self.chol.T
+        Z = np.empty_like(ruido)
+        for k in np.unique(componentes):
+            filas = componentes == k
+            Z[filas] = self.medias[k] + ruido[filas] @ self.chol[k].T
+        return Z
+
+    def decodificar(self, embeddings, salida=None):
+        """Lleva muestras del espacio PCA a un arreglo estructurado con las columnas originales"""
+        Y = embeddings @ self.A + self.b
+        if salida is None:
+            salida = np.empty(len(Y), dtype=self.dtype)
+        for col, pos in zip(self.features_numericas, self.pos_numericas):
+            salida[col] = Y[:, pos]
+        for col, (inicio, fin, etiquetas) in zip(self.features_categoricas, self.tramos_categoricas):
+            salida[col] = etiquetas[Y[:, inicio:fin].argmax(axis=1)]
+        return salida
+
+    def samplear(self, n_muestras, rng=None):
+        """n_muestras cotizantes como arreglo estructurado (se arma por bloques para acotar memoria).
+        Usa el generador del sampler salvo que se pase otro en rng"""
+        rng = self.rng if rng is None else rng
+        salida = np.empty(n_muestras, dtype=self.dtype)
+        for inicio in range(0, n_muestras, self.tamano_bloque):
+            fin = min(inicio + self.tamano_bloque, n_muestras)
+            self.decodificar(self._samplear_embeddings(fin - inicio, rng), salida[inicio:fin])
+        return salida
+
+    def como_df(self, muestras):
+        """Arreglo estructurado -> DataFrame con las columnas de samplear_distribucion"""
+        df = pd.DataFrame({col: muestras[col] for col in self.features_numericas})
+        for col in self.features_categoricas:
+            df[col] = muestras[col].astype(object)
+        return df
+
+    def samplear_df(self, n_muestras, rng=None):
+        return self.como_df(self.samplear(n_muestras, rng))
 
-    scaler = preprocessor.named_transformers_['num']
-    num_feature_names = [f"num__{col}" for col in modelo['features_numericas']]
+    def iterar(self, n_total, tamano_bloque=None, como_df=False):
+        """Genera n_total cotizantes en bloques de tamano_bloque (memoria acotada por bloque)"""
+        tamano_bloque = tamano_bloque or self.tamano_bloque
+        for inicio in range(0, n_total, tamano_bloque):
+            bloque = self.samplear(min(tamano_bloque, n_total - inicio))
+            yield self.como_df(bloque) if como_df else bloque
 
-    if all(col in df_sampled.columns for col in num_feature_names):
-        df_sampled[num_feature_names] = scaler.inverse_transform(df_sampled[num_feature_names])
-        rename_dict = {f"num__{col}": col for col in modelo['features_numericas']}
-        df_sampled.rename(columns=rename_dict, inplace=True)
+# Un sampler por modelo, para no recargar el joblib en cada llamada (mockup.py llama una vez por dia).
+# Por ruta se guarda solo la version con el mtime vigente (actualizar_distribucion reescribe el archivo)
+# y el cache es un LRU acotado
+_MAX_SAMPLERS = 8
+_samplers = OrderedDict()
+
+def _sampler(modelo):
+    if isinstance(modelo, str):
+        clave, version = os.path.abspath(modelo), os.path.getmtime(modelo)
     else:
-        print("Advertencia")
-    
-    ohe = preprocessor.named_transformers_['cat']
-
-    for orig_col in modelo['features_categoricas']:
-        prefix = f"cat__{orig_col}_"
-        ohe_cols = [ c for c in df_sampled.columns if c.startswith(prefix)]
-        if ohe_cols:
-            df_sampled[orig_col] = df_sampled[ohe_cols].idxmax(axis=1).str.replace(prefix, "")
-            df_sampled.drop(columns=ohe_cols, inplace=True)
-    
-    column_order = modelo['features_numericas'] + modelo['features_categoricas']
-    available_cols = [col for col in column_order if col in df_sampled.columns]
+        clave, version = id(modelo), None
+    guardado = _samplers.pop(clave, None)
+    # un id puede reutilizarse si el modelo original ya no existe, por eso tambien se compara el objeto
+    if (guardado is None or guardado[0] != version
+            or (version is None and guardado[1].modelo is not modelo)):
+        guardado = (version, ClientSampler(modelo))
+    _samplers[clave] = guardado
+    while len(_samplers) > _MAX_SAMPLERS:
+        _samplers.popitem(last=False)
+    return guardado[1]
+
+def samplear_distribucion(modelo, n_muestras=int, semilla=42):
+    """
+    n_muestras cotizantes sinteticos como DataFrame.
+
+    Como antes (gmm.sample con el random_state=42 del modelo), por defecto cada llamada parte
+    de la misma semilla y devuelve las mismas muestras. Con semilla=None se sigue el stream
+    del sampler en cache y cada llamada entrega clientes nuevos.
+    """
+    rng = None if semilla is None else np.random.default_rng(semilla)
+    return _sampler(modelo).samplear_df(n_muestras, rng)
+
+# datos.pkl sólo tiene rentas inmediatas garantizadas (ver functions.unir_cotizaciones),
+# así que esos campos no están en el modelo y se completan fijos para asignar segmento
+VALORES_FIJOS = {'TIPO_RENTA': 'I', 'MODALIDAD_RENTA': 'G'}
+
+def generar_cotizantes(modelo, n_total, tamano_bloque=100000, df_segmentos=None,
+                       valores_fijos=VALORES_FIJOS, semilla=None):
+    """
+    Generador de cotizantes sinteticos en bloques de tamano fijo.
+
+    La memoria depende de tamano_bloque y no de n_total: cada bloque se samplea,
+    se le asigna segmento y se entrega antes de generar el siguiente.
+
+    Args:
+        modelo: Modelo de aprender_distribucion, su ruta o un ClientSampler
+        n_total (int): Numero total de cotizantes
+        tamano_bloque (int): Filas por bloque
+        df_segmentos (pd.DataFrame o IndiceSegmentos, opcional): Reglas de segmentos; si se pasa
+            cada bloque trae SEGMENTO_ASIGNADO y COINCIDENCIA
+        valores_fijos (dict): Columnas constantes que se agregan si el modelo no las genera
+        semilla (int, opcional): Semilla del sampler (si modelo no es ya un ClientSampler)
+
+    Yields:
+        pd.DataFrame: Bloque con indice global (el bloque i parte en i * tamano_bloque)
+    """
+    sampler = modelo if isinstance(modelo, ClientSampler) else ClientSampler(modelo, semilla=semilla)
+    indice = df_segmentos
+    if df_segmentos is not None and not isinstance(df_segmentos, IndiceSegmentos):
+        indice = IndiceSegmentos(df_segmentos)
+
+    inicio = 0
+    for bloque in sampler.iterar(n_total, tamano_bloque, como_df=True):
+        bloque.index = pd.RangeIndex(inicio, inicio + len(bloque))
+        inicio += len(bloque)
+        for col, valor in (valores_fijos or {}).items():
+            if col not in bloque.columns:
+                bloque[col] = valor
+        if indice is not None:
+            bloque = bloque.join(indice.asignar_lote(bloque))
+        yield bloque
+
+def _ks_wasserstein(x, y):
+    """KS y Wasserstein-1 desde las dos ECDF evaluadas sobre los valores combinados (x, y ordenados)"""
+    todos = np.concatenate([x, y])
+    todos.sort(kind='mergesort')
+    cdf_x = np.searchsorted(x, todos, side='right') / len(x)
+    cdf_y = np.searchsorted(y, todos, side='right') / len(y)
+    diferencia = np.abs(cdf_x - cdf_y)
+    return diferencia.max(), (diferencia[:-1] * np.diff(todos)).sum()
+
+def _momentos(x):
+    """Media, desviacion (ddof=1) y asimetria corregida, como pandas mean/std/skew"""
+    n = len(x)
+    media = x.mean()
+    centrado = x - media
+    m2 = (centrado ** 2).mean()
+    m3 = (centrado ** 3).mean()
+    desv = np.sqrt(m2 * n / (n - 1)) if n > 1 else np.nan
+    if n > 2 and m2 > 0:
+        asimetria = m3 / m2 ** 1.5 * np.sqrt(n * (n - 1)) / (n - 2)
+    else:
+        asimetria = np.nan
+    return media, desv, asimetria
+
+def _metricas_numericas(x, y):
+    ks, wasserstein = _ks_wasserstein(x, y)
+    mx, sx, ax = _momentos(x)
+    my, sy, ay = _momentos(y)
+    return ks, wasserstein, abs(mx - my), abs(sx - sy), abs(ax - ay)
+
+def evaluar_distribuciones(df_original, df_muestra, features_numericas, features_categoricas,
+                           max_muestra=None, n_bootstrap=0, nivel=0.95, alpha=0.05, semilla=None):
+    """
+    Compara la muestra sintetica con los datos originales, sin graficar.
+
+    Numericas: KS (con p-value asintotico), Wasserstein y diferencias de media, desviacion y
+    asimetria, todo a partir de un solo ordenamiento por columna.
+    Categoricas: chi-cuadrado sobre la tabla de contingencia original vs muestra y distancia
+    de variacion total. Las categorias se comparan como texto (samplear_distribucion las
+    devuelve como str).
+
+    Args:
+        max_muestra (int, opcional): Si alguno de los dos tiene mas filas, se submuestrea a este tamano
+        n_bootstrap (int): Replicas bootstrap para intervalos percentil (0 = sin intervalos); las
+            distancias (KS, Wasserstein) bootstrap tienden a quedar sobre el valor puntual
+        nivel (float): Nivel de confianza de los intervalos
+        alpha (float): Umbral del p-value para marcar PASS
+
+    Returns:
+        dict: 'numericas' y 'categoricas' (pd.DataFrame, una fila por columna), 'n_original', 'n_muestra'
+    """
+    rng = np.random.default_rng(semilla)
+
+    def submuestra(valores):
+        if max_muestra and len(valores) > max_muestra:
+            return rng.choice(valores, max_muestra, replace=False)
+        return valores
+
+    filas = []
+    for col in features_numericas:
+        if col not in df_original.columns or col not in df_muestra.columns:
+            print(f"{col} no encontrada")
+            continue
+        x = np.sort(submuestra(pd.to_numeric(df_original[col], errors='coerce').dropna().to_numpy(dtype=float)))
+        y = np.sort(submuestra(pd.to_numeric(df_muestra[col], errors='coerce').dropna().to_numpy(dtype=float)))
+        if len(x) == 0 or len(y) == 0:
+            print(f"{col} sin datos")
+            continue
 
-    return df_sampled[available_cols]
+        ks, wasserstein, diff_media, diff_desv, diff_asimetria = _metricas_numericas(x, y)
+        n_efectivo = len(x) * len(y) / (len(x) + len(y))
+        fila = {
+            'variable': col,
+            'ks_statistic': ks,
+            'ks_pvalue': kstwobign.sf(np.sqrt(n_efectivo) * ks),
+            'wasserstein_distance': wasserstein,
+            'diff_mean': diff_media,
+            'diff_std': diff_desv,
+            'diff_skewness': diff_asimetria,
+            'n_original': len(x),
+            'n_muestra': len(y),
+        }
 
-def validar_distribuciones(df_original, df_muestra, features_numericas, features_categoricas, output_dir='validacion_plots'):
-    """Valida las distribuciones"""
-    import os
+        if n_bootstrap:
+            replicas = np.array([
+                _metricas_numericas(np.sort(rng.choice(x, len(x))), np.sort(rng.choice(y, len(y))))
+                for _ in range(n_bootstrap)
+            ])
+            cola = (1 - nivel) / 2
+            bajo, alto = np.quantile(replicas, [cola, 1 - cola], axis=0)
+            for k, nombre in enumerate(['ks_statistic', 'wasserstein_distance', 'diff_mean', 'diff_std', 'diff_skewness']):
+                fila[f'{nombre}_ic_bajo'] = bajo[k]
+                fila[f'{nombre}_ic_alto'] = alto[k]
+
+        fila['pasa'] = fila['ks_pvalue'] > alpha
+        filas.append(fila)
+    numericas = pd.DataFrame(filas).set_index('variable') if filas else pd.DataFrame()
+
+    filas = []
+    for col in features_categoricas:
+        if col not in df_original.columns or col not in df_muestra.columns:
+            print(f"{col} no encontrada")
+            continue
+        conteo_original = pd.Series(submuestra(df_original[col].dropna().astype(str).to_numpy())).value_counts()
+        conteo_muestra = pd.Series(submuestra(df_muestra[col].dropna().astype(str).to_numpy())).value_counts()
+        tabla = pd.concat([conteo_original, conteo_muestra], axis=1).fillna(0).to_numpy().T
+        if tabla.shape[1] > 1:
+            chi2, p_value, gl, _ = chi2_contingency(tabla)
+        else:
+            chi2, p_value, gl = 0.0, 1.0, 0
+        proporciones = tabla / tabla.sum(axis=1, keepdims=True)
+        filas.append({
+            'variable': col,
+            'chi2_statistic': chi2,
+            'chi2_pvalue': p_value,
+            'grados_libertad': gl,
+            'tv_distance': 0.5 * np.abs(proporciones[0] - proporciones[1]).sum(),
+            'categorias': tabla.shape[1],
+            'pasa': p_value > alpha,
+        })
+    categoricas = pd.DataFrame(filas).set_index('variable') if filas else pd.DataFrame()
+
+    return {
+        'numericas': numericas,
+        'categoricas': categoricas,
+        'n_original': len(df_original),
+        'n_muestra': len(df_muestra),
+    }
+
+def graficar_distribuciones(df_original, df_muestra, features_numericas, output_dir='validacion_plots',
+                            dpi=300, mostrar=False):
+    """Histogramas, Q-Q y boxplots por variable numerica (paso opcional de validar_distribuciones)"""
+    import matplotlib.pyplot as plt
+
+    columnas = [c for c in features_numericas if c in df_original.columns and c in df_muestra.columns]
+    if not columnas:
+        return None
     os.makedirs(output_dir, exist_ok = True)
 
-    resultados_numericos = {}
+    fig, axes = plt.subplots(len(columnas), 3, figsize=(15, 5*len(columnas)), squeeze=False)
+    for i, col in enumerate(columnas):
+        orig_data = df_original[col].dropna()
+        muestra_data = df_muestra[col].dropna()
 
-    n_num = len(features_numericas)
-    if n_num > 0:
-        fig, axes = plt.subplots(n_num, 3, figsize=(15, 5*n_num))
-        if n_num ==1:
-            axes = axes.reshape(-1,1)
-        
-        for i, col in enumerate(features_numericas):
-            if col not in df_original.columns or col not in df_muestra.columns:
-                print(f"{col} no encontrada")
-                continue
-            orig_data = df_original[col].dropna()
-            muestra_data = df_muestra[col].dropna()
-
-            ks_stat, ks_pvalue = ks_2samp(orig_data, muestra_data)
-            wasserstein_dist = wasserstein_distance(orig_data, muestra_data)
-
-            diff_mean = abs(orig_data.mean() - muestra_data.mean())
-            diff_std = abs(orig_data.std() - muestra_data.std())
-            diff_skew = abs(orig_data.skew() - muestra_data.skew())
-
-            resultados_numericos[col] = {
-                'ks_statistic': ks_stat,
-                'ks_pvalue' : ks_pvalue,
-                'wasserstein_distance': wasserstein_distance,
-                'diff_mean' : diff_mean,
-                'diff_std' : diff_std,
-                'diff_skewness': diff_skew
-            }
-            print(f"\n{col.upper()}:")
-            print(f"  KS Test: statistic={ks_stat:.4f}, p-value={ks_pvalue:.4f}")
-            print(f"  {'✓ Distribuciones similares' if ks_pvalue > 0.05 else '✗ Distribuciones diferentes'}")
-            print(f"  Wasserstein Distance: {wasserstein_dist:.4f}")
-            print(f"  Diff Media: {diff_mean:.4f}, Diff Std: {diff_std:.4f}")
-            
-            # GRÁFICOS
-            # 1. Histogramas superpuestos
-            axes[i, 0].hist(orig_data, alpha=0.7, label='Original', bins=30, density=True)
-            axes[i, 0].hist(muestra_data, alpha=0.7, label='Sintética', bins=30, density=True)
-            axes[i, 0].set_title(f'{col} - Histogramas')
-            axes[i, 0].legend()
-            axes[i, 0].grid(True, alpha=0.3)
-            
-            # 2. Q-Q Plot
-            from scipy.stats import probplot
-            sorted_orig = np.sort(orig_data)
-            sorted_muestra = np.sort(muestra_data)
-            
-            # Interpolar para mismo tamaño
-            if len(sorted_orig) != len(sorted_muestra):
-                min_len = min(len(sorted_orig), len(sorted_muestra))
-                orig_interp = np.interp(np.linspace(0, 1, min_len), 
-                                      np.linspace(0, 1, len(sorted_orig)), sorted_orig)
-                muestra_interp = np.interp(np.linspace(0, 1, min_len), 
-                                         np.linspace(0, 1, len(sorted_muestra)), sorted_muestra)
-            else:
-                orig_interp, muestra_interp = sorted_orig, sorted_muestra
-            
-            axes[i, 1].scatter(orig_interp, muestra_interp, alpha=0.6, s=10)
-            min_val = min(orig_interp.min(), muestra_interp.min())
-            max_val = max(orig_interp.max(), muestra_interp.max())
-            axes[i, 1].plot([min_val, max_val], [min_val, max_val], 'r--', linewidth=2)
-            axes[i, 1].set_xlabel('Original')
-            axes[i, 1].set_ylabel('Sintética')
-            axes[i, 1].set_title(f'{col} - Q-Q Plot')
-            axes[i, 1].grid(True, alpha=0.3)
-            
-            # 3. Boxplots comparativos
-            data_box = [orig_data, muestra_data]
-            axes[i, 2].boxplot(data_box, labels=['Original', 'Sintética'])
-            axes[i, 2].set_title(f'{col} - Boxplots')
-            axes[i, 2].grid(True, alpha=0.3)
-        
-        plt.tight_layout()
-        plt.savefig(f"{output_dir}/variables_numericas.png", dpi=300, bbox_inches='tight')
+        # 1. Histogramas superpuestos
+        axes[i, 0].hist(orig_data, alpha=0.7, label='Original', bins=30, density=True)
+        axes[i, 0].hist(muestra_data, alpha=0.7, label='Sintética', bins=30, density=True)
+        axes[i, 0].set_title(f'{col} - Histogramas')
+        axes[i, 0].legend()
+        axes[i, 0].grid(True, alpha=0.3)
+
+        # 2. Q-Q Plot sobre los mismos cuantiles de ambos
+        n_cuantiles = min(len(orig_data), len(muestra_data))
+        cuantiles = np.linspace(0, 1, n_cuantiles)
+        orig_interp = np.quantile(orig_data, cuantiles)
+        muestra_interp = np.quantile(muestra_data, cuantiles)
+
+        axes[i, 1].scatter(orig_interp, muestra_interp, alpha=0.6, s=10)
+        min_val = min(orig_interp.min(), muestra_interp.min())
+        max_val = max(orig_interp.max(), muestra_interp.max())
+        axes[i, 1].plot([min_val, max_val], [min_val, max_val], 'r--', linewidth=2)
+        axes[i, 1].set_xlabel('Original')
+        axes[i, 1].set_ylabel('Sintética')
+        axes[i, 1].set_title(f'{col} - Q-Q Plot')
+        axes[i, 1].grid(True, alpha=0.3)
+
+        # 3. Boxplots comparativos
+        axes[i, 2].boxplot([orig_data, muestra_data])
+        axes[i, 2].set_xticks([1, 2], ['Original', 'Sintética'])
+        axes[i, 2].set_title(f'{col} - Boxplots')
+        axes[i, 2].grid(True, alpha=0.3)
+
+    plt.tight_layout()
+    ruta = f"{output_dir}/variables_numericas.png"
+    plt.savefig(ruta, dpi=dpi, bbox_inches='tight')
+    if mostrar:
         plt.show()
+    plt.close(fig)
+    return ruta
 
-        print("\nVARIABLES NUMÉRICAS:")
-        if resultados_numericos:
-            for col, results in resultados_numericos.items():
-                status = "✓ PASS" if results['ks_pvalue'] > 0.05 else "✗ FAIL"
-                print(f"  {col}: {status} (p-value: {results['ks_pvalue']:.4f})")
-        else:
-            print("  No hay variables numéricas para validar")
+def validar_distribuciones(df_original, df_muestra, features_numericas, features_categoricas,
+                           output_dir='validacion_plots', graficar=True, mostrar=False, **kwargs_evaluacion):
+    """Valida las distribuciones: imprime el reporte de evaluar_distribuciones y opcionalmente grafica"""
+    resultados = evaluar_distribuciones(df_original, df_muestra, features_numericas, features_categoricas,
+                                        **kwargs_evaluacion)
+
+    for col, r in resultados['numericas'].iterrows():
+        print(f"\n{col.upper()}:")
+        print(f"  KS Test: statistic={r['ks_statistic']:.4f}, p-value={r['ks_pvalue']:.4f}")
+        print(f"  {'✓ Distribuciones similares' if r['pasa'] else '✗ Distribuciones diferentes'}")
+        print(f"  Wasserstein Distance: {r['wasserstein_distance']:.4f}")
+        print(f"  Diff Media: {r['diff_mean']:.4f}, Diff Std: {r['diff_std']:.4f}")
+
+    if graficar:
+        graficar_distribuciones(df_original, df_muestra, features_numericas, output_dir, mostrar=mostrar)
+
+    print("\nVARIABLES NUMÉRICAS:")
+    if len(resultados['numericas']):
+        for col, r in resultados['numericas'].iterrows():
+            status = "✓ PASS" if r['pasa'] else "✗ FAIL"
+            print(f"  {col}: {status} (p-value: {r['ks_pvalue']:.4f})")
+    else:
+        print("  No hay variables numéricas para validar")
+
+    print("\nVARIABLES CATEGÓRICAS:")
+    if len(resultados['categoricas']):
+        for col, r in resultados['categoricas'].iterrows():
+            status = "✓ PASS" if r['pasa'] else "✗ FAIL"
+            print(f"  {col}: {status} (chi2 p-value: {r['chi2_pvalue']:.4f}, TV: {r['tv_distance']:.4f})")
+    else:
+        print("  No hay variables categóricas para validar")
+
+    return resultados
 
 # TODO: dejar como test
 if __name__ == "__test__":
@@ -1,10 +1,13 @@
 import pandas as pd
+import numpy as np
 import random
 from datetime import datetime, timedelta
 import os
+import itertools
 import holidays
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Border, Side, Alignment, Font
+from escritor_excel import escribir_libro, estilo_celda
+from escenario import Escenario, abrir_escenario, ruta_escenario, completar_rankings
+from functions import RankingModel, TablaRanking, cargar_desde_pickle
 
 def generar_tasas_por_segmento():
     """Genera un diccionario de tasas predefinidas por segmento"""
@@ -13,6 +16,9 @@ def generar_tasas_por_segmento():
 # Diccionario global de tasas por segmento
 tasas_por_segmento = generar_tasas_por_segmento()
 
+# Tabla de probabilidades de ranking por tasa (se carga en el main si existen los datos)
+tabla_ranking = None
+
 # Feriados legales en Chile para el año deseado
 feriados_chile = holidays.CL(years=2025)
 
@@ -33,22 +39,27 @@ def asignar_tasa_automatica(segmento):
     """Asigna tasa automática basada en el segmento"""
     return tasas_por_segmento.get(segmento, 0.5)  # Default 0.5 si el segmento no existe
 
+def tasas_para_segmentos(segmentos):
+    """asignar_tasa_automatica para un arreglo de segmentos, con una tabla indexada por segmento"""
+    segmentos = np.asarray(segmentos, dtype=float)
+    conocidos = np.array(sorted(tasas_por_segmento), dtype=np.int64)
+    tabla = np.full(conocidos.max() + 1 if len(conocidos) else 1, 0.5)
+    tabla[conocidos] = [tasas_por_segmento[s] for s in conocidos]
+    # Igual que dict.get: sólo los segmentos definidos (3.0 sí, 3.5 no) toman su tasa
+    definido = np.isin(segmentos, conocidos)
+    return np.where(definido, tabla[np.where(definido, segmentos, 0).astype(np.int64)], 0.5)
+
+def completar_tasas(largo):
+    """Tasa por segmento en las filas con segmento y sin tasa de Escenario.largo; devuelve las celdas rellenadas"""
+    faltantes = largo['Segmento'].notna() & largo['Tasa'].isna()
+    largo.loc[faltantes, 'Tasa'] = tasas_para_segmentos(largo.loc[faltantes, 'Segmento'])
+    return faltantes
+
 def rellenar_tasas_automaticamente(df):
     """Rellena todas las tasas vacías automáticamente basado en segmento"""
-    columnas = df.columns.tolist()
-    
-    for i in range(0, len(columnas), 7):
-        segmento_col = columnas[i+3]
-        tasa_col = columnas[i+4]
-        
-        filas_con_segmento = df[segmento_col].notna()
-        
-        for fila in df[filas_con_segmento].index:
-            if pd.isna(df.at[fila, tasa_col]):
-                segmento = df.at[fila, segmento_col]
-                df.at[fila, tasa_col] = asignar_tasa_automatica(segmento)
-    
-    return df
+    escenario = Escenario.desde_ancho(df, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS)
+    completar_tasas(escenario.largo)
+    return escenario.a_ancho()
 
 def menu_relleno_tasas(df, archivo):
     print("\n🔧 OPCIONES PARA RELLENAR TASAS")
@@ -71,14 +82,14 @@ def menu_relleno_tasas(df, archivo):
             # Opción para modificar manualmente después del automático
             if input("¿Desea modificar alguna tasa manualmente? (s/n): ").lower() == 's':
                 input("✏️ Modifique las tasas en el Excel y presione Enter para continuar...")
-                df = pd.read_excel(archivo)
+                df = leer_detalle(archivo)
                 guardar_excel(df, archivo)
             
             return df
             
         elif opcion == '2':
             input("✏️ Abra el archivo Excel, rellene las tasas manualmente y presione Enter para continuar...")
-            df = pd.read_excel(archivo)
+            df = leer_detalle(archivo)
             guardar_excel(df, archivo)
             return df
             
@@ -94,7 +105,11 @@ def asignar_segmento(*args):
     return random.randint(1, 10) 
 
 def calcular_ranking(segmento: str, tasa: float) -> int:
-    """Calcula ranking basado en segmento y tasa (función de juguete)"""
+    """Calcula ranking basado en segmento y tasa.
+    Si hay tabla_ranking se sortea según sus probabilidades, si no es aleatorio (función de juguete)"""
+    if tabla_ranking is not None:
+        probs = tabla_ranking.predict_proba(tasa)[0]
+        return int(random.choices(list(tabla_ranking.rankings), weights=probs, k=1)[0])
     return random.randint(1, 10)
 
 def calcular_venta_ponderada(segmento, ranking):
@@ -103,321 +118,221 @@ def calcular_venta_ponderada(segmento, ranking):
     factor = 1.2
     return base * factor / ranking * segmento
 
+def _generador():
+    """Generador de numpy sembrado desde random, así random.seed sigue fijando los sorteos"""
+    return np.random.default_rng(random.getrandbits(64))
+
+def calcular_rankings(segmentos, tasas, rng=None):
+    """calcular_ranking para arreglos: con tabla_ranking sortea por la inversa de la acumulada, si no es aleatorio"""
+    rng = rng or _generador()
+    tasas = np.asarray(tasas, dtype=float)
+    n = len(tasas)
+    if tabla_ranking is None or n == 0:
+        return rng.integers(1, 11, n)
+    rankings = np.asarray(tabla_ranking.rankings)
+    acumulada = np.cumsum(tabla_ranking.predict_proba(tasas), axis=1)
+    u = rng.random(n) * acumulada[:, -1]
+    posicion = np.minimum((u[:, None] > acumulada).sum(axis=1), len(rankings) - 1)
+    return rankings[posicion]
+
+def ventas_ponderadas(segmentos, rankings):
+    """calcular_venta_ponderada para arreglos, redondeada a 2 decimales; con ranking 0 no hay venta"""
+    segmentos = np.asarray(segmentos, dtype=float)
+    rankings = np.asarray(rankings, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ventas = np.round(np.asarray(calcular_venta_ponderada(segmentos, rankings), dtype=float), 2)
+    ventas[rankings == 0] = np.nan
+    return ventas
+
+def completar_ventas(largo, filas):
+    """Venta ponderada de las filas indicadas de Escenario.largo; avisa las que quedan sin venta por ranking 0"""
+    ceros = filas & (largo['Ranking'] == 0)
+    if ceros.any():
+        print(f"⚠️ {int(ceros.sum())} filas con ranking igual a cero, se omite cálculo de venta.")
+    largo.loc[filas, 'Venta'] = ventas_ponderadas(largo.loc[filas, 'Segmento'], largo.loc[filas, 'Ranking'])
+    return filas
+
 def actualizar_ventas_y_resumen(path_excel):
-    """Versión corregida que solo modifica ventas en Detalle y regenera Resumen"""
+    """Completa las ventas vacías de Detalle (con segmento y ranking) y regenera Resumen.
+    Lee el escenario una vez y lo escribe una vez con guardar_excel"""
     try:
-        # 1. Cargar el archivo manteniendo el formato
-        wb = load_workbook(path_excel)
-        
-        if 'Detalle' not in wb.sheetnames:
-            raise ValueError("No se encontró la hoja 'Detalle'")
-            
-        ws_detalle = wb['Detalle']
-        
-        # 2. Procesar solo las celdas necesarias en Detalle
-        for row in ws_detalle.iter_rows(min_row=2):  # Saltar encabezados
-            # Buscar columnas relevantes en cada fila (asumiendo estructura fija)
-            for idx, cell in enumerate(row):
-                # Identificar columnas por posición relativa (cada 7 columnas)
-                if (idx % 7 == 3):  # Columna Segmento (índice 3 en cada bloque)
-                    segmento = cell.value
-                    segmento_col = cell.column
-                elif (idx % 7 == 5):  # Columna Ranking (índice 5)
-                    ranking = cell.value
-                    ranking_col = cell.column
-                elif (idx % 7 == 6):  # Columna Venta (índice 6)
-                    venta_cell = cell
-            
-            # Solo procesar si tenemos todos los datos necesarios
-            if (segmento is not None and 
-                ranking is not None and 
-                venta_cell is not None and 
-                venta_cell.value is None):
-                
-                try:
-                    if pd.notna(segmento) and pd.notna(ranking):
-                        venta = calcular_venta_ponderada(int(segmento), int(ranking))
-                        venta_cell.value = round(float(venta), 2)
-                except Exception as e:
-                    print(f"⚠️ Error en fila {row[0].row}: {str(e)}")
-                    continue
-        
-        # 3. Guardar temporalmente los cambios en Detalle
-        wb.save(path_excel)
-        
-        # 4. Actualizar hoja Resumen
-        # Cargar datos actualizados de Detalle
-        df_detalle = pd.read_excel(path_excel, sheet_name='Detalle')
-        df_resumen = generar_hoja_resumen(df_detalle)
-        
-        # Guardar solo la hoja Resumen (preservando Detalle)
-        with pd.ExcelWriter(path_excel, engine='openpyxl', mode='a') as writer:
-            writer.book = load_workbook(path_excel)
-            writer.sheets = {ws.title: ws for ws in writer.book.worksheets}
-            
-            # Eliminar hoja Resumen existente
-            if 'Resumen' in writer.book.sheetnames:
-                writer.book.remove(writer.book['Resumen'])
-            
-            # Agregar nueva hoja Resumen
-            df_resumen.to_excel(writer, sheet_name='Resumen', index=False)
-        
-        # 5. Reaplicar estilos
-        estilizar_excel(path_excel)
-        
+        escenario = abrir_escenario(path_excel, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS, hoja='Detalle')
+        largo = escenario.largo
+        completar_ventas(largo, largo['Segmento'].notna() & largo['Ranking'].notna() & largo['Venta'].isna())
+        guardar_excel(escenario.a_ancho(), path_excel)
         print("✅ Ventas asignadas y Resumen actualizado correctamente")
-    
+
     except Exception as e:
         print(f"❌ Error crítico: {str(e)}")
         raise
 
-def generar_hoja_resumen(df_detalle):
-    """Versión corregida que maneja correctamente los bloques de columnas"""
-    datos_resumen = []
-    
-    # Creamos una lista de columnas únicas temporalmente
-    columnas_unicas = [f"Col_{i}" for i in range(len(df_detalle.columns))]
-    df_temp = df_detalle.copy()
-    df_temp.columns = columnas_unicas
-    
-    # Procesar cada bloque de 7 columnas (un día)
-    for i in range(0, len(df_temp.columns), 7):
-        if i + 7 > len(df_temp.columns):
-            print(f"⚠️ Bloque incompleto en columnas {i} a {i+7}, omitiendo...")
-            continue
-            
-        cols_dia = df_temp.columns[i:i+7]
-        df_dia = df_temp[cols_dia].copy()
-        
-        # Verificar que tenemos exactamente 7 columnas
-        if len(df_dia.columns) != 7:
-            print(f"⚠️ Bloque en columnas {i} a {i+7} no tiene 7 columnas, tiene {len(df_dia.columns)}. Omitiendo...")
-            continue
-            
-        # Renombrar columnas para procesamiento
-        df_dia.columns = ['Fecha', 'Cliente', 'Cotizacion', 'Segmento', 'Tasa', 'Ranking', 'Venta']
-        
-        # Filtrar filas con clientes y segmentos válidos
-        df_dia = df_dia[
-            df_dia['Cliente'].notna() & 
-            df_dia['Segmento'].notna() & 
-            (df_dia['Segmento'] != '') & 
-            (pd.to_numeric(df_dia['Segmento'], errors='coerce') > 0)
-        ]
-        
-        if df_dia.empty:
-            continue
-            
-        # Convertir columnas numéricas de forma segura
-        df_dia['Tasa'] = pd.to_numeric(df_dia['Tasa'], errors='coerce')
-        df_dia['Ranking'] = pd.to_numeric(df_dia['Ranking'], errors='coerce')
-        df_dia['Venta'] = pd.to_numeric(df_dia['Venta'], errors='coerce')
-        
-        # Obtener la fecha real del primer elemento no nulo
-        fecha = df_dia['Fecha'].iloc[0]
-        
-        # Agrupar por segmento (omitirá automáticamente segmentos vacíos/inválidos)
-        for segmento, group in df_dia.groupby('Segmento'):
-            # Verificación adicional de segmento válido
-            if pd.isna(segmento) or segmento == '':
-                continue
-                
-            try:
-                segmento = int(segmento)
-                if segmento <= 0:
-                    continue
-            except:
-                continue
-                
-            num_cotizaciones = len(group)
-            
-            # Calcular tasa promedio con manejo seguro
-            tasa_promedio = round(group['Tasa'].mean(), 2) if not group['Tasa'].isna().all() else 0
-            
-            # Distribución de rankings con manejo seguro
-            ranking_counts = {}
-            try:
-                rankings = group['Ranking'].dropna()
-                if not rankings.empty:
-                    rankings = rankings.astype(int)
-                    ranking_counts = rankings.value_counts().to_dict()
-            except:
-                ranking_counts = {}
-            
-            # Función segura para cálculo de porcentajes
-            def calc_percent(rank):
-                count = ranking_counts.get(rank, 0)
-                return round((count / num_cotizaciones) * 100, 2) if num_cotizaciones > 0 else 0
-            
-            ranking_percent = {
-                1: calc_percent(1),
-                2: calc_percent(2),
-                3: calc_percent(3),
-                4: calc_percent(4),
-                5: calc_percent(5),
-                6: sum(calc_percent(r) for r in range(6, 11))  # Suma del 6 al 10
-            }
-            
-            # Calcular venta ponderada con manejo seguro
-            venta_ponderada = round(group['Venta'].sum(), 2) if not group['Venta'].isna().all() else 0
-            
-            # Agregar al resumen solo si hay datos válidos
-            datos_resumen.append([
-                fecha,
-                segmento,
-                num_cotizaciones,
-                tasa_promedio,
-                ranking_percent[1],
-                ranking_percent[2],
-                ranking_percent[3],
-                ranking_percent[4],
-                ranking_percent[5],
-                ranking_percent[6],
-                venta_ponderada
-            ])
-    
-    # Crear DataFrame de resumen
-    return pd.DataFrame(datos_resumen, columns=[
-        "Fecha", "Segmento", "Numero de cotizaciones", "Tasa",
-        "Ranking 1 %", "Ranking 2 %", "Ranking 3 %", "Ranking 4 %",
-        "Ranking 5 %", "Ranking 6 y más %", "Venta ponderada"
-    ])
-
-def estilizar_excel(path_excel):
-    """Aplica estilos a ambas hojas del Excel con el nuevo diseño"""
-    wb = load_workbook(path_excel)
-    
-    if 'Resumen' in wb.sheetnames:
-        ws_resumen = wb['Resumen']
-        
-        # Colores base para días alternados
-        color_dia_par = "E6F3FF"  # Azul claro
-        color_dia_impar = "E6FFE6"  # Verde claro
-        color_fila_alterna_claro = "FFFFFF"  # Blanco
-        color_fila_alterna_oscuro = "CCE5FF"  # Azul más oscuro para días azules
-        color_fila_alterna_oscuro_verde = "CCFFCC"  # Verde más oscuro para días verdes
-        
-        # Aplicar estilos a la hoja Resumen
-        thin = Side(border_style="thin", color="000000")
-        borde = Border(left=thin, right=thin, top=thin, bottom=thin)
-        
-        # Identificar cambios de día
-        fecha_actual = None
-        color_dia_actual = None
-        es_dia_par = False
-        
-        for i, row in enumerate(ws_resumen.iter_rows(), start=1):
-            # Saltar encabezados
-            if i == 1:
-                for cell in row:
-                    cell.font = Font(bold=True)
-                    cell.fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
-                    cell.border = borde
-                    cell.alignment = Alignment(horizontal="center", vertical="center")
-                continue
-            
-            # Determinar si cambió el día
-            fecha_celda = row[0].value  # Primera columna es fecha
-            if fecha_celda != fecha_actual:
-                fecha_actual = fecha_celda
-                es_dia_par = not es_dia_par
-                color_dia_actual = color_dia_par if es_dia_par else color_dia_impar
-                fila_en_dia = 0  # Reiniciar contador de filas por día
-            
-            # Alternar tonos para filas del mismo día
-            fila_en_dia += 1
-            if fila_en_dia % 2 == 1:
-                color_fila = color_dia_actual
-            else:
-                if es_dia_par:
-                    color_fila = color_fila_alterna_oscuro
-                else:
-                    color_fila = color_fila_alterna_oscuro_verde
-            
-            # Aplicar estilo a toda la fila
-            for cell in row:
-                cell.fill = PatternFill(start_color=color_fila, end_color=color_fila, fill_type="solid")
-                cell.border = borde
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        ws_resumen.freeze_panes = "A2"
-    
-    # Mantener el estilo original para la hoja Detalle
-    if 'Detalle' in wb.sheetnames:
-        ws_detalle = wb['Detalle']
-        colores_detalle = [
-            "B7E1FC", "FFCCCC", "CCFFCC", "FFFFCC",
-            "C6EFCE", "FFF2CC", "E4C6EF"
-        ] * ((len(ws_detalle[1]) + 6) // 7)  # Paréntesis cerrado correctamente
-        aplicar_estilos(ws_detalle, colores_detalle[:len(ws_detalle[1])])
-    
-
-    wb.save(path_excel)
-    print(f"✅ Excel generado correctamente con nuevo diseño: {path_excel}")
-
-def aplicar_estilos(ws, colores):
-    """Función auxiliar para aplicar estilos básicos"""
-    thin = Side(border_style="thin", color="000000")
-    borde = Border(left=thin, right=thin, top=thin, bottom=thin)
-    
-    for row in ws.iter_rows():
-        for cell in row:
-            if cell.column <= len(colores):
-                fill = PatternFill(
-                    start_color=colores[cell.column-1],
-                    end_color=colores[cell.column-1],
-                    fill_type="solid"
-                )
-                cell.fill = fill
-            
-            cell.border = borde
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            
-            if cell.row == 1:
-                cell.font = Font(bold=True)
-    
-    ws.freeze_panes = "A2"
+COLUMNAS_BLOQUE = ['Fecha', 'Cliente', 'Cotizacion', 'Segmento', 'Tasa', 'Ranking', 'Venta']
+COLUMNAS_NUMERICAS = ['Segmento', 'Tasa', 'Ranking', 'Venta']
+COLUMNAS_RESUMEN = [
+    "Fecha", "Segmento", "Numero de cotizaciones", "Tasa",
+    "Ranking 1 %", "Ranking 2 %", "Ranking 3 %", "Ranking 4 %",
+    "Ranking 5 %", "Ranking 6 y más %", "Venta ponderada"
+]
+
+def detalle_largo(df_detalle, columnas_bloque=COLUMNAS_BLOQUE):
+    """
+    Pasa la hoja Detalle (un bloque de columnas por día) a formato largo en una sola operación.
+
+    Returns:
+        pd.DataFrame: Dia (número de bloque), Fila (fila en Detalle) y las columnas del bloque
+    """
+    ancho = len(columnas_bloque)
+    n_filas = len(df_detalle)
+    n_dias = len(df_detalle.columns) // ancho
+    if len(df_detalle.columns) % ancho:
+        print(f"⚠️ Bloque incompleto en columnas {n_dias * ancho} a {(n_dias + 1) * ancho}, omitiendo...")
+
+    valores = (
+        df_detalle.iloc[:, :n_dias * ancho]
+        .to_numpy(dtype=object)
+        .reshape(n_filas, n_dias, ancho)
+        .transpose(1, 0, 2)
+        .reshape(n_dias * n_filas, ancho)
+    )
+    largo = pd.DataFrame(valores, columns=columnas_bloque)
+    largo.insert(0, 'Dia', np.repeat(np.arange(n_dias), n_filas))
+    largo.insert(1, 'Fila', np.tile(np.arange(n_filas), n_dias))
+    return largo
+
+def resumen_desde_largo(largo, con_dia=False):
+    """Resumen por día y segmento a partir de detalle_largo, con un solo groupby.
+    con_dia agrega al inicio la columna Dia (número de bloque) para poder reemplazar días sueltos"""
+    segmento = pd.to_numeric(largo['Segmento'], errors='coerce')
+    validas = (
+        largo['Cliente'].notna() &
+        largo['Segmento'].notna() &
+        (largo['Segmento'] != '') &
+        (segmento > 0)
+    )
+    d = pd.DataFrame({
+        'Dia': largo['Dia'][validas],
+        'Fecha': largo['Fecha'][validas],
+        'Segmento': segmento[validas],
+        'Tasa': pd.to_numeric(largo['Tasa'][validas], errors='coerce'),
+        'Ranking': pd.to_numeric(largo['Ranking'][validas], errors='coerce'),
+        'Venta': pd.to_numeric(largo['Venta'][validas], errors='coerce'),
+    })
+    # La fecha del día es la de su primera fila válida
+    fechas = d.drop_duplicates('Dia').set_index('Dia')['Fecha']
+
+    # Segmentos entre 0 y 1 pasan el filtro pero int(segmento) <= 0 los descarta
+    d = d[d['Segmento'] >= 1]
+    columnas = ['Dia'] + COLUMNAS_RESUMEN if con_dia else COLUMNAS_RESUMEN
+    if d.empty:
+        return pd.DataFrame([], columns=columnas)
+
+    # Indicador de cada ranking (truncado a entero): su promedio por grupo es la proporción
+    ranking = np.trunc(d['Ranking'])
+    porcentajes = {f"Ranking {r} %": ranking == r for r in range(1, 6)}
+    porcentajes["Ranking 6 y más %"] = ranking.between(6, 10)
+    d = d.assign(**porcentajes)
+
+    resumen = d.groupby(['Dia', 'Segmento'], sort=True).agg(**{
+        "Numero de cotizaciones": ('Segmento', 'size'),
+        "Tasa": ('Tasa', 'mean'),
+        **{columna: (columna, 'mean') for columna in porcentajes},
+        "Venta ponderada": ('Venta', 'sum'),
+    })
+    resumen[list(porcentajes)] *= 100
+    resumen['Tasa'] = resumen['Tasa'].fillna(0)
+    resumen = resumen.round(2).reset_index()
+    resumen['Fecha'] = fechas.loc[resumen['Dia']].to_numpy()
+    resumen['Segmento'] = resumen['Segmento'].astype(int)
+    return resumen[columnas]
 
-def guardar_excel(df_detalle, archivo):
+def generar_hoja_resumen(df_detalle):
+    """Resumen por día y segmento (cotizaciones, tasa promedio, % por ranking y venta ponderada)"""
+    return resumen_desde_largo(detalle_largo(df_detalle))
+
+# Colores de la hoja Detalle (uno por columna del bloque de 7) y de la hoja Resumen
+COLORES_DETALLE = ["B7E1FC", "FFCCCC", "CCFFCC", "FFFFCC", "C6EFCE", "FFF2CC", "E4C6EF"]
+COLORES_RESUMEN = {
+    'resumen_par': "E6F3FF",            # Azul claro
+    'resumen_par_alterna': "CCE5FF",    # Azul más oscuro para días azules
+    'resumen_impar': "E6FFE6",          # Verde claro
+    'resumen_impar_alterna': "CCFFCC",  # Verde más oscuro para días verdes
+}
+
+def estilos_libro():
+    """Estilos con nombre de las hojas Detalle y Resumen"""
+    estilos = [estilo_celda("resumen_encabezado", "D9D9D9", negrita=True)]
+    estilos += [estilo_celda(nombre, color) for nombre, color in COLORES_RESUMEN.items()]
+    for k, color in enumerate(COLORES_DETALLE):
+        estilos.append(estilo_celda(f"detalle_{k}", color))
+        estilos.append(estilo_celda(f"detalle_encabezado_{k}", color, negrita=True))
+    return estilos
+
+def estilos_detalle(n_columnas):
+    """(estilos del encabezado, estilos de cada fila) para Detalle: un color por columna del bloque"""
+    encabezado = [f"detalle_encabezado_{j % 7}" for j in range(n_columnas)]
+    fila = [f"detalle_{j % 7}" for j in range(n_columnas)]
+    return encabezado, fila
+
+def estilos_resumen(fechas):
+    """Estilo de cada fila de Resumen: el color cambia con el día y alterna tono dentro del día"""
+    estilos = []
+    fecha_actual = object()
+    es_dia_par = False
+    for fecha in fechas:
+        if fecha != fecha_actual:
+            fecha_actual = fecha
+            es_dia_par = not es_dia_par
+            fila_en_dia = 0
+        fila_en_dia += 1
+        nombre = 'resumen_par' if es_dia_par else 'resumen_impar'
+        estilos.append(nombre if fila_en_dia % 2 == 1 else f"{nombre}_alterna")
+    return estilos
+
+def escribir_excel(df_detalle, resumen_df, archivo):
+    """Escribe Detalle y Resumen ya estilizados en una sola pasada"""
+    encabezado_detalle, fila_detalle = estilos_detalle(len(df_detalle.columns))
+    fechas_resumen = [None if pd.isna(f) else f for f in resumen_df['Fecha']] if len(resumen_df) else []
+    escribir_libro(archivo, [
+        ('Detalle', df_detalle, encabezado_detalle, itertools.repeat(fila_detalle)),
+        ('Resumen', resumen_df, ['resumen_encabezado'] * len(resumen_df.columns), estilos_resumen(fechas_resumen)),
+    ], estilos_libro())
+
+def ruta_resumen(archivo):
+    """Resumen (con Dia) de la última escritura del libro, para reemplazar sólo los días que cambian"""
+    return os.path.splitext(archivo)[0] + '.resumen.parquet'
+
+def guardar_escenario(escenario, archivo, resumen=None):
+    """
+    Escribe Detalle y Resumen desde el escenario y deja escenario y Resumen como la última versión escrita.
+
+    Args:
+        resumen (pd.DataFrame, opcional): Resumen con columna Dia ya calculado (por defecto se calcula completo)
+    """
     try:
-        df_detalle = df_detalle.replace(r'^\s*$', pd.NA, regex=True)
-        resumen_df = generar_hoja_resumen(df_detalle)
-
-        archivo_existe = os.path.exists(archivo)
-
-        if archivo_existe:
-            wb = load_workbook(archivo)
-            sheets_to_remove = [name for name in ['Detalle', 'Resumen'] if name in wb.sheetnames]
-            for name in sheets_to_remove:
-                wb.remove(wb[name])
-
-            # Solo guardar si todavía hay hojas visibles
-            if wb.sheetnames:
-                wb.save(archivo)
-            else:
-                # Eliminar el archivo y recrearlo desde cero
-                wb.close()
-                os.remove(archivo)
-            mode = 'a' if os.path.exists(archivo) else 'w'
-        else:
-            mode = 'w'
-
-
-        with pd.ExcelWriter(archivo, engine='openpyxl', mode=mode) as writer:
-            df_detalle.to_excel(writer, sheet_name='Detalle', index=False)
-            resumen_df.to_excel(writer, sheet_name='Resumen', index=False)
-
-        estilizar_excel(archivo)
+        if resumen is None:
+            resumen = resumen_desde_largo(escenario.largo, con_dia=True)
+        df_detalle = escenario.a_ancho()
+        df_detalle.columns = [h for bloque in escenario.encabezados for h in bloque]
+        escribir_excel(df_detalle, resumen.drop(columns='Dia'), archivo)
+        escenario.guardar(ruta_escenario(archivo), archivo)
+        resumen.to_parquet(ruta_resumen(archivo), index=False)
         print(f"✅ Excel generado correctamente con nuevo diseño: {archivo}")
 
     except PermissionError:
         print(f"❌ Error: No se pudo guardar '{archivo}'. Cierre el archivo e intente nuevamente.")
         input("Presione Enter para continuar...")
-        guardar_excel(df_detalle, archivo)
+        guardar_escenario(escenario, archivo, resumen)
     except Exception as e:
         print(f"❌ Error inesperado: {str(e)}")
         raise
 
+def guardar_excel(df_detalle, archivo):
+    guardar_escenario(Escenario.desde_ancho(df_detalle, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS), archivo)
+
+def leer_detalle(archivo, columnas=('Tasa', 'Ranking')):
+    """Detalle desde el escenario guardado, con las columnas editables tomadas del Excel si cambió"""
+    return abrir_escenario(archivo, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS, hoja='Detalle', columnas=columnas).a_ancho()
+
 def generar_excel(desde_fecha: str, cantidad_dias: int, archivo_salida: str):
     fecha_inicio = datetime.strptime(desde_fecha, "%d-%m-%Y")
     columnas_totales = []
@@ -466,106 +381,97 @@ def generar_excel(desde_fecha: str, cantidad_dias: int, archivo_salida: str):
     print(f"✅ Excel generado correctamente como: {archivo_salida}")
 
 def procesar_rankings(df: pd.DataFrame):
-    columnas = df.columns.tolist()
-    dias_procesados = 0
-    dias_omitidos = []
-
-    for i in range(0, len(columnas), 7):  # Avanzamos de 7 en 7 columnas
-        fecha_col = columnas[i]
-        cliente_col = columnas[i+1]
-        segmento_col = columnas[i+3]
-        tasa_col = columnas[i+4]
-        ranking_col = columnas[i+5]
-
-        # Solo considerar filas donde hay cliente (ignorar filas vacías)
-        filas_con_clientes = df[cliente_col].notna()
-        
-        if not filas_con_clientes.any():
-            continue  # No hay clientes este día, saltar
-
-        tasas = df.loc[filas_con_clientes, tasa_col]
+    """Rankings faltantes de todos los días a la vez; se omiten los días con tasas incompletas"""
+    escenario = Escenario.desde_ancho(df, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS)
+    _, procesados, omitidos = completar_rankings(
+        escenario.largo, 'Cliente',
+        lambda filas: calcular_rankings(filas['Segmento'], filas['Tasa'])
+    )
 
-        if tasas.isna().any():
-            print(f"⚠️ Día {fecha_col} tiene tasas incompletas para algunos clientes. Se omite.")
-            dias_omitidos.append(fecha_col)
-            continue
-
-        for fila in df[filas_con_clientes].index:
-            if pd.notna(df.at[fila, ranking_col]):
-                continue
-            segmento = df.at[fila, segmento_col]
-            tasa = df.at[fila, tasa_col]
-            df.at[fila, ranking_col] = calcular_ranking(segmento, float(tasa))
-
-        dias_procesados += 1
+    dias_omitidos = []
+    for dia in omitidos:
+        fecha_col = escenario.encabezados[dia][0]
+        print(f"⚠️ Día {fecha_col} tiene tasas incompletas para algunos clientes. Se omite.")
+        dias_omitidos.append(fecha_col)
 
-    return df, dias_procesados, dias_omitidos
+    return escenario.a_ancho(), len(procesados), dias_omitidos
 
 def procesar_ventas_ponderadas(df: pd.DataFrame):
-    columnas = df.columns.tolist()
-    dias_calculados = 0
-
-    for i in range(0, len(columnas), 7):
-        # Validación de columnas mínimas
-        if i + 6 >= len(columnas):
-            continue
-        
-        cliente_col = columnas[i+1]
-        segmento_col = columnas[i+3]
-        ranking_col = columnas[i+5]
-        venta_col = columnas[i+6]
-
-        # Solo filas con cliente y ranking válido
-        filas_validas = df[cliente_col].notna() & df[ranking_col].notna()
-
-        for fila in df[filas_validas].index:
-            segmento = df.at[fila, segmento_col]
-            ranking = df.at[fila, ranking_col]
-            try:
-                venta = calcular_venta_ponderada(segmento, ranking)
-                df.at[fila, venta_col] = round(float(venta), 2)
-            except Exception as e:
-                print(f"❌ Error en fila {fila}: {e}")
-                df.at[fila, venta_col] = ""
-
-        dias_calculados += 1
-
-    return df, dias_calculados
+    """Recalcula la venta ponderada de todas las filas con cliente y ranking (incluye rankings editados)"""
+    escenario = Escenario.desde_ancho(df.iloc[:, :len(df.columns) // 7 * 7], COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS)
+    largo = escenario.largo
+    completar_ventas(largo, largo['Cliente'].notna() & largo['Ranking'].notna())
+    return escenario.a_ancho(), escenario.n_dias
 
 def generar_resumen(df_detalle):
-    resumen = []
+    """Resumen por día: total de cotizaciones con ranking y % por ranking"""
+    if len(df_detalle) == 0:
+        return pd.DataFrame()
+    largo = detalle_largo(df_detalle)
 
-    columnas = df_detalle.columns.tolist()
-    for i in range(0, len(columnas), 7):
-        if i + 6 >= len(columnas):
-            continue  # Saltar si el bloque está incompleto
+    validas = largo['Segmento'].notna() & largo['Ranking'].notna()
+    ranking = pd.to_numeric(largo['Ranking'], errors='coerce')
+    d = pd.DataFrame({'Dia': largo['Dia'], 'valida': validas, 'Ranking': ranking.where(validas)})
 
-        fecha_col = columnas[i]
-        segmento_col = columnas[i+3]
-        ranking_col = columnas[i+5]
+    total = d.groupby('Dia', sort=True)['valida'].sum()
+    conteos = {r: (d['Ranking'] == r).groupby(d['Dia']).sum() for r in range(1, 6)}
+    otros = (d['Ranking'] >= 6).groupby(d['Dia']).sum()
 
-        filas_validas = df_detalle[segmento_col].notna() & df_detalle[ranking_col].notna()
-        total = filas_validas.sum()
-        if total == 0:
-            continue
+    # Fecha de la primera fila del bloque
+    fechas = largo.loc[largo['Fila'] == 0].set_index('Dia')['Fecha']
 
-        conteo = df_detalle[filas_validas][ranking_col].value_counts().to_dict()
+    resumen = []
+    for dia in total.index[total > 0]:
         fila_resumen = {
-            "Fecha": df_detalle[fecha_col][0],
-            "Total Clientes": total
+            "Fecha": fechas[dia],
+            "Total Clientes": total[dia]
         }
-
         for r in range(1, 6):
-            fila_resumen[f"Ranking {r}"] = round(100 * conteo.get(r, 0) / total, 1)
-
-        # Agrupamos ranking 6 o más
-        otros = sum(v for k, v in conteo.items() if isinstance(k, (int, float)) and k >= 6)
-        fila_resumen["Ranking 6 y más %"] = round(100 * otros / total, 1)
-
+            fila_resumen[f"Ranking {r}"] = round(100 * conteos[r][dia] / total[dia], 1)
+        fila_resumen["Ranking 6 y más %"] = round(100 * otros[dia] / total[dia], 1)
         resumen.append(fila_resumen)
 
     return pd.DataFrame(resumen)
 
+def recalcular_cambios(archivo):
+    """
+    Trae las tasas y rankings editados en el Excel y recalcula sólo lo que depende de ellos:
+    la venta de las filas con ranking editado (o con ranking y sin venta) y las filas de Resumen
+    de los días tocados. Si no hay una versión escrita con qué comparar, recalcula todo.
+
+    Returns:
+        pd.DataFrame: Detalle actualizado
+    """
+    escenario = abrir_escenario(archivo, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS, hoja='Detalle')
+    largo = escenario.largo
+    con_ranking = largo['Cliente'].notna() & largo['Ranking'].notna()
+    resumen = pd.read_parquet(ruta_resumen(archivo)) if os.path.exists(ruta_resumen(archivo)) else None
+
+    if escenario.cambios is None or resumen is None:
+        completar_ventas(largo, con_ranking)
+        guardar_escenario(escenario, archivo)
+        return escenario.a_ancho()
+
+    cambios = escenario.cambios
+    editados = cambios[cambios['Columna'] == 'Ranking']
+    sucias = escenario.mascara_celdas(editados['Dia'], editados['Fila'])
+    recalcular = con_ranking & (sucias | (largo['Venta'].isna() & (largo['Ranking'] != 0)))
+    if cambios.empty and not recalcular.any():
+        print("✅ Sin cambios en tasas ni rankings, no hay nada que recalcular")
+        return escenario.a_ancho()
+
+    completar_ventas(largo, recalcular)
+    dias = np.union1d(cambios['Dia'].to_numpy(), largo.loc[recalcular, 'Dia'].to_numpy())
+    resumen = resumen[~resumen['Dia'].isin(dias)]
+    nuevo = resumen_desde_largo(largo[largo['Dia'].isin(dias)], con_dia=True)
+    if len(nuevo):
+        resumen = pd.concat([resumen, nuevo], ignore_index=True) if len(resumen) else nuevo
+    resumen = resumen.sort_values('Dia', kind='stable').reset_index(drop=True)
+
+    print(f"🔄 {len(cambios)} celdas editadas: {int(recalcular.sum())} ventas y {len(dias)} días de Resumen recalculados")
+    guardar_escenario(escenario, archivo, resumen)
+    return escenario.a_ancho()
+
 def menu_repeticion(df, archivo):
     generar_resumen(df)  # Mostrar resumen antes del menú
     
@@ -578,16 +484,14 @@ def menu_repeticion(df, archivo):
 
         if opcion == '1':
             input("✏️ Rellene las tasas en el Excel y presione Enter para continuar...")
-            df = pd.read_excel(archivo)
+            df = leer_detalle(archivo)
             df, _, _ = procesar_rankings(df)
             guardar_excel(df, archivo)
             generar_resumen(df)  # Mostrar resumen actualizado
 
         elif opcion == '2':
             input("✏️ Modifique manualmente los rankings y presione Enter para continuar...")
-            df = pd.read_excel(archivo)
-            df, _ = procesar_ventas_ponderadas(df)
-            guardar_excel(df, archivo)
+            df = recalcular_cambios(archivo)
             generar_resumen(df)  # Mostrar resumen actualizado
 
         elif opcion == '3':
@@ -597,83 +501,23 @@ def menu_repeticion(df, archivo):
             print("❌ Opción no válida. Intente de nuevo.")
 
 def rellenar_tasas_en_excel(archivo):
-    """Modifica directamente la hoja 'Detalle' del archivo Excel, rellenando tasas por segmento"""
-    wb = load_workbook(archivo)
-    
-    if "Detalle" not in wb.sheetnames:
-        print("❌ La hoja 'Detalle' no existe.")
-        return
-    
-    ws = wb["Detalle"]
-    columnas = [cell.value for cell in ws[1]]
-
-    for i in range(0, len(columnas), 7):
-        if i + 4 >= len(columnas):
-            continue
-        segmento_col = i + 4  # columna índice real (Excel es base 1)
-        tasa_col = i + 5
-
-        for fila in range(2, ws.max_row + 1):
-            segmento = ws.cell(row=fila, column=segmento_col).value
-            tasa = ws.cell(row=fila, column=tasa_col).value
-
-            if segmento is not None and tasa in (None, ""):
-                try:
-                    segmento_int = int(segmento)
-                    tasa_asignada = tasas_por_segmento.get(segmento_int, 0.5)
-                    ws.cell(row=fila, column=tasa_col).value = tasa_asignada
-                except:
-                    continue
-
-    wb.save(archivo)
-    print("✅ Tasas automáticas asignadas en la hoja Detalle.")
+    """Rellena las tasas vacías de la hoja 'Detalle' según el segmento y guarda el libro"""
+    escenario = abrir_escenario(archivo, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS, hoja='Detalle')
+    rellenadas = completar_tasas(escenario.largo)
+    df = escenario.a_ancho()
+    guardar_excel(df, archivo)
+    print(f"✅ {int(rellenadas.sum())} tasas automáticas asignadas en la hoja Detalle.")
+    return df
 
 def rellenar_ventas_ponderadas_en_excel(archivo):
-    """Modifica directamente la hoja 'Detalle' del Excel, rellenando ventas ponderadas si hay ranking y segmento válidos"""
-    from openpyxl import load_workbook
-
-    wb = load_workbook(archivo)
-
-    if "Detalle" not in wb.sheetnames:
-        print("❌ La hoja 'Detalle' no existe.")
-        return
-
-    ws = wb["Detalle"]
-    columnas = [cell.value for cell in ws[1]]
-
-    for i in range(0, len(columnas), 7):
-        if i + 6 >= len(columnas):
-            continue
-
-        segmento_col = i + 4 + 1  # Excel base 1
-        ranking_col = i + 6
-        venta_col = i + 7
-
-        for fila in range(2, ws.max_row + 1):
-            try:
-                segmento = ws.cell(row=fila, column=segmento_col).value
-                ranking = ws.cell(row=fila, column=ranking_col).value
-                venta_actual = ws.cell(row=fila, column=venta_col).value
-
-                if segmento is None or ranking is None or venta_actual not in (None, ""):
-                    continue
-
-                segmento = float(segmento)
-                ranking = float(ranking)
-
-                if ranking == 0:
-                    print(f"⚠️ Ranking igual a cero en fila {fila}, se omite cálculo de venta.")
-                    continue
-
-                venta = calcular_venta_ponderada(segmento, ranking)
-                ws.cell(row=fila, column=venta_col).value = round(float(venta), 2)
-
-            except Exception as e:
-                print(f"❌ Error en fila {fila}: {e}")
-                continue
-
-    wb.save(archivo)
+    """Rellena las ventas ponderadas vacías de la hoja 'Detalle' con ranking y segmento válidos y guarda el libro"""
+    escenario = abrir_escenario(archivo, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS, hoja='Detalle')
+    largo = escenario.largo
+    completar_ventas(largo, largo['Segmento'].notna() & largo['Ranking'].notna() & largo['Venta'].isna())
+    df = escenario.a_ancho()
+    guardar_excel(df, archivo)
     print("✅ Ventas ponderadas calculadas y asignadas directamente en hoja Detalle.")
+    return df
 
 
 # Ejemplo de uso:
@@ -682,6 +526,12 @@ if __name__ == "__main__":
 
     # Configuración inicial
     tasas_por_segmento = {segmento: round(random.uniform(0.1, 1.0), 2) for segmento in range(1, 11)}
+
+    # Modelo de ranking precalculado como tabla (si existen los datos)
+    ruta_datos = os.path.join("BBDD", "datos.pkl")
+    if os.path.exists(ruta_datos):
+        modelo_ranking = RankingModel.desde_datos(cargar_desde_pickle(ruta_datos), ruta_cache=os.path.join("BBDD", "modelo_ranking.pkl"))
+        tabla_ranking = TablaRanking(modelo_ranking, tasa_min=0.0, tasa_max=1.0)
     
     # 1. Solicitar parámetros iniciales
     print("⚙️ CONFIGURACIÓN INICIAL")
@@ -705,7 +555,7 @@ if __name__ == "__main__":
     # 2. Generar el Excel base
     print("\n⏳ Generando archivo Excel inicial...")
     generar_excel(desde, dias, archivo)
-    df = pd.read_excel(archivo)
+    df = leer_detalle(archivo)
     
     # 3. Función para rellenar tasas
     def rellenar_tasas(df, archivo):
@@ -727,25 +577,21 @@ if __name__ == "__main__":
             
             elif opcion == '2':
                 print("\n⏳ Asignando tasas automáticamente...")
-                rellenar_tasas_en_excel(archivo)
-
-                # Leer el archivo actualizado y regenerar hoja resumen
-                df = pd.read_excel(archivo, sheet_name="Detalle")
-                guardar_excel(df, archivo)  # Esto regenera hoja Resumen y re-aplica estilos
+                df = rellenar_tasas_en_excel(archivo)  # Guarda Detalle y regenera Resumen
 
                 print("✅ Tasas asignadas automáticamente y hoja Resumen actualizada.")
 
                 revisar = input("¿Desea revisar/modificar las tasas manualmente? (s/n): ").lower()
                 if revisar == 's':
                     input("✏️ Modifique las tasas en el Excel y presione Enter para continuar...")
-                    df = pd.read_excel(archivo, sheet_name="Detalle")
+                    df = leer_detalle(archivo)
                     guardar_excel(df, archivo)
                 return df, True
 
                 
             elif opcion == '3':
                 input("✏️ Abra el archivo Excel, rellene las tasas manualmente y presione Enter para continuar...")
-                df = pd.read_excel(archivo)
+                df = leer_detalle(archivo)
                 guardar_excel(df, archivo)
                 return df, True
                 
@@ -810,9 +656,7 @@ if __name__ == "__main__":
 
     # 5. Calcular ventas ponderadas
     input("✏️ Puede modificar manualmente los rankings si desea. Presione Enter para continuar...")
-    rellenar_ventas_ponderadas_en_excel(archivo)
-    df = pd.read_excel(archivo)
-    guardar_excel(df, archivo)
+    df = rellenar_ventas_ponderadas_en_excel(archivo)
 
     # 6. Verificar ventas faltantes
     while True:
@@ -838,7 +682,7 @@ if __name__ == "__main__":
             print(f"📌 Días con ventas ponderadas faltantes para algunos clientes: {vacios}")
             seguir = input("¿Desea rellenar los rankings faltantes y continuar? (s/n): ").lower()
             if seguir == 's':
-                df = pd.read_excel(archivo)
+                df = leer_detalle(archivo)
                 df, _, _ = procesar_rankings(df)
                 df, _ = procesar_ventas_ponderadas(df)
                 guardar_excel(df, archivo)
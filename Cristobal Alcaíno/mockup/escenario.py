@@ -0,0 +1,286 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow.parquet as pq
+from cache_excel import tabla_desde_pandas
+
+# Escenario de trabajo de los generadores de Excel en formato largo.
+# Los generadores arman una hoja con un bloque de columnas por día (4 en excel_gen, 7 en
+# codigo_generador_excel); acá el mismo escenario se guarda como una fila por (Dia, Fila)
+# con las columnas del bloque, en un Parquet junto al xlsx:
+#   datos_clientes.xlsx                  vista para editar a mano
+#   datos_clientes.escenario.parquet     escenario canónico (+ encabezados y estado del xlsx)
+# Al volver del Excel sólo se leen las columnas editables (Tasa, Ranking) y se comparan
+# con el escenario; si el xlsx no cambió desde la última escritura no se lee nada.
+
+def ruta_escenario(archivo):
+    """Ruta del Parquet del escenario asociado a un xlsx"""
+    return os.path.splitext(archivo)[0] + '.escenario.parquet'
+
+def _estado_archivo(ruta):
+    estado = os.stat(ruta)
+    return {'mtime': estado.st_mtime, 'tamano': estado.st_size}
+
+def _nombres_pandas(nombres):
+    """Nombres únicos como los deja pd.read_excel: el segundo 'Tasa' pasa a 'Tasa.1', etc."""
+    vistos = {}
+    unicos = []
+    for nombre in nombres:
+        k = vistos.get(nombre, 0)
+        while k > 0:
+            vistos[nombre] = k + 1
+            nombre = f"{nombre}.{k}"
+            k = vistos.get(nombre, 0)
+        vistos[nombre] = k + 1
+        unicos.append(nombre)
+    return unicos
+
+class Escenario:
+    """
+    Escenario de un generador en formato largo.
+
+    Attributes:
+        largo (pd.DataFrame): Dia, Fila y las columnas del bloque, ordenado por (Dia, Fila) y denso
+            (n_dias * n_filas filas, las celdas vacías quedan en NaN/None)
+        encabezados (list): Encabezados de las columnas de cada día, tal como van en el xlsx
+        columnas_bloque (list): Nombres genéricos de las columnas del bloque
+        columnas_numericas (list): Columnas del bloque que se guardan como float
+        n_filas (int): Filas de la hoja
+        cambios (pd.DataFrame): Celdas que cambiaron en la última sincronización con el xlsx
+            (vacío si el xlsx no se tocó; None si no se sabe, p.ej. al armarlo desde el xlsx)
+    """
+
+    def __init__(self, largo, encabezados, columnas_bloque, columnas_numericas=(), n_filas=None):
+        self.largo = largo
+        self.encabezados = [list(bloque) for bloque in encabezados]
+        self.columnas_bloque = list(columnas_bloque)
+        self.columnas_numericas = list(columnas_numericas)
+        self.n_filas = int(n_filas) if n_filas is not None else len(largo) // max(len(encabezados), 1)
+        self.estado_excel = None
+        self.cambios = None
+
+    @property
+    def n_dias(self):
+        return len(self.encabezados)
+
+    @classmethod
+    def desde_ancho(cls, df, columnas_bloque, columnas_numericas=(), encabezados=None):
+        """
+        Escenario a partir de la hoja ancha (un bloque de len(columnas_bloque) columnas por día).
+
+        Los textos vacíos pasan a NaN y las columnas numéricas a float, como quedan al leer el xlsx.
+        encabezados es la primera fila del xlsx tal cual (por defecto los nombres de columna de df,
+        que en un DataFrame leído con pd.read_excel ya vienen renombrados: 'Tasa.1', ...).
+        """
+        ancho = len(columnas_bloque)
+        n_dias = len(df.columns) // ancho
+        if len(df.columns) % ancho:
+            raise ValueError(f"La hoja tiene {len(df.columns)} columnas, no es múltiplo del bloque de {ancho}")
+        n_filas = len(df)
+
+        encabezados = list(df.columns) if encabezados is None else list(encabezados)
+        encabezados = [[str(c) for c in encabezados[j * ancho:(j + 1) * ancho]] for j in range(n_dias)]
+        df = df.replace(r'^\s*$', np.nan, regex=True)
+
+        largo = {
+            'Dia': np.repeat(np.arange(n_dias, dtype=np.int64), n_filas),
+            'Fila': np.tile(np.arange(n_filas, dtype=np.int64), n_dias),
+        }
+        for k, columna in enumerate(columnas_bloque):
+            # (n_filas, n_dias) -> día por día
+            valores = df.iloc[:, k::ancho].to_numpy(dtype=object).T.ravel()
+            if columna in columnas_numericas:
+                largo[columna] = pd.to_numeric(pd.Series(valores), errors='coerce').astype(float).to_numpy()
+            else:
+                largo[columna] = pd.Series(valores, dtype=object).where(pd.notna(valores), None).to_numpy()
+        return cls(pd.DataFrame(largo), encabezados, columnas_bloque, columnas_numericas, n_filas)
+
+    def a_ancho(self):
+        """Hoja ancha con los nombres de columna que devolvería pd.read_excel"""
+        nombres = _nombres_pandas([h for bloque in self.encabezados for h in bloque])
+        matrices = {
+            columna: self.largo[columna].to_numpy().reshape(self.n_dias, self.n_filas)
+            for columna in self.columnas_bloque
+        }
+        ancho = len(self.columnas_bloque)
+        datos = {}
+        for j in range(self.n_dias):
+            for k, columna in enumerate(self.columnas_bloque):
+                datos[nombres[j * ancho + k]] = matrices[columna][j]
+        return pd.DataFrame(datos, index=pd.RangeIndex(self.n_filas))
+
+    def guardar(self, ruta, archivo_excel=None):
+        """
+        Guarda el escenario en Parquet.
+
+        Args:
+            ruta (str): Ruta del Parquet
+            archivo_excel (str, opcional): xlsx recién escrito desde este escenario; se anota su
+                mtime y tamaño para no releerlo mientras no lo editen
+        """
+        if archivo_excel is not None:
+            self.estado_excel = _estado_archivo(archivo_excel)
+        meta = {
+            'columnas_bloque': self.columnas_bloque,
+            'columnas_numericas': self.columnas_numericas,
+            'encabezados': self.encabezados,
+            'n_filas': self.n_filas,
+            'excel': self.estado_excel,
+        }
+        tabla = tabla_desde_pandas(self.largo)
+        metadata = dict(tabla.schema.metadata or {})
+        metadata[b'escenario'] = json.dumps(meta).encode('utf-8')
+        tabla = tabla.replace_schema_metadata(metadata)
+
+        tmp = ruta + '.tmp'
+        pq.write_table(tabla, tmp)
+        os.replace(tmp, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        tabla = pq.read_table(ruta, memory_map=True)
+        meta = json.loads(tabla.schema.metadata[b'escenario'])
+        largo = tabla.to_pandas()
+        for columna in meta['columnas_numericas']:
+            largo[columna] = largo[columna].astype(float)
+        escenario = cls(largo, meta['encabezados'], meta['columnas_bloque'], meta['columnas_numericas'], meta['n_filas'])
+        escenario.estado_excel = meta['excel']
+        return escenario
+
+    def excel_modificado(self, archivo):
+        """True si el xlsx cambió (o no se sabe) desde la última vez que se escribió o sincronizó"""
+        return self.estado_excel is None or self.estado_excel != _estado_archivo(archivo)
+
+    def sincronizar_desde_excel(self, archivo, hoja=None, columnas=('Tasa', 'Ranking')):
+        """
+        Trae al escenario las ediciones hechas en el xlsx, leyendo sólo esas columnas.
+
+        Args:
+            archivo (str): Ruta del xlsx
+            hoja (str, opcional): Hoja (por defecto la primera)
+            columnas (tuple): Columnas del bloque a leer (deben ser numéricas)
+
+        Returns:
+            pd.DataFrame: Celdas que cambiaron (Dia, Fila, Columna, Anterior, Nuevo), también en self.cambios
+        """
+        ancho = len(self.columnas_bloque)
+        posiciones = [self.columnas_bloque.index(c) for c in columnas]
+        indices = [j * ancho + k for j in range(self.n_dias) for k in posiciones]
+        cambios = []
+        if indices:
+            hoja_kw = {'sheet_name': hoja} if hoja else {'sheet_id': 1}
+            # Todo como texto y luego a float: una tasa escrita como texto no invalida la columna.
+            # Sin encabezado, así la primera fila llega tal cual y no depende de cómo fastexcel
+            # renombre los encabezados repetidos
+            leido = pl.read_excel(archivo, engine='calamine', columns=indices, has_header=False,
+                                  infer_schema_length=0, **hoja_kw)
+            if leido.width != len(indices) or leido.height == 0:
+                raise ValueError(f"La hoja de '{archivo}' no tiene las columnas del escenario; regenere el Excel")
+            for i, nombre in zip(indices, leido.row(0)):
+                esperado = self.encabezados[i // ancho][i % ancho]
+                if nombre != str(esperado):
+                    raise ValueError(f"Columna {i + 1} de '{archivo}' es '{nombre}', se esperaba '{esperado}'")
+            leido = leido.slice(1)
+            if leido.height > self.n_filas:
+                raise ValueError(f"La hoja de '{archivo}' tiene {leido.height} filas y el escenario {self.n_filas}; regenere el Excel")
+
+            valores = leido.select(pl.all().cast(pl.Float64, strict=False)).to_numpy().astype(float)
+            if leido.height < self.n_filas:
+                # Filas finales vacías que calamine no devuelve
+                relleno = np.full((self.n_filas - leido.height, len(indices)), np.nan)
+                valores = np.vstack([valores, relleno])
+
+            for m, columna in enumerate(columnas):
+                # Columnas de esta variable: una por día -> orden (Dia, Fila) del formato largo
+                nuevo = valores[:, m::len(columnas)].T.ravel()
+                anterior = self.largo[columna].to_numpy()
+                distinto = ~((nuevo == anterior) | (np.isnan(nuevo) & np.isnan(anterior)))
+                if distinto.any():
+                    posicion = np.flatnonzero(distinto)
+                    cambios.append(pd.DataFrame({
+                        'Dia': self.largo['Dia'].to_numpy()[posicion],
+                        'Fila': self.largo['Fila'].to_numpy()[posicion],
+                        'Columna': columna,
+                        'Anterior': anterior[posicion],
+                        'Nuevo': nuevo[posicion],
+                    }))
+                    self.largo[columna] = nuevo
+
+        self.estado_excel = _estado_archivo(archivo)
+        self.cambios = pd.concat(cambios, ignore_index=True) if cambios else _sin_cambios()
+        return self.cambios
+
+    def mascara_celdas(self, dias, filas):
+        """Máscara sobre largo de las filas (dias[i], filas[i])"""
+        mascara = np.zeros(len(self.largo), dtype=bool)
+        mascara[np.asarray(dias, dtype=np.int64) * self.n_filas + np.asarray(filas, dtype=np.int64)] = True
+        return pd.Series(mascara, index=self.largo.index)
+
+def _sin_cambios():
+    return pd.DataFrame({
+        'Dia': pd.Series(dtype=np.int64), 'Fila': pd.Series(dtype=np.int64), 'Columna': pd.Series(dtype=object),
+        'Anterior': pd.Series(dtype=float), 'Nuevo': pd.Series(dtype=float)
+    })
+
+def abrir_escenario(archivo, columnas_bloque, columnas_numericas=(), hoja=None, columnas=('Tasa', 'Ranking')):
+    """
+    Escenario de un xlsx de los generadores, al día con lo editado en el Excel.
+
+    Usa el Parquet del escenario y sólo relee las columnas editables si el xlsx cambió; las celdas
+    editadas quedan en escenario.cambios. Si no hay escenario guardado (o es de otro formato de bloque)
+    lo arma leyendo el xlsx completo una vez (escenario.cambios queda en None).
+
+    Args:
+        archivo (str): Ruta del xlsx
+        columnas_bloque (list): Nombres genéricos de las columnas de cada bloque diario
+        columnas_numericas (list): Columnas del bloque que son números
+        hoja (str, opcional): Hoja con los bloques (por defecto la primera)
+        columnas (tuple): Columnas editables que se traen desde el Excel
+
+    Returns:
+        Escenario
+    """
+    ruta = ruta_escenario(archivo)
+    escenario = Escenario.cargar(ruta) if os.path.exists(ruta) else None
+    if escenario is None or escenario.columnas_bloque != list(columnas_bloque):
+        # Sin encabezado: se guardan los de la primera fila tal cual (sincronizar_desde_excel los
+        # compara así), no los renombrados por pandas
+        crudo = pd.read_excel(archivo, sheet_name=hoja or 0, header=None)
+        encabezados = crudo.iloc[0].tolist() if len(crudo) else []
+        df = crudo.iloc[1:].reset_index(drop=True)
+        df.columns = _nombres_pandas([str(h) for h in encabezados])
+        escenario = Escenario.desde_ancho(df, columnas_bloque, columnas_numericas, encabezados)
+        escenario.guardar(ruta, archivo)
+        return escenario
+
+    if escenario.excel_modificado(archivo):
+        escenario.sincronizar_desde_excel(archivo, hoja=hoja, columnas=columnas)
+        escenario.guardar(ruta)
+    else:
+        escenario.cambios = _sin_cambios()
+    return escenario
+
+def completar_rankings(largo, clave, calcular_rankings):
+    """
+    Rellena los rankings faltantes de todos los días de una vez.
+
+    Sólo se tocan filas ocupadas sin ranking, y se omiten los días que tengan alguna fila
+    ocupada sin tasa (igual que los generadores al recorrer día por día).
+
+    Args:
+        largo (pd.DataFrame): Escenario.largo (se modifica)
+        clave (str): Columna que marca las filas ocupadas ('Cliente', 'Perfil')
+        calcular_rankings (callable): Recibe las filas a rellenar y devuelve sus rankings
+
+    Returns:
+        tuple: (máscara de celdas rellenadas, días procesados, días omitidos)
+    """
+    ocupadas = largo[clave].notna()
+    dias = np.unique(largo.loc[ocupadas, 'Dia'])
+    omitidos = np.unique(largo.loc[ocupadas & largo['Tasa'].isna(), 'Dia'])
+    rellenar = ocupadas & largo['Ranking'].isna() & ~largo['Dia'].isin(omitidos)
+    if rellenar.any():
+        largo.loc[rellenar, 'Ranking'] = np.asarray(calcular_rankings(largo.loc[rellenar]), dtype=float)
+    return rellenar, np.setdiff1d(dias, omitidos), omitidos
@@ -0,0 +1,77 @@
+import os
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, PatternFill, Border, Side, Alignment, Font
+
+# Escritura de los libros de los generadores en una sola pasada.
+# El libro se arma en modo write-only (las filas se escriben en streaming) y cada celda
+# lleva un estilo con nombre registrado una vez en el libro, en vez de crear
+# PatternFill/Border por celda y luego reabrir el archivo para estilizarlo.
+
+def estilo_celda(nombre, color=None, negrita=False, ajustar_texto=False):
+    """Estilo con nombre: borde delgado, centrado y opcionalmente relleno y negrita"""
+    thin = Side(border_style="thin", color="000000")
+    estilo = NamedStyle(name=nombre)
+    estilo.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    estilo.alignment = Alignment(horizontal="center", vertical="center", wrap_text=ajustar_texto or None)
+    estilo.font = Font(bold=negrita)
+    if color:
+        estilo.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+    return estilo
+
+def _valores(df):
+    """Filas de df como tuplas de valores python, con None en los vacios"""
+    objetos = df.astype(object)
+    objetos = objetos.where(df.notna(), None)
+    return objetos.itertuples(index=False, name=None)
+
+def _hojas_a_conservar(archivo, nombres):
+    """Valores de las hojas de un libro existente que no se van a reescribir"""
+    if not os.path.exists(archivo):
+        return []
+    wb = load_workbook(archivo, read_only=True)
+    try:
+        return [(ws.title, list(ws.iter_rows(values_only=True))) for ws in wb.worksheets if ws.title not in nombres]
+    finally:
+        wb.close()
+
+def escribir_libro(archivo, hojas, estilos):
+    """
+    Escribe un libro completo en una pasada.
+
+    Args:
+        archivo (str): Ruta del xlsx (se reemplaza; otras hojas que tuviera se conservan como valores)
+        hojas (list): Tuplas (nombre, df, estilos_encabezado, estilos_filas)
+            estilos_encabezado: lista con el nombre de estilo de cada columna del encabezado
+            estilos_filas: iterable con, por fila, un nombre de estilo (toda la fila) o una lista por columna
+        estilos (list): NamedStyle usados por las hojas
+    """
+    nombres = [nombre for nombre, _, _, _ in hojas]
+    otras_hojas = _hojas_a_conservar(archivo, nombres)
+
+    wb = Workbook(write_only=True)
+    for estilo in estilos:
+        wb.add_named_style(estilo)
+
+    def celda(ws, valor, estilo):
+        c = WriteOnlyCell(ws, value=valor)
+        c.style = estilo
+        return c
+
+    for nombre, df, estilos_encabezado, estilos_filas in hojas:
+        ws = wb.create_sheet(nombre)
+        ws.freeze_panes = "A2"
+        ws.append([celda(ws, str(col), estilo) for col, estilo in zip(df.columns, estilos_encabezado)])
+        for valores, estilo in zip(_valores(df), estilos_filas):
+            if isinstance(estilo, str):
+                ws.append([celda(ws, v, estilo) for v in valores])
+            else:
+                ws.append([celda(ws, v, e) for v, e in zip(valores, estilo)])
+
+    for nombre, filas in otras_hojas:
+        ws = wb.create_sheet(nombre)
+        for fila in filas:
+            ws.append(fila)
+
+    wb.save(archivo)
@@ -1,10 +1,12 @@
 import pandas as pd
+import numpy as np
 import random
 from datetime import datetime, timedelta
 import os
+import itertools
 import holidays
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Border, Side, Alignment, Font
+from escritor_excel import escribir_libro, estilo_celda
+from escenario import Escenario, abrir_escenario, ruta_escenario, completar_rankings
 
 # Feriados legales en Chile para el año deseado
 feriados_chile = holidays.CL(years=2025)
@@ -27,44 +29,53 @@ def calcular_ranking(perfil, tasa):
 def calcular_venta_ponderada(perfil, ranking):
     return random.randint(50, 200)
 
-def estilizar_excel(path_excel):
-    wb = load_workbook(path_excel)
-    ws = wb.active
+def _generador():
+    """Generador de numpy sembrado desde random, así random.seed sigue fijando los sorteos"""
+    return np.random.default_rng(random.getrandbits(64))
 
-    colores = {
-        0: "B7E1FC",  # Fecha
-        1: "C6EFCE",  # Tasa
-        2: "FFF2CC",  # Ranking
-        3: "E4C6EF",  # Venta
-    }
+# Versiones por arreglo de calcular_ranking y calcular_venta_ponderada
+def calcular_rankings(perfiles, tasas):
+    return _generador().integers(1, 11, len(tasas))
 
-    thin = Side(border_style="thin", color="000000")
-    borde = Border(left=thin, right=thin, top=thin, bottom=thin)
+def calcular_ventas_ponderadas(perfiles, rankings):
+    return _generador().integers(50, 201, len(rankings))
 
-    for i, row in enumerate(ws.iter_rows(), start=1):
-        for j, cell in enumerate(row, start=1):
-            tipo = (j - 1) % 4
-            fill = PatternFill(start_color=colores[tipo], end_color=colores[tipo], fill_type="solid")
+# Columnas de cada bloque diario (la primera lleva la fecha como encabezado y el perfil como valor)
+COLUMNAS_BLOQUE = ['Perfil', 'Tasa', 'Ranking', 'Venta']
+COLUMNAS_NUMERICAS = ['Tasa', 'Ranking', 'Venta']
 
-            cell.fill = fill
-            cell.border = borde
-            cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-            if i == 1:
-                cell.font = Font(bold=True)
+# Un color por columna del bloque
+COLORES = [
+    "B7E1FC",  # Fecha
+    "C6EFCE",  # Tasa
+    "FFF2CC",  # Ranking
+    "E4C6EF",  # Venta
+]
 
-    ws.freeze_panes = "A2"
-    wb.save(path_excel)
-    print(f"🎨 Estilo aplicado a: {path_excel}")
+def estilos_libro():
+    estilos = []
+    for k, color in enumerate(COLORES):
+        estilos.append(estilo_celda(f"bloque_{k}", color, ajustar_texto=True))
+        estilos.append(estilo_celda(f"bloque_encabezado_{k}", color, negrita=True, ajustar_texto=True))
+    return estilos
 
 def guardar_excel(df, archivo):
     try:
-        df.to_excel(archivo, index=False)
-        estilizar_excel(archivo)
+        df = df.replace(r'^\s*$', pd.NA, regex=True)
+        n_columnas = len(df.columns)
+        encabezado = [f"bloque_encabezado_{j % 4}" for j in range(n_columnas)]
+        fila = [f"bloque_{j % 4}" for j in range(n_columnas)]
+        escribir_libro(archivo, [('Sheet1', df, encabezado, itertools.repeat(fila))], estilos_libro())
+        Escenario.desde_ancho(df, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS).guardar(ruta_escenario(archivo), archivo)
     except PermissionError:
         print(f"❌ No se pudo guardar el archivo '{archivo}'. Asegúrese de que no esté abierto en Excel y vuelva a intentar.")
         input("📁 Cierre el archivo y presione Enter para volver a intentar...")
         guardar_excel(df, archivo)
 
+def leer_excel(archivo):
+    """Hoja desde el escenario guardado, con las tasas y rankings tomados del Excel si cambió"""
+    return abrir_escenario(archivo, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS).a_ancho()
+
 def generar_excel(desde_fecha: str, cantidad_dias: int, archivo_salida: str):
     fecha_inicio = datetime.strptime(desde_fecha, "%d-%m-%Y")
     columnas_totales = []
@@ -96,58 +107,44 @@ def generar_excel(desde_fecha: str, cantidad_dias: int, archivo_salida: str):
     print(f"✅ Excel generado correctamente como: {archivo_salida}")
 
 def procesar_rankings(df: pd.DataFrame):
-    columnas = df.columns.tolist()
-    dias_procesados = 0
-    dias_omitidos = []
-
-    for i in range(0, len(columnas), 4):
-        perfil_col = columnas[i]
-        tasa_col = columnas[i + 1]
-        ranking_col = columnas[i + 2]
-
-        filas_validas = df[perfil_col].notna()
-        tasas = df.loc[filas_validas, tasa_col]
+    """Rankings faltantes de todos los días a la vez; se omiten los días con tasas incompletas"""
+    escenario = Escenario.desde_ancho(df, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS)
+    _, procesados, omitidos = completar_rankings(
+        escenario.largo, 'Perfil',
+        lambda filas: calcular_rankings(filas['Perfil'], filas['Tasa'])
+    )
 
-        if filas_validas.sum() == 0:
-            continue
-        if tasas.isna().sum() > 0:
-            print(f"⚠️ Día {perfil_col} tiene tasas incompletas. Se omite.")
-            dias_omitidos.append(perfil_col)
-            continue
-
-        for fila in df[filas_validas].index:
-            if pd.notna(df.at[fila, ranking_col]):
-                continue
-            perfil = df.at[fila, perfil_col]
-            tasa = df.at[fila, tasa_col]
-            df.at[fila, ranking_col] = calcular_ranking(perfil, float(tasa))
-
-        dias_procesados += 1
+    dias_omitidos = []
+    for dia in omitidos:
+        perfil_col = escenario.encabezados[dia][0]
+        print(f"⚠️ Día {perfil_col} tiene tasas incompletas. Se omite.")
+        dias_omitidos.append(perfil_col)
 
-    return df, dias_procesados, dias_omitidos
+    return escenario.a_ancho(), len(procesados), dias_omitidos
 
 def procesar_ventas_ponderadas(df: pd.DataFrame):
-    columnas = df.columns.tolist()
-    dias_calculados = 0
-
-    for i in range(0, len(columnas), 4):
-        perfil_col = columnas[i]
-        ranking_col = columnas[i + 2]
-        venta_col = columnas[i + 3]
-
-        filas_validas = df[perfil_col].notna() & df[ranking_col].notna()
-
-        if not filas_validas.any():
-            continue
-
-        for fila in df[filas_validas].index:
-            perfil = df.at[fila, perfil_col]
-            ranking = df.at[fila, ranking_col]
-            df.at[fila, venta_col] = calcular_venta_ponderada(perfil, ranking)
-
-        dias_calculados += 1
-
-    return df, dias_calculados
+    """Recalcula la venta ponderada de todas las filas con perfil y ranking (incluye rankings editados)"""
+    escenario = Escenario.desde_ancho(df, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS)
+    largo = escenario.largo
+    filas = largo['Perfil'].notna() & largo['Ranking'].notna()
+    largo.loc[filas, 'Venta'] = calcular_ventas_ponderadas(largo.loc[filas, 'Perfil'], largo.loc[filas, 'Ranking'])
+    return escenario.a_ancho(), largo.loc[filas, 'Dia'].nunique()
+
+def recalcular_cambios(archivo):
+    """Trae los rankings editados en el Excel y recalcula sólo la venta de esas filas (y de las que no tienen)"""
+    escenario = abrir_escenario(archivo, COLUMNAS_BLOQUE, COLUMNAS_NUMERICAS)
+    largo = escenario.largo
+    recalcular = largo['Perfil'].notna() & largo['Ranking'].notna()
+    if escenario.cambios is not None:
+        editados = escenario.cambios[escenario.cambios['Columna'] == 'Ranking']
+        recalcular &= escenario.mascara_celdas(editados['Dia'], editados['Fila']) | largo['Venta'].isna()
+    if not recalcular.any():
+        return escenario.a_ancho()
+
+    largo.loc[recalcular, 'Venta'] = calcular_ventas_ponderadas(largo.loc[recalcular, 'Perfil'], largo.loc[recalcular, 'Ranking'])
+    df = escenario.a_ancho()
+    guardar_excel(df, archivo)
+    return df
 
 def menu_repeticion(df, archivo):
     while True:
@@ -159,15 +156,13 @@ def menu_repeticion(df, archivo):
 
         if opcion == '1':
             input("✏️ Rellene las tasas en el Excel y presione Enter para continuar...")
-            df = pd.read_excel(archivo)
+            df = leer_excel(archivo)
             df, _, _ = procesar_rankings(df)
             guardar_excel(df, archivo)
 
         elif opcion == '2':
             input("✏️ Modifique manualmente los rankings y presione Enter para continuar...")
-            df = pd.read_excel(archivo)
-            df, _ = procesar_ventas_ponderadas(df)
-            guardar_excel(df, archivo)
+            df = recalcular_cambios(archivo)
 
         elif opcion == '3':
             print("👋 Finalizando...")
@@ -199,7 +194,7 @@ if __name__ == "__main__":
 
     while True:
         input("\n✏️ Rellene las tasas en el Excel y presione Enter para continuar...")
-        df = pd.read_excel(archivo)
+        df = leer_excel(archivo)
 
         df, procesados, omitidos = procesar_rankings(df)
         guardar_excel(df, archivo)
@@ -213,7 +208,7 @@ if __name__ == "__main__":
             break
 
     input("\n✏️ Puede modificar manualmente los rankings si desea. Presione Enter para continuar...")
-    df = pd.read_excel(archivo)
+    df = leer_excel(archivo)
 
     df, _ = procesar_ventas_ponderadas(df)
     guardar_excel(df, archivo)
@@ -230,7 +225,7 @@ if __name__ == "__main__":
             print(f"📌 Días con ventas ponderadas faltantes: {vacios}")
             seguir = input("¿Desea rellenar los rankings faltantes y continuar? (s/n): ").lower()
             if seguir == 's':
-                df = pd.read_excel(archivo)
+                df = leer_excel(archivo)
                 df, _, _ = procesar_rankings(df)
                 df, _ = procesar_ventas_ponderadas(df)
                 guardar_excel(df, archivo)
@@ -2,8 +2,11 @@ import random
 import pandas as pd
 import os
 import pickle
+import hashlib
+from collections import OrderedDict
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from joblib import Parallel, delayed
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import classification_report, confusion_matrix
@@ -12,64 +15,109 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from mpl_toolkits.mplot3d import Axes3D
 from sklearn.metrics import silhouette_score
+import polars as pl
+from cache_excel import ruta_parquet
 
 # Visualiza los clusters de segundo nivel
 # Función que simula probabilidades en función de la tasa
 #TODO: Usar los argumentos en la funcion
 
-def unir_cotizaciones(bbdd1, bbdd2, base_path='BBDD'):
-    """funcion que une 2 xlsx sobre la misma columna COTIZACIONES
-    retorna el .xlsx"""
-    ## TODO: limpiar duplicados, limpiar rechazos, limpiar invalidos
-    ## TODO: Pedirle estos archivos a NICO B. o verificar cuales son
-    # TODO: Insertar los argumentos aca
-    cotizaciones = pd.read_excel(os.path.join(base_path, bbdd1))
-    sc_cotizaciones = pd.read_excel(os.path.join(base_path, bbdd2))
-    
-    ids_con_aceptada = cotizaciones[cotizaciones['ACEPTADA']==1]['COTIZANTE'].unique()
-    cotizaciones['ACEPTADA'] = cotizaciones['ACEPTADA'].replace(-1, 1)
-
-    filtro = (
-        (cotizaciones['COTIZANTE'].isin(ids_con_aceptada)) & 
-        (cotizaciones['ACEPTADA'] == 1) &
-        (cotizaciones['TIPO_RENTA'] == "I") &
-        (cotizaciones['MODALIDAD_RENTA'] == "G")
-    ) | (
-        (~cotizaciones['COTIZANTE'].isin(ids_con_aceptada)) &
-        (cotizaciones['TIPO_RENTA'] == "I") &
-        (cotizaciones['MODALIDAD_RENTA'] == "G")
+def plan_datos_modelo(cotizaciones, sc_cotizaciones):
+    """
+    Plan lazy de polars con el cruce y filtrado de unir_cotizaciones.
+
+    Args:
+        cotizaciones (pl.LazyFrame): COTIZACIONES
+        sc_cotizaciones (pl.LazyFrame): SC_COTIZACIONES
+
+    Returns:
+        pl.LazyFrame: Cotizaciones filtradas con POSICION_RELATIVA (antes de quitar constantes)
+    """
+    # Cotizantes con alguna cotizacion aceptada (sobre todo el archivo, antes de filtrar I/G)
+    ids_con_aceptada = (
+        cotizaciones
+        .filter(pl.col('ACEPTADA') == 1)
+        .select('COTIZANTE')
+        .unique()
+        .with_columns(pl.lit(True).alias('_CON_ACEPTADA'))
     )
 
-    datos_filtrados = cotizaciones[filtro]
-    sc_cotizaciones = pd.read_excel(os.path.join(base_path, bbdd2))
-
-    datos_filtrados_con_posicion = pd.merge(
-        datos_filtrados,
-        sc_cotizaciones[['COTIZANTE', 'COTIZACION', 'POSICION_RELATIVA']],
-        on=['COTIZANTE', 'COTIZACION'],
-        how='left'
+    # Si el cotizante tiene una aceptada se quedan sólo sus aceptadas, si no todas
+    filtrados = (
+        cotizaciones
+        .filter((pl.col('TIPO_RENTA') == "I") & (pl.col('MODALIDAD_RENTA') == "G"))
+        .with_columns(pl.col('ACEPTADA').replace(-1, 1))
+        .join(ids_con_aceptada, on='COTIZANTE', how='left', maintain_order='left')
+        .filter(pl.col('_CON_ACEPTADA').is_null() | (pl.col('ACEPTADA') == 1))
+        .drop('_CON_ACEPTADA')
     )
 
-    datos_filtrados_con_posicion['POSICION_RELATIVA'] = pd.to_numeric(
-    datos_filtrados_con_posicion['POSICION_RELATIVA'],
-    errors='coerce'
+    esquema_cot = cotizaciones.collect_schema()
+    esquema_sc = sc_cotizaciones.collect_schema()
+    claves = ['COTIZANTE', 'COTIZACION']
+    posiciones = sc_cotizaciones.select(
+        [pl.col(c).cast(esquema_cot[c], strict=False) if esquema_sc[c] != esquema_cot[c] else pl.col(c) for c in claves]
+        + ['POSICION_RELATIVA']
     )
-
-    columnas_numericas = datos_filtrados_con_posicion.select_dtypes(include=np.number).columns
-    numericas = datos_filtrados_con_posicion[columnas_numericas]
-
-    aceptada_var = numericas['ACEPTADA']
-    numericas_sin_constantes = numericas.loc[:, numericas.nunique() > 1]
-
-    if 'POSICION_RELATIVA' not in numericas_sin_constantes.columns:
-        numericas_sin_constantes['POSICION_RELATIVA'] = datos_filtrados_con_posicion['POSICION_RELATIVA']
+    if esquema_sc['POSICION_RELATIVA'] == pl.String:
+        posiciones = posiciones.with_columns(pl.col('POSICION_RELATIVA').str.strip_chars().cast(pl.Float64, strict=False))
+
+    return filtrados.join(posiciones, on=claves, how='left', maintain_order='left_right')
+
+def finalizar_datos_modelo(datos):
+    """
+    Deja el resultado de plan_datos_modelo como el datos_modelo de siempre: sólo columnas
+    numericas no constantes (POSICION_RELATIVA y ACEPTADA siempre), sin nulos, en pandas
+    y con el indice de filas del cruce.
+
+    Args:
+        datos (pl.DataFrame): Resultado ya recolectado de plan_datos_modelo
+    """
+    numericas = [c for c, tipo in datos.schema.items() if tipo.is_numeric()]
+    flotantes = [c for c in numericas if datos.schema[c].is_float()]
+    datos = datos.with_columns(pl.col(flotantes).fill_nan(None))
+
+    # Una sola pasada: valores distintos (sin nulos) y nulos de cada columna
+    resumen = datos.select(
+        [pl.col(c).drop_nulls().n_unique().alias(f"{c}|unicos") for c in numericas]
+        + [pl.col(c).null_count().alias(f"{c}|nulos") for c in numericas]
+    ).row(0, named=True)
+
+    columnas = [c for c in numericas if resumen[f"{c}|unicos"] > 1]
+    if 'POSICION_RELATIVA' not in columnas:
+        columnas.append('POSICION_RELATIVA')
         print("POSICION_RELATIVA fue agregada manualmente porque fue eliminada en el filtrado.")
+    if 'ACEPTADA' not in columnas:
+        columnas.append('ACEPTADA')
+
+    # pandas pasa a float los enteros con nulos (p.ej. POSICION_RELATIVA sin cruce)
+    promover = [c for c in columnas if datos.schema[c].is_integer() and resumen[f"{c}|nulos"] > 0]
+    datos_modelo = (
+        datos
+        .with_row_index('_FILA')
+        .select(['_FILA'] + columnas)
+        .with_columns(pl.col(promover).cast(pl.Float64))
+        .drop_nulls(columnas)
+    )
 
-    if 'ACEPTADA' not in numericas_sin_constantes.columns:
-        numericas_sin_constantes['ACEPTADA'] = aceptada_var
-    datos_modelo = numericas_sin_constantes.dropna()
+    resultado = datos_modelo.drop('_FILA').to_pandas()
+    indice = datos_modelo['_FILA'].to_numpy().astype(np.int64)
+    if len(indice) == len(datos):
+        resultado.index = pd.RangeIndex(len(indice))
+    else:
+        resultado.index = pd.Index(indice)
+    return resultado
+
+def unir_cotizaciones(bbdd1, bbdd2, base_path='BBDD'):
+    """funcion que une 2 xlsx sobre la misma columna COTIZACIONES
+    retorna el datos_modelo (DataFrame)"""
+    ## TODO: limpiar duplicados, limpiar rechazos, limpiar invalidos
+    ## TODO: Pedirle estos archivos a NICO B. o verificar cuales son
+    # Cada Excel se lee una vez (cache Parquet de leer_excel) y el resto es un plan lazy de polars
+    cotizaciones = pl.scan_parquet(ruta_parquet(os.path.join(base_path, bbdd1)))
+    sc_cotizaciones = pl.scan_parquet(ruta_parquet(os.path.join(base_path, bbdd2)))
     ## hey en vola podria retornar el pickle
-    return datos_modelo
+    return finalizar_datos_modelo(plan_datos_modelo(cotizaciones, sc_cotizaciones).collect())
 
 def guardar_como_picke(objeto, ruta):
     with open(ruta, 'wb') as f:
@@ -93,57 +141,296 @@ def estimar_probabilidades_ranking(tasa):
         probs.append(weight / total_weight)
     return probs
 
+class RankingModel:
+    """Regresion logistica multinomial TASA_VENTA -> POSICION_RELATIVA que se ajusta una sola vez.
+    Se guarda junto al hash de los datos de entrenamiento para no reajustar si los datos no cambian"""
+
+    def __init__(self):
+        self.modelo = None
+        self.rankings = None
+        self.hash_datos = None
+        self.rango_tasas = None
+
+    @staticmethod
+    def calcular_hash(datos_modelo):
+        """Hash del contenido de las columnas usadas para entrenar"""
+        if 'POSICION_RELATIVA' not in datos_modelo.columns:
+            raise ValueError("Los datos no contienen la columna 'POSICION_RELATIVA'")
+        if 'TASA_VENTA' not in datos_modelo.columns:
+            raise ValueError("Los datos no contienen la columna 'tasa'")
+        columnas = datos_modelo[['TASA_VENTA', 'POSICION_RELATIVA']]
+        return hashlib.sha1(pd.util.hash_pandas_object(columnas, index=False).values.tobytes()).hexdigest()
+
+    def fit(self, datos_modelo):
+        self.hash_datos = self.calcular_hash(datos_modelo)
+        X = datos_modelo[['TASA_VENTA']].values
+        y = datos_modelo['POSICION_RELATIVA'].values
+
+        self.modelo = LogisticRegression(multi_class='multinomial', solver='lbfgs', max_iter=1000)
+        self.modelo.fit(X, y)
+        self.rankings = self.modelo.classes_
+        self.rango_tasas = (float(X.min()), float(X.max()))
+        return self
+
+    def predict_proba(self, tasas):
+        """tasas: float o array de n tasas
+        Retorna array (n, n_rankings) con la probabilidad de cada ranking (columnas en self.rankings)"""
+        tasas = np.asarray(tasas, dtype=float).reshape(-1)
+        if len(self.rankings) <= 2:
+            return self.modelo.predict_proba(tasas[:, None])
+        # softmax directo con los coeficientes, sin el overhead de sklearn por llamada
+        z = tasas[:, None] * self.modelo.coef_[:, 0] + self.modelo.intercept_
+        z -= z.max(axis=1, keepdims=True)
+        np.exp(z, out=z)
+        z /= z.sum(axis=1, keepdims=True)
+        return z
+
+    def probabilidades(self, tasa):
+        """Mismo formato que estimar_probabilidades_ranking_v2: lista de (ranking, prob)"""
+        return list(zip(self.rankings, self.predict_proba(tasa)[0]))
+
+    def guardar(self, ruta):
+        guardar_como_picke(self, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        return cargar_desde_pickle(ruta)
+
+    @classmethod
+    def desde_datos(cls, datos_modelo, ruta_cache=None):
+        """Carga el modelo desde ruta_cache si fue entrenado con los mismos datos, si no lo ajusta y lo guarda"""
+        hash_datos = cls.calcular_hash(datos_modelo)
+        if ruta_cache and os.path.exists(ruta_cache):
+            modelo = cls.cargar(ruta_cache)
+            if getattr(modelo, 'hash_datos', None) == hash_datos:
+                return modelo
+        modelo = cls().fit(datos_modelo)
+        if ruta_cache:
+            modelo.guardar(ruta_cache)
+        return modelo
+
+class TablaRanking:
+    """Tabla precalculada de probabilidades de ranking sobre una grilla densa de TASA_VENTA.
+    Consultar es una interpolacion lineal (tiempo constante) con error acotado respecto
+    al modelo exacto (RankingModel / estimar_probabilidades_ranking_v2).
+
+    Cota: las probabilidades son un softmax de w_k * tasa + b_k, luego |p_k''| <= (max w - min w)^2
+    y el error de interpolar linealmente con paso h es a lo mas h^2 * (max w - min w)^2 / 8"""
+
+    def __init__(self, modelo, tasa_min=None, tasa_max=None, tolerancia=1e-4, n_puntos=None):
+        """modelo: RankingModel ajustado
+        tasa_min, tasa_max: rango de la grilla (por defecto el rango de tasas de entrenamiento)
+        tolerancia: error maximo permitido, define el paso de la grilla
+        n_puntos: fija el numero de puntos de la grilla (la cota se calcula a partir de el)"""
+        rango = getattr(modelo, 'rango_tasas', None) or (0.0, 1.0)
+        self.tasa_min = rango[0] if tasa_min is None else tasa_min
+        self.tasa_max = rango[1] if tasa_max is None else tasa_max
+        if self.tasa_max <= self.tasa_min:
+            raise ValueError("tasa_max debe ser mayor que tasa_min")
+
+        self.modelo = modelo
+        self.rankings = modelo.rankings
+        pesos = modelo.modelo.coef_[:, 0]
+        # Con 2 rankings el multinomial es softmax([-d, d]): pesos efectivos -w y w
+        amplitud = 2 * abs(pesos[0]) if len(pesos) == 1 else pesos.max() - pesos.min()
+
+        ancho = self.tasa_max - self.tasa_min
+        if n_puntos is None:
+            if amplitud == 0:
+                n_puntos = 2
+            else:
+                paso = np.sqrt(8 * tolerancia) / amplitud
+                n_puntos = int(np.ceil(ancho / paso)) + 1
+        n_puntos = max(int(n_puntos), 2)
+
+        self.tasas = np.linspace(self.tasa_min, self.tasa_max, n_puntos)
+        self.paso = self.tasas[1] - self.tasas[0]
+        self.probs = modelo.predict_proba(self.tasas)
+        self.cota_error = self.paso ** 2 * amplitud ** 2 / 8
+
+    def predict_proba(self, tasas):
+        """Igual que RankingModel.predict_proba pero interpolando en la tabla.
+        Tasas fuera de la grilla se calculan con el modelo exacto"""
+        tasas = np.asarray(tasas, dtype=float).reshape(-1)
+        posicion = (tasas - self.tasa_min) / self.paso
+        dentro = (posicion >= 0) & (posicion <= len(self.tasas) - 1)
+
+        i = np.clip(np.floor(posicion), 0, len(self.tasas) - 2).astype(int)
+        frac = np.clip(posicion - i, 0, 1)[:, None]
+        resultado = (1 - frac) * self.probs[i] + frac * self.probs[i + 1]
+        if not dentro.all():
+            resultado[~dentro] = self.modelo.predict_proba(tasas[~dentro])
+        return resultado
+
+    def probabilidades(self, tasa):
+        """Mismo formato que estimar_probabilidades_ranking_v2: lista de (ranking, prob)"""
+        return list(zip(self.rankings, self.predict_proba(tasa)[0]))
+
+    def error_observado(self):
+        """Error maximo contra el modelo exacto en los puntos medios de la grilla (donde es mayor)"""
+        medios = (self.tasas[:-1] + self.tasas[1:]) / 2
+        return np.abs(self.predict_proba(medios) - self.modelo.predict_proba(medios)).max()
+
+    def guardar(self, ruta):
+        guardar_como_picke(self, ruta)
+
+def construir_tablas_por_segmento(datos_modelo, columna_segmento, tolerancia=1e-4, ruta_cache=None):
+    """Una TablaRanking por segmento (ajusta un RankingModel con las filas de cada segmento)
+    retorna dict segmento -> TablaRanking"""
+    tablas = {}
+    for segmento, datos_segmento in datos_modelo.groupby(columna_segmento):
+        if datos_segmento['POSICION_RELATIVA'].nunique() < 2:
+            print(f"Segmento {segmento} tiene un solo ranking, se omite")
+            continue
+        modelo = RankingModel().fit(datos_segmento)
+        tablas[segmento] = TablaRanking(modelo, tolerancia=tolerancia)
+    if ruta_cache:
+        guardar_como_picke(tablas, ruta_cache)
+    return tablas
+
+# Ultimos modelos ajustados en esta sesion, por hash de los datos (LRU acotado)
+_MAX_MODELOS_RANKING = 8
+_modelos_ranking = OrderedDict()
+
 # TODO: Revisar este codigo
 def estimar_probabilidades_ranking_v2(tasa, datos_modelo):
     """Dado una tasa devuelve el ranking probable
-    el ranking probable se calcula mediante una regresion logistica usando datos_modelo"""
-    probs = []
-    if 'POSICION_RELATIVA' not in datos_modelo.columns:
-        raise ValueError("Los datos no contienen la columna 'POSICION_RELATIVA'")
-    if 'TASA_VENTA' not in datos_modelo.columns:
-        raise ValueError("Los datos no contienen la columna 'tasa'")
-    X = datos_modelo[['TASA_VENTA']].values
-    y = datos_modelo['POSICION_RELATIVA'].values
-
-    model = LogisticRegression(multi_class='multinomial', solver='lbfgs', max_iter=1000)
-    model.fit(X, y)
-    probabilidades = model.predict_proba([[tasa]])[0]
-    rankings_unicos = np.sort(np.unique(y))
-    probs = [(ranking, prob) for ranking, prob in zip(rankings_unicos, probabilidades)]
-    probs.sort(key=lambda x: x[0])
-
-    return probs 
-
-def clusterizacion_jerarquica(datos, n_cluster_nivel1 =3, n_clusters_nivel2=2):
-    """Cluster a 2 niveles
-    Args: datos pre procesados, n clusters 1 int, n clusters 2 int"""
-    # Por tasa y ranking
+    el ranking probable se calcula mediante una regresion logistica usando datos_modelo
+    El modelo se ajusta una vez por cada datos_modelo distinto (ver RankingModel)"""
+    hash_datos = RankingModel.calcular_hash(datos_modelo)
+    modelo = _modelos_ranking.pop(hash_datos, None)
+    if modelo is None:
+        modelo = RankingModel().fit(datos_modelo)
+    _modelos_ranking[hash_datos] = modelo
+    while len(_modelos_ranking) > _MAX_MODELOS_RANKING:
+        _modelos_ranking.popitem(last=False)
+    return modelo.probabilidades(tasa)
+
+FEATURES_CLUSTER = ['TASA_VENTA', 'POSICION_RELATIVA']
+
+def _kmeans(n_clusters, n_filas, umbral_minibatch, tamano_lote, **kwargs):
+    """KMeans normal, o MiniBatchKMeans si hay mas de umbral_minibatch filas"""
+    if umbral_minibatch is not None and n_filas > umbral_minibatch:
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=tamano_lote, n_init='auto')
+    return KMeans(n_clusters=n_clusters, random_state=42, **kwargs)
+
+def _ajustar_nivel2(datos_cluster, n_clusters_nivel2, umbral_minibatch, tamano_lote):
+    """Ajusta el segundo nivel dentro de un cluster; None si tiene muy pocas filas"""
+    if len(datos_cluster) <= n_clusters_nivel2:
+        return None, np.zeros(len(datos_cluster), dtype=np.int64)
+    modelo = _kmeans(n_clusters_nivel2, len(datos_cluster), umbral_minibatch, tamano_lote, n_init=1)
+    return modelo, modelo.fit_predict(datos_cluster)
+
+class ModeloClusters:
+    """Clusters a 2 niveles ajustados: scaler, KMeans de nivel 1 y un KMeans de nivel 2 por cluster"""
+
+    def __init__(self, scaler, kmeans_nivel1, kmeans_nivel2, features=FEATURES_CLUSTER):
+        self.scaler = scaler
+        self.kmeans_nivel1 = kmeans_nivel1
+        self.kmeans_nivel2 = kmeans_nivel2  # lista, None si el cluster no se subdividio
+        self.features = list(features)
+
+    def predecir(self, datos):
+        """(cluster_nivel1, cluster_nivel2) de cotizaciones nuevas sin reajustar"""
+        X = self.scaler.transform(datos[self.features] if isinstance(datos, pd.DataFrame) else np.asarray(datos, dtype=float))
+        nivel1 = self.kmeans_nivel1.predict(X).astype(np.int64)
+        nivel2 = np.zeros(len(X), dtype=np.int64)
+        for cluster_id, modelo in enumerate(self.kmeans_nivel2):
+            filas = np.flatnonzero(nivel1 == cluster_id)
+            if modelo is not None and len(filas):
+                nivel2[filas] = modelo.predict(X[filas])
+        return nivel1, nivel2
+
+    def guardar(self, ruta):
+        guardar_como_picke(self, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        return cargar_desde_pickle(ruta)
+
+class ClusterAssigner:
+    """
+    Asignacion de (cluster_nivel1, cluster_nivel2) a cotizaciones nuevas con centroides precalculados.
+
+    Equivale a ModeloClusters.predecir (centroide mas cercano en el espacio escalado) pero
+    sin pasar por sklearn: los centroides de nivel 2 se guardan en un arreglo
+    (clusters nivel 1 x clusters nivel 2 x features) relleno con inf donde no hay centroide,
+    y todo el lote se resuelve con dos argmin.
+    """
+
+    def __init__(self, modelo):
+        if isinstance(modelo, str):
+            modelo = ModeloClusters.cargar(modelo)
+        self.features = modelo.features
+        self.media = np.asarray(modelo.scaler.mean_, dtype=float)
+        self.escala = np.asarray(modelo.scaler.scale_, dtype=float)
+        self.centroides1 = np.asarray(modelo.kmeans_nivel1.cluster_centers_, dtype=float)
+
+        k1, n_features = self.centroides1.shape
+        k2 = max([m.n_clusters for m in modelo.kmeans_nivel2 if m is not None] + [1])
+        self.centroides2 = np.full((k1, k2, n_features), np.inf)
+        for cluster_id, m in enumerate(modelo.kmeans_nivel2):
+            if m is None:
+                # cluster sin subdividir: siempre nivel 2 = 0
+                self.centroides2[cluster_id, 0] = 0.0
+            else:
+                self.centroides2[cluster_id, :m.n_clusters] = m.cluster_centers_
+
+    def asignar(self, tasas, posiciones):
+        """Etiquetas para arreglos de TASA_VENTA y POSICION_RELATIVA; devuelve (nivel1, nivel2)"""
+        X = (np.column_stack([np.asarray(tasas, dtype=float).reshape(-1),
+                              np.asarray(posiciones, dtype=float).reshape(-1)]) - self.media) / self.escala
+        nivel1 = ((X[:, None, :] - self.centroides1[None]) ** 2).sum(axis=2).argmin(axis=1)
+        nivel2 = ((X[:, None, :] - self.centroides2[nivel1]) ** 2).sum(axis=2).argmin(axis=1)
+        return nivel1, nivel2
+
+    def asignar_df(self, datos):
+        return self.asignar(datos[self.features[0]].to_numpy(), datos[self.features[1]].to_numpy())
+
+    def asignar_uno(self, tasa, posicion):
+        """Una sola cotizacion (para llamar por cliente en el simulador)"""
+        x = (np.array([tasa, posicion], dtype=float) - self.media) / self.escala
+        n1 = int(((self.centroides1 - x) ** 2).sum(axis=1).argmin())
+        n2 = int(((self.centroides2[n1] - x) ** 2).sum(axis=1).argmin())
+        return n1, n2
+
+def ajustar_modelo_clusters(datos, n_cluster_nivel1=3, n_clusters_nivel2=2, umbral_minibatch=200000,
+                            tamano_lote=4096, n_jobs=None):
+    """
+    Ajusta los clusters a 2 niveles sin modificar datos.
+
+    Los ajustes de nivel 2 son independientes entre clusters y corren en paralelo (hilos,
+    KMeans libera el GIL). Sobre umbral_minibatch filas se usa MiniBatchKMeans.
+
+    Returns:
+        tuple: (ModeloClusters, etiquetas nivel 1, etiquetas nivel 2) con las etiquetas como arreglos int
+    """
     scaler_n1 = StandardScaler()
-    features_n1 = datos[['TASA_VENTA', 'POSICION_RELATIVA']]
-    features_n1_scaled = scaler_n1.fit_transform(features_n1)
-
-    kmeans_nivel1 = KMeans(
-        n_clusters=n_cluster_nivel1,
-        random_state=42,
-        init='k-means++',
-        n_init='auto'
+    features_n1_scaled = scaler_n1.fit_transform(datos[FEATURES_CLUSTER])
+
+    kmeans_nivel1 = _kmeans(n_cluster_nivel1, len(datos), umbral_minibatch, tamano_lote, init='k-means++', n_init='auto')
+    nivel1 = kmeans_nivel1.fit_predict(features_n1_scaled).astype(np.int64)
+
+    filas_por_cluster = [np.flatnonzero(nivel1 == cluster_id) for cluster_id in range(n_cluster_nivel1)]
+    ajustes = Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(_ajustar_nivel2)(features_n1_scaled[filas], n_clusters_nivel2, umbral_minibatch, tamano_lote)
+        for filas in filas_por_cluster
     )
-    datos['cluster_nivel1'] = kmeans_nivel1.fit_predict(features_n1_scaled)
-    cluster_n2_labels = np.zeros(len(datos), dtype=int)*-1
-    for cluster_id in range(n_cluster_nivel1):
-        mask = (datos['cluster_nivel1'] == cluster_id)
-        cluster_data = features_n1_scaled[mask]
-        if len(cluster_data) > n_clusters_nivel2:
-            kmeans_nivel2 = KMeans(
-                n_clusters=n_clusters_nivel2,
-                random_state=42,
-                n_init=1
-            )
-            datos.loc[mask, 'cluster_nivel2'] = kmeans_nivel2.fit_predict(cluster_data)
-        else:
-            datos.loc[mask, 'cluster_nivel2'] = 0
 
-    return datos
+    nivel2 = np.zeros(len(datos), dtype=np.int64)
+    for filas, (_, etiquetas) in zip(filas_por_cluster, ajustes):
+        nivel2[filas] = etiquetas
+
+    modelo = ModeloClusters(scaler_n1, kmeans_nivel1, [m for m, _ in ajustes])
+    return modelo, nivel1, nivel2
+
+def clusterizacion_jerarquica(datos, n_cluster_nivel1 =3, n_clusters_nivel2=2, **kwargs):
+    """Cluster a 2 niveles
+    Args: datos pre procesados, n clusters 1 int, n clusters 2 int
+    Devuelve una copia de datos con cluster_nivel1 y cluster_nivel2 (datos no se modifica);
+    para guardar el modelo usar ajustar_modelo_clusters"""
+    _, nivel1, nivel2 = ajustar_modelo_clusters(datos, n_cluster_nivel1, n_clusters_nivel2, **kwargs)
+    return datos.assign(cluster_nivel1=nivel1, cluster_nivel2=nivel2)
 
 # Esta funcion sera utilizada solo en las presentaciones o para probar el archivo
 # No es importante
@@ -240,11 +527,12 @@ def generar_perfil_cliente(tipos_cliente, niveles_riesgo):
 if __name__ == "__test__":
     print('clusterizando')
     datos = cargar_desde_pickle(os.path.join('BBDD')+"/datos.pkl")
-    datos_clusterizados = clusterizacion_jerarquica(
+    modelo_cluster, nivel1, nivel2 = ajustar_modelo_clusters(
         datos,
         n_cluster_nivel1=4,
         n_clusters_nivel2=2
     )
+    datos_clusterizados = datos.assign(cluster_nivel1=nivel1, cluster_nivel2=nivel2)
 
     print('visualizando')
     #vis_clus(datos_clusterizados, nivel=1, sample_size=2000, random_state=42)
@@ -256,8 +544,7 @@ if __name__ == "__test__":
     datos_clusterizados.to_csv("BBDD/cluster.csv", index=False)
 
     print('guardando como pickle')
-    # TODO: Corregir esto
-    #guardar_como_picke((datos_clusterizados, modelo_n1, modelo_n2), "BBDD/modelos_cluster.pkl")
+    modelo_cluster.guardar("BBDD/modelos_cluster.pkl")
 
     print('Success')
 
@@ -0,0 +1,109 @@
+import os
+import re
+import datetime
+import polars as pl
+from cache_excel import ruta_parquet, _leer_manifiesto, _guardar_manifiesto
+from functions import plan_datos_modelo, finalizar_datos_modelo, guardar_como_picke
+
+# Carga mensual de COTIZACIONES_<AAAAMM>.xlsx + SC_COTIZACIONES_<AAAAMM>.xlsx.
+# Cada mes se cruza y filtra por separado (plan_datos_modelo, igual que en los scripts R
+# que trabajan mes a mes) y queda en su propia particion:
+#   BBDD/datos_modelo/mes=AAAAMM/datos.parquet
+#   BBDD/datos_modelo/manifiesto.json   meses cargados y sus archivos de origen
+# Agregar un mes sólo lee y escribe ese mes. Quitar constantes y nulos se hace al cargar,
+# sobre los meses pedidos, con finalizar_datos_modelo.
+
+def _validar_mes(mes):
+    mes = str(mes)
+    if not re.fullmatch(r"\d{6}", mes):
+        raise ValueError(f"Mes invalido (se espera AAAAMM): {mes}")
+    return mes
+
+def meses_cargados(dataset_dir='BBDD/datos_modelo'):
+    """Meses ya cargados (ordenados)"""
+    return sorted(_leer_manifiesto(dataset_dir).keys())
+
+def agregar_mes(mes, base_path='BBDD', dataset_dir=None, bbdd1=None, bbdd2=None, forzar=False):
+    """
+    Agrega un mes al dataset particionado.
+
+    Args:
+        mes (str o int): Mes AAAAMM
+        base_path (str): Carpeta de los Excel
+        dataset_dir (str, opcional): Carpeta del dataset (por defecto BBDD/datos_modelo)
+        bbdd1, bbdd2 (str, opcional): Nombres de los Excel (por defecto COTIZACIONES_<mes>.xlsx y SC_COTIZACIONES_<mes>.xlsx)
+        forzar (bool): Recargar aunque el mes ya este en el manifiesto
+
+    Returns:
+        bool: True si se cargo el mes, False si ya estaba
+    """
+    mes = _validar_mes(mes)
+    dataset_dir = dataset_dir or os.path.join(base_path, 'datos_modelo')
+    os.makedirs(dataset_dir, exist_ok=True)
+    manifiesto = _leer_manifiesto(dataset_dir)
+    if mes in manifiesto and not forzar:
+        return False
+
+    ruta_cot = os.path.join(base_path, bbdd1 or f"COTIZACIONES_{mes}.xlsx")
+    ruta_sc = os.path.join(base_path, bbdd2 or f"SC_COTIZACIONES_{mes}.xlsx")
+    datos = plan_datos_modelo(
+        pl.scan_parquet(ruta_parquet(ruta_cot)),
+        pl.scan_parquet(ruta_parquet(ruta_sc))
+    ).collect()
+
+    particion = os.path.join(dataset_dir, f"mes={mes}")
+    os.makedirs(particion, exist_ok=True)
+    destino = os.path.join(particion, 'datos.parquet')
+    tmp = destino + '.tmp'
+    datos.write_parquet(tmp)
+    os.replace(tmp, destino)
+
+    manifiesto[mes] = {
+        # relativa a dataset_dir, asi el dataset se puede mover o leer desde otra carpeta
+        'parquet': os.path.relpath(destino, dataset_dir),
+        'cotizaciones': os.path.abspath(ruta_cot),
+        'sc_cotizaciones': os.path.abspath(ruta_sc),
+        'filas': datos.height,
+        'cargado': datetime.datetime.now().isoformat(timespec='seconds')
+    }
+    _guardar_manifiesto(dataset_dir, manifiesto)
+    return True
+
+def cargar_datos_modelo(dataset_dir='BBDD/datos_modelo', meses=None):
+    """
+    datos_modelo (como unir_cotizaciones) a partir de los meses cargados.
+
+    Args:
+        meses (list, opcional): Meses AAAAMM a usar (por defecto todos)
+    """
+    manifiesto = _leer_manifiesto(dataset_dir)
+    meses = sorted(manifiesto) if meses is None else [_validar_mes(m) for m in meses]
+    faltan = [m for m in meses if m not in manifiesto]
+    if faltan:
+        raise ValueError(f"Meses no cargados: {faltan}")
+    if not meses:
+        raise ValueError(f"No hay meses cargados en {dataset_dir}")
+
+    # diagonal_relaxed: tolera columnas nuevas o tipos que cambian entre meses
+    datos = pl.concat(
+        [pl.scan_parquet(os.path.join(dataset_dir, manifiesto[m]['parquet'])) for m in meses],
+        how='diagonal_relaxed'
+    ).collect()
+    return finalizar_datos_modelo(datos)
+
+def actualizar_datos_pkl(meses_nuevos, base_path='BBDD', ruta_pickle=None):
+    """Carga los meses que falten y regenera BBDD/datos.pkl desde el dataset (sin releer Excel viejos)"""
+    dataset_dir = os.path.join(base_path, 'datos_modelo')
+    for mes in meses_nuevos:
+        if agregar_mes(mes, base_path=base_path, dataset_dir=dataset_dir):
+            print(f"Mes {mes} cargado")
+        else:
+            print(f"Mes {mes} ya estaba cargado")
+    datos = cargar_datos_modelo(dataset_dir)
+    guardar_como_picke(datos, ruta_pickle or os.path.join(base_path, 'datos.pkl'))
+    return datos
+
+if __name__ == "__main__":
+    datos = actualizar_datos_pkl(['202404'])
+    print(f"Meses cargados: {meses_cargados('BBDD/datos_modelo')}")
+    print(datos.shape)
@@ -1,10 +1,10 @@
 import random
 from collections import Counter
-from functions import estimar_probabilidades_ranking_v2
+from functions import RankingModel, TablaRanking
 from functions import generar_perfil_cliente, estimar_probabilidades_ranking, ajustar_probs_por_perfil
 from clientes_dist import samplear_distribucion
 from parametros import dias_del_mes, ranking_acumulado_mes, ventas_acumuladas, clientes_totales, rankings_totales
-from modelo_ces import cargar_datos, predict_auto_arima
+from modelo_ces import cargar_datos, CacheArima
 from functions import cargar_desde_pickle
 
 # PARAMETROS
@@ -15,7 +15,13 @@ niveles_riesgo = ["bajo", "medio", "alto"]
 # Generacion del excel
 base_path = "BBDD"
 serie = cargar_datos(base_path)
-forecast = predict_auto_arima(serie, n_steps=14)
+# Un solo ajuste del ARIMA para todo el mes (queda en cache por si la serie no cambia)
+cache_arima = CacheArima(ruta=base_path+"/cache_arima.pkl")
+forecast = cache_arima.pronosticar(serie, n_steps=len(dias_del_mes))
+# Modelo de ranking: se ajusta una vez (o se carga si datos.pkl no cambio)
+modelo_ranking = RankingModel.desde_datos(cargar_desde_pickle(base_path+"/datos.pkl"), ruta_cache=base_path+"/modelo_ranking.pkl")
+# Tabla precalculada: cada cambio de tasa es una interpolacion, no una evaluacion del modelo
+tabla_ranking = TablaRanking(modelo_ranking)
 
 for dia in dias_del_mes:
     print(f"\n🗓️ Día {dia}")
@@ -26,8 +32,7 @@ for dia in dias_del_mes:
     # Hacer una clusterizacion de los clientes
     # En vola un cliente se puede modelar como una clase con id, tipo y nivel de riesgo
 
-    forecast = predict_auto_arima(serie, n_steps=dia)
-    n_clientes = int(forecast.iloc[0])
+    n_clientes = int(forecast.iloc[dia - 1])
     #n_clientes = random.randint(5, 6)
     #print(f"📌 Clientes esperados hoy: {n_clientes}\n")
     
@@ -49,7 +54,7 @@ for dia in dias_del_mes:
     while True:
 
         # TODO: Incluir sugerencia de estimar_probabilidades_ranking_v2
-        probs_base = estimar_probabilidades_ranking_v2(tasa, cargar_desde_pickle(base_path+"/datos.pkl"))
+        probs_base = tabla_ranking.probabilidades(tasa)
         print('Sugerencia')
         # Hasta aca funciona
         # TODO: Incluir input de ajuste manual si es necesario
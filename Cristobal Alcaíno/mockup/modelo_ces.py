@@ -4,9 +4,14 @@ import matplotlib.pyplot as plt
 from pmdarima import auto_arima
 import os
 import pickle
-from collections import defaultdict
+import hashlib
+from collections import defaultdict, OrderedDict
 import time
+import multiprocessing
+from multiprocessing.connection import wait
 import polars as pl
+from cache_excel import leer_excel
+from almacen_series import AlmacenSeries, almacen_desde_conteos, almacen_desde_ancho
 
 def cargar_datos(base_path):
     # Rutas a los archivos
@@ -14,8 +19,8 @@ def cargar_datos(base_path):
     file_2023 = os.path.join(base_path, "SCOMP_MERCADO_2024.xlsx")
     
     # Leer las hojas correspondientes
-    df_2024 = pd.read_excel(file_2024, sheet_name="CES ING POR DIA", skiprows=2)
-    df_2023 = pd.read_excel(file_2023, sheet_name="CES ING POR DIA", skiprows=2)
+    df_2024 = leer_excel(file_2024, sheet_name="CES ING POR DIA", skiprows=2)
+    df_2023 = leer_excel(file_2023, sheet_name="CES ING POR DIA", skiprows=2)
     
     # Extraer columnas relevantes
     ces_2023 = df_2023['CES.Ingresados']
@@ -62,22 +67,30 @@ def cargar_datos_segmentos(base_path):
     # TODO: retornar el arima
     pass
 
-def procesar_datos_segmentos(archivo_excel, output_path='segmentos_data.pkl', chunk_size=1000):
-    df = pd.read_excel(archivo_excel, usecols=['FECHA_COTIZACION', 'NOMBRE_SEGMENTO'], parse_dates=['FECHA_COTIZACION'])
+def procesar_datos_segmentos(archivo_excel, output_path='segmentos_data.pkl', chunk_size=1000, almacen_path='segmentos_store'):
+    df = leer_excel(archivo_excel, columnas=['FECHA_COTIZACION', 'NOMBRE_SEGMENTO'])
+    df['FECHA_COTIZACION'] = pd.to_datetime(df['FECHA_COTIZACION'])
     df = df.dropna(subset=['FECHA_COTIZACION', 'NOMBRE_SEGMENTO'])
     df['fecha'] = df['FECHA_COTIZACION'].dt.date
 
     print('contando ocurrencias')
     conteos = df.groupby(['NOMBRE_SEGMENTO', 'fecha']).size().reset_index(name='conteo')
     segmentos_data = defaultdict(dict)
-    for _, row in conteos.iterrows():
-        segmentos_data[row['NOMBRE_SEGMENTO']][row['fecha']] = row['conteo']
+    for segmento, grupo in conteos.groupby('NOMBRE_SEGMENTO'):
+        segmentos_data[segmento] = dict(zip(grupo['fecha'], grupo['conteo']))
     
     min_date = df['fecha'].min()
     max_date = df['fecha'].max()
 
     with open(output_path, 'wb') as f:
         pickle.dump((dict(segmentos_data), min_date, max_date), f)
+
+    # Misma informacion en formato denso (segmentos x dias) con memory map, ver almacen_series.
+    # Una ruta relativa se toma desde la carpeta de output_path, asi el almacen queda junto al pickle
+    if almacen_path:
+        almacen_path = os.path.join(os.path.dirname(output_path), almacen_path)
+        almacen_desde_conteos(conteos, almacen_path)
+        print(f"Almacen denso guardado en {almacen_path}")
     
     print(f"Datos procesados y guardados en {output_path}")
     print(f'Rango de fechas {min_date} a {max_date}')
@@ -86,19 +99,21 @@ def procesar_datos_segmentos(archivo_excel, output_path='segmentos_data.pkl', ch
     return segmentos_data, min_date, max_date
 
 def obtener_serie_segmento(segmento, segmentos_data, min_date, max_date):
+                if isinstance(segmentos_data, AlmacenSeries):
+                    return segmentos_data.serie(segmento, min_date, max_date)
                 datos_segmento = segmentos_data.get(segmento, {})
                 rango_fechas = pd.date_range(start=min_date, end=max_date, freq='D')
-                serie = pd.Series(
-                    index=rango_fechas, 
-                    data=[datos_segmento.get(fecha.date(), 0) for fecha in rango_fechas] 
-                )
-                return serie
+                serie = pd.Series(datos_segmento, dtype='int64')
+                serie.index = pd.to_datetime(serie.index)
+                return serie.reindex(rango_fechas, fill_value=0)
 
-def procesar_y_exportar(ruta_archivo, directorio_salida = 'output'):
+def procesar_y_exportar(ruta_archivo, directorio_salida = '.'):
+    # Por defecto en el directorio de trabajo, donde lo buscan forecast_all_segments y
+    # obtener_serie_segmento_v2 (igual que refrescar_agregados)
     os.makedirs(directorio_salida, exist_ok=True)
 
     try:
-        df = pd.read_excel(ruta_archivo)
+        df = leer_excel(ruta_archivo)
     except Exception as e:
         raise ValueError(f"Error al leer el archivo Excel {str(e)}")
     
@@ -113,16 +128,36 @@ def procesar_y_exportar(ruta_archivo, directorio_salida = 'output'):
     resultado = df.groupby(["FECHA_COTIZACION", 'NOMBRE_SEGMENTO'])['COTIZANTE'].nunique().unstack()
     nombre_archivo = 'series_por_segmento.pkl'
 
-    resultado.to_pickle(f"{nombre_archivo}")
+    resultado.to_pickle(os.path.join(directorio_salida, nombre_archivo))
+    # Version por segmento en disco para leer un solo segmento sin cargar todo (ver obtener_serie_segmento_v2)
+    almacen_desde_ancho(resultado, os.path.join(directorio_salida, 'series_por_segmento_store'))
     return resultado
 
+# Almacenes ya abiertos (abrir uno es barato, pero asi no se relee segmentos.json).
+# La version es el mtime de segmentos.json, que guardar_almacen reemplaza al final:
+# si el almacen se vuelve a escribir, la entrada vieja se descarta y se abre de nuevo
+_almacenes = {}
+
+def _almacen(directorio):
+    version = os.stat(os.path.join(directorio, 'segmentos.json')).st_mtime_ns
+    entrada = _almacenes.get(directorio)
+    if entrada is None or entrada[0] != version:
+        entrada = _almacenes[directorio] = (version, AlmacenSeries(directorio))
+    return entrada[1]
+
 def obtener_serie_segmento_v2(pickle_name, segmento, fecha_inicio=None, fecha_fin=None):
+    """Serie de cotizantes de un segmento entre dos fechas (incluidas).
+    pickle_name puede ser series_por_segmento.pkl o el directorio series_por_segmento_store;
+    con el directorio solo se leen los bytes de ese segmento en ese rango de fechas"""
+    if os.path.isdir(pickle_name):
+        return _almacen(pickle_name).serie(segmento, fecha_inicio, fecha_fin)
+
     try:
         df = pd.read_pickle(pickle_name)
-    except Exception:
-        pass
+    except Exception as e:
+        raise ValueError(f"No se pudo leer {pickle_name}: {e}") from e
     if segmento not in df.columns:
-        raise ValueError
+        raise ValueError(f"Segmento no encontrado: {segmento}")
     
     serie = df[segmento]
     if fecha_inicio is not None or fecha_fin is not None:
@@ -135,17 +170,191 @@ def obtener_serie_segmento_v2(pickle_name, segmento, fecha_inicio=None, fecha_fi
         serie = serie.loc[mask]
 
     return serie
+
+def _ajustar_auto_arima(ts, seasonal=False, m=1):
+    """Busqueda stepwise del auto_arima (la parte cara)"""
+    return auto_arima(ts,
+                      seasonal=seasonal,
+                      m=m,
+                      stepwise=True,
+                      suppress_warnings=True,
+                      error_action='ignore')
+
+def _fechas_pronostico(ts, n_steps):
+    return pd.date_range(ts.index[-1] + pd.Timedelta(days=1), periods=n_steps, freq='D')
+
 def predict_auto_arima(ts, n_steps=14, seasonal=False, m=1):
     """Esta funcion hace un autoarima general de una serie de tiempo que le pasamos"""
-    model = auto_arima(ts,
-                       seasonal=seasonal,
-                       m=m,
-                       stepwise=True,
-                       suppress_warnings=True,
-                       error_action='ignore')
+    model = _ajustar_auto_arima(ts, seasonal=seasonal, m=m)
     
     forecast = model.predict(n_periods=n_steps)
-    return pd.Series(forecast, index=pd.date_range(ts.index[-1] + pd.Timedelta(days=1), periods=n_steps, freq='D'))
+    return pd.Series(forecast, index=_fechas_pronostico(ts, n_steps))
+
+class CacheArima:
+    """Cache de modelos auto_arima ya ajustados: el ultimo modelo de cada serie (por nombre).
+    - misma serie: se reutiliza el modelo (sin volver a buscar el orden)
+    - serie que extiende la ya ajustada: se agregan las observaciones nuevas con update()
+    - serie distinta con el mismo nombre: se hace la busqueda stepwise y reemplaza a la anterior
+    A lo mas guarda max_series series (se descartan las usadas hace mas tiempo). El archivo
+    se escribe una vez por llamada a pronosticar / pronosticar_lote, solo si algo cambio.
+    Con un modelo se pueden pedir pronosticos a cualquier horizonte"""
+
+    def __init__(self, ruta=None, seasonal=False, m=1, max_series=256):
+        self.ruta = ruta
+        self.seasonal = seasonal
+        self.m = m
+        self.max_series = max_series
+        self.modelos = OrderedDict()  # nombre -> {'hash', 'modelo', 'n', 'orden'}
+        self._cambios = False
+        if ruta and os.path.exists(ruta):
+            with open(ruta, 'rb') as f:
+                modelos = pickle.load(f)
+            # un archivo con el formato anterior (por hash, sin nombre) se descarta
+            if all(isinstance(e, dict) and 'hash' in e for e in modelos.values()):
+                self.modelos = OrderedDict(modelos)
+
+    @staticmethod
+    def _hash(serie):
+        return hashlib.sha1(pd.util.hash_pandas_object(serie).values.tobytes()).hexdigest()
+
+    def modelo(self, serie, nombre=None):
+        """Modelo ajustado para serie; nombre identifica la serie (por defecto serie.name)"""
+        nombre = serie.name if nombre is None else nombre
+        clave = self._hash(serie)
+        entrada = self.modelos.get(nombre)
+        if entrada is not None:
+            self.modelos.move_to_end(nombre)
+            if entrada['hash'] == clave:
+                return entrada['modelo']
+            # La serie extiende a la ya ajustada: solo se agregan las observaciones nuevas
+            n = entrada['n']
+            if n < len(serie) and self._hash(serie.iloc[:n]) == entrada['hash']:
+                modelo = entrada['modelo']
+                modelo.update(serie.iloc[n:])
+                self._registrar(nombre, clave, modelo, len(serie))
+                return modelo
+
+        modelo = _ajustar_auto_arima(serie, seasonal=self.seasonal, m=self.m)
+        self._registrar(nombre, clave, modelo, len(serie))
+        return modelo
+
+    def _registrar(self, nombre, clave, modelo, n):
+        self.modelos[nombre] = {'hash': clave, 'modelo': modelo, 'n': n, 'orden': modelo.order}
+        self.modelos.move_to_end(nombre)
+        while len(self.modelos) > self.max_series:
+            self.modelos.popitem(last=False)
+        self._cambios = True
+
+    def pronosticar(self, serie, n_steps=14, nombre=None):
+        """Igual que predict_auto_arima(serie, n_steps) pero sin reajustar si la serie ya se vio"""
+        forecast = self._pronostico(serie, n_steps, nombre)
+        self.guardar()
+        return forecast
+
+    def pronosticar_lote(self, series, n_steps=14):
+        """Pronostico de varias series {nombre: serie}; el cache se escribe una sola vez al final"""
+        try:
+            return {nombre: self._pronostico(serie, n_steps, nombre) for nombre, serie in series.items()}
+        finally:
+            self.guardar()
+
+    def _pronostico(self, serie, n_steps, nombre):
+        forecast = self.modelo(serie, nombre).predict(n_periods=n_steps)
+        return pd.Series(np.asarray(forecast), index=_fechas_pronostico(serie, n_steps))
+
+    def guardar(self):
+        if self.ruta and self._cambios:
+            tmp = self.ruta + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(dict(self.modelos), f)
+            os.replace(tmp, self.ruta)
+            self._cambios = False
+
+def _serie_diaria(serie):
+    """Lleva una columna de series_por_segmento a frecuencia diaria (dias sin cotizaciones = 0)"""
+    serie = serie.groupby(serie.index.normalize()).sum()
+    return serie.asfreq('D', fill_value=0)
+
+def _pronosticar_segmento(segmento, serie, n_steps, seasonal, m):
+    """Pronostico de un segmento: nunca lanza excepcion, el error viaja en el resultado"""
+    try:
+        model = _ajustar_auto_arima(serie, seasonal=seasonal, m=m)
+        forecast = np.asarray(model.predict(n_periods=n_steps))
+        return segmento, _fechas_pronostico(serie, n_steps), forecast, model.order, model.seasonal_order, None
+    except Exception as e:
+        return segmento, None, None, None, None, f"{type(e).__name__}: {e}"
+
+def _proceso_segmento(conexion, segmento, serie, n_steps, seasonal, m):
+    """Proceso de un solo segmento: manda el resultado por su propio Pipe"""
+    conexion.send(_pronosticar_segmento(segmento, serie, n_steps, seasonal, m))
+    conexion.close()
+
+def forecast_all_segments(n_steps=14, n_jobs=None, pickle_name='series_por_segmento.pkl',
+                          timeout=300, seasonal=False, m=1):
+    """Pronostica todos los segmentos de series_por_segmento.pkl en paralelo.
+    Cada segmento corre en su propio proceso, con a lo mas n_jobs procesos a la vez. Si un
+    segmento falla o lleva mas de timeout segundos corriendo (contados desde que partio su
+    proceso) se informa en ERROR, su proceso se termina en ese momento y el cupo pasa al
+    siguiente segmento, asi un segmento colgado no frena al resto.
+    Cada proceso devuelve su resultado por un Pipe propio que se descarta junto con el, asi
+    terminar un proceso a medio escribir no afecta a los demas.
+
+    Retorna un DataFrame largo con SEGMENTO, FECHA, PRONOSTICO, ORDEN, ORDEN_ESTACIONAL, ERROR
+    (los segmentos con error tienen una sola fila con FECHA y PRONOSTICO vacios)"""
+    df = pd.read_pickle(pickle_name)
+    n_jobs = n_jobs or os.cpu_count()
+
+    pendientes = list(df.columns)[::-1]
+    activos = {}  # segmento -> (proceso, receptor, inicio)
+    resultados = {}
+    while pendientes or activos:
+        while pendientes and len(activos) < n_jobs:
+            segmento = pendientes.pop()
+            receptor, emisor = multiprocessing.Pipe(duplex=False)
+            proceso = multiprocessing.Process(
+                target=_proceso_segmento,
+                args=(emisor, segmento, _serie_diaria(df[segmento]), n_steps, seasonal, m),
+                daemon=True
+            )
+            proceso.start()
+            # el padre cierra su copia del emisor: si el hijo muere, recv() da EOFError
+            emisor.close()
+            activos[segmento] = (proceso, receptor, time.monotonic())
+
+        listos = wait([receptor for _, receptor, _ in activos.values()], timeout=0.1)
+        ahora = time.monotonic()
+        for segmento, (proceso, receptor, inicio) in list(activos.items()):
+            if receptor in listos:
+                try:
+                    resultados[segmento] = receptor.recv()
+                    error = None
+                except EOFError:
+                    # el proceso murio sin dejar resultado (p.ej. sin memoria)
+                    proceso.join()
+                    error = f"proceso terminado (exitcode {proceso.exitcode})"
+            elif timeout is not None and ahora - inicio > timeout:
+                error = f"timeout ({timeout}s)"
+            else:
+                continue
+            if error is not None:
+                proceso.terminate()
+                resultados[segmento] = (segmento, None, None, None, None, error)
+            proceso.join()
+            receptor.close()
+            del activos[segmento]
+
+    filas = []
+    for segmento in df.columns:
+        _, fechas, forecast, orden, orden_estacional, error = resultados[segmento]
+        if error is not None:
+            filas.append({'SEGMENTO': segmento, 'FECHA': pd.NaT, 'PRONOSTICO': np.nan,
+                          'ORDEN': None, 'ORDEN_ESTACIONAL': None, 'ERROR': error})
+            continue
+        for fecha, valor in zip(fechas, forecast):
+            filas.append({'SEGMENTO': segmento, 'FECHA': fecha, 'PRONOSTICO': valor,
+                          'ORDEN': orden, 'ORDEN_ESTACIONAL': orden_estacional, 'ERROR': None})
+
+    return pd.DataFrame(filas, columns=['SEGMENTO', 'FECHA', 'PRONOSTICO', 'ORDEN', 'ORDEN_ESTACIONAL', 'ERROR'])
 
 #reemplazar main 
 
@@ -63,6 +63,318 @@ def asignar_segmento(cotizante, df_segmentos):
         'COINCIDENCIA': mejor_puntaje
     }
 
+def _compilar_reglas(df_segmentos):
+    """
+    Compila las reglas de df_segmentos en arreglos de NumPy (una posición por segmento).
+    Una regla cuya columna no existe o es NaN queda deshabilitada, igual que en asignar_segmento.
+    """
+    n = len(df_segmentos)
+    reglas = {'SEGMENTO': df_segmentos['SEGMENTO'].to_numpy(), 'N': n}
+
+    for campo in ['TIPO_RENTA', 'MODALIDAD_RENTA']:
+        if campo in df_segmentos.columns:
+            reglas[campo] = df_segmentos[campo].to_numpy(dtype=object)
+            reglas[f'{campo}_ACTIVA'] = df_segmentos[campo].notna().to_numpy()
+
+    if 'SALDO_MINIMO' in df_segmentos.columns and 'SALDO_MAXIMO' in df_segmentos.columns:
+        saldo_min = pd.to_numeric(df_segmentos['SALDO_MINIMO'], errors='coerce').to_numpy(dtype=float)
+        saldo_max = pd.to_numeric(df_segmentos['SALDO_MAXIMO'], errors='coerce').to_numpy(dtype=float)
+        reglas['SALDO'] = (saldo_min, saldo_max, ~np.isnan(saldo_min) & ~np.isnan(saldo_max))
+        reglas['SALDO_TEXTO'] = (df_segmentos['SALDO_MINIMO'].tolist(), df_segmentos['SALDO_MAXIMO'].tolist())
+
+    if 'MESES_GARANTIZADOS_MINIMO' in df_segmentos.columns and 'MESES_GARANTIZADOS_MAXIMO' in df_segmentos.columns:
+        meses_min = pd.to_numeric(df_segmentos['MESES_GARANTIZADOS_MINIMO'], errors='coerce').to_numpy(dtype=float)
+        meses_max = pd.to_numeric(df_segmentos['MESES_GARANTIZADOS_MAXIMO'], errors='coerce').to_numpy(dtype=float)
+        # Sin máximo el rango queda abierto hacia arriba
+        meses_max = np.where(np.isnan(meses_max), np.inf, meses_max)
+        reglas['MESES'] = (meses_min, meses_max, ~np.isnan(meses_min))
+        reglas['MESES_TEXTO'] = (
+            df_segmentos['MESES_GARANTIZADOS_MINIMO'].tolist(),
+            [m if pd.notna(m) else float('inf') for m in df_segmentos['MESES_GARANTIZADOS_MAXIMO']]
+        )
+
+    return reglas
+
+def _codificar_categoria(valores_cotizantes, valores_segmentos):
+    """Codifica ambas columnas con los mismos enteros para comparar con ==; NaN queda como -1"""
+    codigos, _ = pd.factorize(np.concatenate([valores_segmentos, valores_cotizantes]))
+    return codigos[len(valores_segmentos):], codigos[:len(valores_segmentos)]
+
+def _motivo(fila, reglas, j, aciertos):
+    """Reconstruye el texto MOTIVO de asignar_segmento para el segmento j"""
+    razones = []
+    if aciertos.get('TIPO_RENTA'):
+        razones.append(f"Tipo renta: {fila['TIPO_RENTA']}")
+    if aciertos.get('SALDO'):
+        saldo_min, saldo_max = reglas['SALDO_TEXTO']
+        razones.append(f"Renta {fila['RENTA']} en rango [{saldo_min[j]}-{saldo_max[j]}]")
+    if aciertos.get('MODALIDAD_RENTA'):
+        razones.append(f"Modalidad: {fila['MODALIDAD_RENTA']}")
+    if aciertos.get('MESES'):
+        meses_min, meses_max = reglas['MESES_TEXTO']
+        razones.append(f"Meses garantizados: {fila['MESES_GARANTIZADOS']} en rango [{meses_min[j]}-{meses_max[j]}]")
+    return ", ".join(razones)
+
+def asignar_segmentos_batch(df_cotizantes, df_segmentos, con_motivo=False, tamano_bloque=20000):
+    """
+    Versión vectorizada de asignar_segmento para muchos cotizantes a la vez.
+
+    Las reglas se compilan una vez y se evalúa un bloque de cotizantes contra todos
+    los segmentos en una matriz (filas x segmentos). El desempate es el mismo que en
+    asignar_segmento: gana el primer segmento con el puntaje máximo y con puntaje 0
+    no se asigna segmento.
+
+    Args:
+        df_cotizantes (pd.DataFrame): Una fila por cotizante (RENTA, TIPO_RENTA, ...)
+        df_segmentos (pd.DataFrame): DataFrame con las reglas de segmentos (ya limpio).
+        con_motivo (bool): Si es True se agrega la columna MOTIVO (más lento).
+        tamano_bloque (int): Cotizantes evaluados por bloque, acota la memoria.
+
+    Returns:
+        pd.DataFrame: SEGMENTO_ASIGNADO, COINCIDENCIA (y MOTIVO) con el índice de df_cotizantes
+    """
+    reglas = _compilar_reglas(df_segmentos)
+    n = len(df_cotizantes)
+    n_segmentos = reglas['N']
+
+    # Pre-codificar las columnas categóricas una sola vez
+    categorias = {}
+    for campo in ['TIPO_RENTA', 'MODALIDAD_RENTA']:
+        if campo in reglas and campo in df_cotizantes.columns:
+            cod_cot, cod_seg = _codificar_categoria(df_cotizantes[campo].to_numpy(dtype=object), reglas[campo])
+            categorias[campo] = (cod_cot, np.where(reglas[f'{campo}_ACTIVA'], cod_seg, -2))
+    usar_saldo = 'SALDO' in reglas and 'RENTA' in df_cotizantes.columns
+    usar_meses = 'MESES' in reglas and 'MESES_GARANTIZADOS' in df_cotizantes.columns
+    renta = pd.to_numeric(df_cotizantes['RENTA'], errors='coerce').to_numpy(dtype=float) if usar_saldo else None
+    meses = pd.to_numeric(df_cotizantes['MESES_GARANTIZADOS'], errors='coerce').to_numpy(dtype=float) if usar_meses else None
+
+    mejor = np.full(n, -1, dtype=np.int64)
+    puntaje_mejor = np.zeros(n, dtype=np.int64)
+
+    for inicio in range(0, n, tamano_bloque):
+        fin = min(inicio + tamano_bloque, n)
+        puntaje = np.zeros((fin - inicio, n_segmentos), dtype=np.int8)
+        for campo, (cod_cot, cod_seg) in categorias.items():
+            puntaje += cod_cot[inicio:fin, None] == cod_seg[None, :]
+        if usar_saldo:
+            saldo_min, saldo_max, activa = reglas['SALDO']
+            r = renta[inicio:fin, None]
+            puntaje += 2 * ((saldo_min <= r) & (r <= saldo_max) & activa)
+        if usar_meses:
+            meses_min, meses_max, activa = reglas['MESES']
+            m = meses[inicio:fin, None]
+            puntaje += (meses_min <= m) & (m <= meses_max) & activa
+
+        if n_segmentos:
+            # argmax devuelve el primer máximo, igual que el ">" estricto del loop original
+            idx = puntaje.argmax(axis=1)
+            puntaje_mejor[inicio:fin] = puntaje[np.arange(fin - inicio), idx]
+            mejor[inicio:fin] = np.where(puntaje_mejor[inicio:fin] > 0, idx, -1)
+
+    segmentos = np.append(reglas['SEGMENTO'].astype(object), None)
+    resultado = pd.DataFrame({
+        'SEGMENTO_ASIGNADO': segmentos[mejor],
+        'COINCIDENCIA': puntaje_mejor
+    }, index=df_cotizantes.index)
+
+    if con_motivo:
+        motivos = []
+        filas = df_cotizantes.to_dict('records')
+        for i, j in enumerate(mejor):
+            if j < 0:
+                motivos.append("")
+                continue
+            aciertos = {}
+            for campo, (cod_cot, cod_seg) in categorias.items():
+                aciertos[campo] = cod_cot[i] == cod_seg[j]
+            if usar_saldo:
+                saldo_min, saldo_max, activa = reglas['SALDO']
+                aciertos['SALDO'] = activa[j] and saldo_min[j] <= renta[i] <= saldo_max[j]
+            if usar_meses:
+                meses_min, meses_max, activa = reglas['MESES']
+                aciertos['MESES'] = activa[j] and meses_min[j] <= meses[i] <= meses_max[j]
+            motivos.append(_motivo(filas[i], reglas, j, aciertos))
+        resultado['MOTIVO'] = motivos
+
+    return resultado
+
+def _tramos(minimos, maximos, activa):
+    """
+    Divide la recta en tramos elementales a partir de los bordes de los intervalos.
+    Para bordes b_0 < ... < b_{n-1} hay 2n+1 tramos: los huecos entre bordes (pares)
+    y los bordes mismos (impares), porque los intervalos son cerrados. Se agrega un
+    último tramo para valores NaN o ausentes, que no cae en ningún intervalo.
+
+    Returns:
+        bordes (np.ndarray), contiene (np.ndarray bool tramos x segmentos)
+    """
+    valores = np.concatenate([minimos[activa], maximos[activa]])
+    bordes = np.unique(valores[np.isfinite(valores)])
+    n = len(bordes)
+    representantes = np.empty(2 * n + 1)
+    if n:
+        representantes[1::2] = bordes
+        representantes[2:-1:2] = (bordes[:-1] + bordes[1:]) / 2
+        representantes[0] = bordes[0] - 1
+        representantes[-1] = bordes[-1] + 1
+    else:
+        representantes[0] = 0.0
+    contiene = (minimos <= representantes[:, None]) & (representantes[:, None] <= maximos) & activa
+    contiene = np.vstack([contiene, np.zeros((1, len(minimos)), dtype=bool)])
+    return bordes, contiene
+
+def _buscar_tramo(bordes, valores):
+    """Búsqueda binaria del tramo de cada valor (ver _tramos)"""
+    valores = np.asarray(valores, dtype=float)
+    i = np.searchsorted(bordes, valores, side='left')
+    en_borde = (i < len(bordes)) & (bordes[np.minimum(i, len(bordes) - 1)] == valores) if len(bordes) else np.zeros(valores.shape, dtype=bool)
+    tramo = np.where(en_borde, 2 * i + 1, 2 * i)
+    return np.where(np.isnan(valores), 2 * len(bordes) + 1, tramo)
+
+class IndiceSegmentos:
+    """
+    Índice precompilado de las reglas de SC_SEGMENTOS.
+
+    Se construye una vez desde limpiar_datos(df_segmentos). Los segmentos se agrupan en
+    clases por su par (TIPO_RENTA, MODALIDAD_RENTA); dentro de una clase esos dos campos
+    suman lo mismo para cualquier cotizante, así que el ganador sólo depende de RENTA y
+    MESES_GARANTIZADOS. Para cada clase los rangos se parten en tramos con los bordes de
+    esa clase y se precalcula el segmento ganador de cada par de tramos.
+
+    Asignar un cotizante son dos búsquedas binarias y una lectura de tabla por clase, y
+    luego quedarse con el mejor de las clases: el costo depende del número de clases y no
+    del número de segmentos. La memoria es la suma, por clase, de tramos de renta por
+    tramos de meses. El resultado es el mismo que el de asignar_segmento (incluido el desempate).
+    """
+
+    def __init__(self, df_segmentos, tamano_bloque=64):
+        self.reglas = _compilar_reglas(df_segmentos)
+        n_segmentos = self.reglas['N']
+
+        # Código de cada segmento por campo categórico: posición del valor o -1 si la regla no aplica
+        self.categorias = {}
+        codigos = []
+        for campo in ['TIPO_RENTA', 'MODALIDAD_RENTA']:
+            codigo = np.full(n_segmentos, -1, dtype=np.int64)
+            if campo in self.reglas:
+                valores = self.reglas[campo]
+                activa = self.reglas[f'{campo}_ACTIVA']
+                conocidos = list(pd.unique(valores[activa]))
+                self.categorias[campo] = {v: k for k, v in enumerate(conocidos)}
+                codigo[activa] = [self.categorias[campo][v] for v in valores[activa]]
+            codigos.append(codigo)
+
+        sin_regla = (np.zeros(n_segmentos), np.zeros(n_segmentos), np.zeros(n_segmentos, dtype=bool))
+        saldo = self.reglas.get('SALDO', sin_regla)
+        meses = self.reglas.get('MESES', sin_regla)
+
+        self.clases = []
+        pares = np.stack(codigos, axis=1) if n_segmentos else np.empty((0, 2), dtype=np.int64)
+        for par in np.unique(pares, axis=0):
+            # Índices del catálogo en orden: el primero de la clase gana los empates dentro de ella
+            indices = np.flatnonzero((pares == par).all(axis=1))
+            bordes_saldo, en_saldo = _tramos(*(x[indices] for x in saldo))
+            bordes_meses, en_meses = _tramos(*(x[indices] for x in meses))
+            en_saldo = 2 * en_saldo.astype(np.int8)
+            en_meses = en_meses.astype(np.int8)
+
+            ganador = np.empty((len(en_saldo), len(en_meses)), dtype=np.int32)
+            puntaje = np.empty(ganador.shape, dtype=np.int8)
+            for inicio in range(0, len(en_saldo), tamano_bloque):
+                fin = min(inicio + tamano_bloque, len(en_saldo))
+                rango = en_saldo[inicio:fin, None, :] + en_meses[None, :, :]
+                # argmax devuelve el primer máximo, igual que el ">" estricto del loop original
+                idx = rango.argmax(axis=2)
+                ganador[inicio:fin] = indices[idx]
+                puntaje[inicio:fin] = np.take_along_axis(rango, idx[..., None], axis=2)[..., 0]
+            self.clases.append((int(par[0]), int(par[1]), bordes_saldo, bordes_meses, ganador, puntaje))
+
+    def _codigo(self, campo, valores):
+        mapa = self.categorias.get(campo, {})
+        return np.array([mapa.get(v, len(mapa)) for v in valores], dtype=np.int64)
+
+    def _ganador(self, t, m, renta, meses):
+        """Segmento ganador (-1 si ninguno suma) y puntaje para cada cotizante"""
+        mejor = np.full(len(t), -1, dtype=np.int64)
+        puntaje_mejor = np.full(len(t), -1, dtype=np.int64)
+        for tipo, modalidad, bordes_saldo, bordes_meses, ganador, puntaje in self.clases:
+            r = _buscar_tramo(bordes_saldo, renta)
+            k = _buscar_tramo(bordes_meses, meses)
+            candidato = ganador[r, k]
+            p = puntaje[r, k] + (t == tipo) + (m == modalidad)
+            # Entre clases gana el mayor puntaje y, si empatan, el segmento que aparece primero
+            mejora = (p > puntaje_mejor) | ((p == puntaje_mejor) & (candidato < mejor))
+            mejor = np.where(mejora, candidato, mejor)
+            puntaje_mejor = np.where(mejora, p, puntaje_mejor)
+        puntaje_mejor = np.maximum(puntaje_mejor, 0)
+        return np.where(puntaje_mejor > 0, mejor, -1), puntaje_mejor
+
+    def asignar_lote(self, df_cotizantes):
+        """Asigna segmento a todas las filas de df_cotizantes (SEGMENTO_ASIGNADO, COINCIDENCIA)"""
+        n = len(df_cotizantes)
+
+        def columna(nombre, numerica):
+            if nombre not in df_cotizantes.columns:
+                return np.full(n, np.nan) if numerica else [None] * n
+            if numerica:
+                return pd.to_numeric(df_cotizantes[nombre], errors='coerce').to_numpy(dtype=float)
+            return df_cotizantes[nombre].tolist()
+
+        ganador, puntaje = self._ganador(
+            self._codigo('TIPO_RENTA', columna('TIPO_RENTA', False)),
+            self._codigo('MODALIDAD_RENTA', columna('MODALIDAD_RENTA', False)),
+            columna('RENTA', True),
+            columna('MESES_GARANTIZADOS', True)
+        )
+        segmentos = np.append(self.reglas['SEGMENTO'].astype(object), None)
+        return pd.DataFrame({
+            'SEGMENTO_ASIGNADO': segmentos[ganador],
+            'COINCIDENCIA': puntaje.astype(np.int64)
+        }, index=df_cotizantes.index)
+
+    def asignar(self, cotizante):
+        """
+        Misma interfaz y resultado que asignar_segmento(cotizante, df_segmentos).
+
+        Args:
+            cotizante (dict): Diccionario con los datos del cotizante
+
+        Returns:
+            dict: Resultado de la asignación
+        """
+        def numero(nombre):
+            valor = cotizante.get(nombre, np.nan)
+            return np.nan if pd.isna(valor) else valor
+
+        ganador, puntaje = self._ganador(
+            self._codigo('TIPO_RENTA', [cotizante.get('TIPO_RENTA')]),
+            self._codigo('MODALIDAD_RENTA', [cotizante.get('MODALIDAD_RENTA')]),
+            np.array([numero('RENTA')], dtype=float),
+            np.array([numero('MESES_GARANTIZADOS')], dtype=float)
+        )
+        j = ganador[0]
+
+        if j < 0:
+            return {'SEGMENTO_ASIGNADO': None, 'MOTIVO': "", 'COINCIDENCIA': 0}
+
+        # El motivo sólo se arma para el segmento ganador
+        reglas = self.reglas
+        aciertos = {}
+        for campo in self.categorias:
+            aciertos[campo] = bool(reglas[f'{campo}_ACTIVA'][j]) and cotizante.get(campo) == reglas[campo][j]
+        if 'SALDO' in reglas:
+            saldo_min, saldo_max, activa = reglas['SALDO']
+            aciertos['SALDO'] = bool(activa[j]) and saldo_min[j] <= numero('RENTA') <= saldo_max[j]
+        if 'MESES' in reglas:
+            meses_min, meses_max, activa = reglas['MESES']
+            aciertos['MESES'] = bool(activa[j]) and meses_min[j] <= numero('MESES_GARANTIZADOS') <= meses_max[j]
+
+        return {
+            'SEGMENTO_ASIGNADO': reglas['SEGMENTO'][j],
+            'MOTIVO': _motivo(cotizante, reglas, j, aciertos),
+            'COINCIDENCIA': int(puntaje[0])
+        }
+
 def limpiar_datos(df):
     # Normalizar nombres de columnas
     df.columns = df.columns.str.strip().str.upper()
@@ -84,6 +396,7 @@ def limpiar_datos(df):
 
 
 import polars as pl
+from cache_excel import leer_excel
 
 def contar_segmentos_polars(file_path, sheet_name=None):
     """
@@ -96,11 +409,8 @@ def contar_segmentos_polars(file_path, sheet_name=None):
     Returns:
         dict: Diccionario con {nombre_segmento: cantidad}
     """
-    # Leer el archivo Excel
-    if sheet_name:
-        df = pl.read_excel(file_path, sheet_name=sheet_name)
-    else:
-        df = pl.read_excel(file_path)
+    # Leer el archivo Excel (desde el cache Parquet)
+    df = leer_excel(file_path, sheet_name=sheet_name, motor='polars')
     
     # Verificar si existe la columna necesaria
     if 'NOMBRE_SEGMENTO' not in df.columns:
@@ -128,10 +438,7 @@ def contar_segmentos_polars_tuplas(file_path, sheet_name=None):
     Returns:
         list: Lista de tuplas (nombre_segmento, cantidad)
     """
-    if sheet_name:
-        df = pl.read_excel(file_path, sheet_name=sheet_name)
-    else:
-        df = pl.read_excel(file_path)
+    df = leer_excel(file_path, sheet_name=sheet_name, motor='polars')
     
     if 'NOMBRE_SEGMENTO' not in df.columns:
         raise ValueError("El DataFrame no contiene la columna 'NOMBRE_SEGMENTO'")
@@ -143,7 +450,7 @@ def contar_segmentos_polars_tuplas(file_path, sheet_name=None):
     )
 
 def cotizaciones_promedio(file_path, sheet_name=None):
-    df = pl.read_excel(file_path)
+    df = leer_excel(file_path, sheet_name=sheet_name, motor='polars')
     required_columns = {'COTIZANTE', 'COTIZACION'}
     
     max_por_cotizante = (
@@ -173,7 +480,7 @@ if __name__ == "__main__":
             f.write(f"{segmento}: {cantidad}\n")
     ###############################################
     # Cargar datos con hoja específica
-    df_segmentos = pd.read_excel('BBDD/SC_SEGMENTOS.xlsx')  
+    df_segmentos = leer_excel('BBDD/SC_SEGMENTOS.xlsx')
     
     # Verificar columnas
     print("Columnas en df_segmentos:", df_segmentos.columns.tolist())
@@ -193,5 +500,9 @@ if __name__ == "__main__":
     resultado = asignar_segmento(cotizante_ejemplo, df_segmentos)
     print("Resultado:", resultado)
 
+    # Lo mismo con el índice precompilado (se construye una sola vez)
+    indice = IndiceSegmentos(df_segmentos)
+    print("Resultado (indice):", indice.asignar(cotizante_ejemplo))
+
     #TODO: Ahora que tenemos una forma de asignar
     # podemos simular personas --> asignarlas a segmentos
\ No newline at end of file
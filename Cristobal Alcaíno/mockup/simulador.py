@@ -0,0 +1,353 @@
+import os
+import multiprocessing
+import numpy as np
+import pandas as pd
+import joblib
+from functions import RankingModel, TablaRanking, cargar_desde_pickle
+from modelo_ces import cargar_datos, CacheArima
+from clientes_dist import ClientSampler
+
+# Simulador de un mes sin interaccion (version vectorizada de mockup.py).
+# Todas las replicas se simulan a la vez como arreglos (replicas x dias x rankings).
+
+CUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Hasta este numero de ventas por dia la suma de montos se sortea exacta,
+# sobre eso se usa la aproximacion normal de la suma de uniformes (Irwin-Hall)
+_MAX_SUMA_EXACTA = 30
+
+def _suma_uniformes(rng, n, venta_min, venta_max):
+    """Suma de n[i] montos U(venta_min, venta_max) para cada celda de n, sin sortear monto por monto"""
+    n = np.asarray(n)
+    planos = n.reshape(-1)
+    total = np.empty(planos.shape, dtype=float)
+
+    chicos = planos < _MAX_SUMA_EXACTA
+    if chicos.any():
+        u = rng.random((chicos.sum(), _MAX_SUMA_EXACTA - 1))
+        mascara = np.arange(_MAX_SUMA_EXACTA - 1) < planos[chicos][:, None]
+        total[chicos] = (u * mascara).sum(axis=1)
+    grandes = ~chicos
+    if grandes.any():
+        m = planos[grandes]
+        total[grandes] = rng.normal(m / 2, np.sqrt(m / 12))
+
+    return (venta_min * planos + (venta_max - venta_min) * total).reshape(n.shape)
+
+def _ventas_con_perfiles(rng, n, venta_min, venta_max, sampler, columna_monto, tamano_bloque=262144):
+    """
+    Como _suma_uniformes, pero cada venta tiene su propio perfil sampleado del modelo de clientes:
+    el monto U(venta_min, venta_max) se escala por columna_monto del perfil sobre su media en el modelo.
+    """
+    n = np.asarray(n)
+    planos = n.reshape(-1)
+    total = np.zeros(planos.shape, dtype=float)
+
+    scaler = sampler.modelo['pipeline'].named_steps['preprocessor'].named_transformers_['num']
+    referencia = scaler.mean_[sampler.features_numericas.index(columna_monto)]
+    if referencia <= 0:
+        raise ValueError(f"La media de {columna_monto} en el modelo de clientes debe ser positiva")
+
+    # Celda (replica, dia) de cada venta; los perfiles se samplean por bloques para acotar memoria
+    celdas = np.repeat(np.arange(planos.size), planos)
+    for inicio in range(0, len(celdas), tamano_bloque):
+        fin = min(inicio + tamano_bloque, len(celdas))
+        perfiles = sampler.samplear(fin - inicio)
+        factor = np.clip(perfiles[columna_monto], 0, None) / referencia
+        montos = rng.uniform(venta_min, venta_max, fin - inicio) * factor
+        total += np.bincount(celdas[inicio:fin], weights=montos, minlength=planos.size)
+
+    return total.reshape(n.shape)
+
+def modelo_distribucion_por_defecto(base_path='BBDD'):
+    """Ruta de modelo_distribucion.pkl en base_path o, donde lo deja clientes_dist, en el directorio de trabajo (None si no existe)"""
+    for ruta in (os.path.join(base_path, 'modelo_distribucion.pkl'), 'modelo_distribucion.pkl'):
+        if os.path.exists(ruta):
+            return ruta
+    return None
+
+def cargar_modelo_ranking(base_path='BBDD'):
+    """RankingModel en cache + TablaRanking, como en mockup.py"""
+    modelo = RankingModel.desde_datos(
+        cargar_desde_pickle(os.path.join(base_path, 'datos.pkl')),
+        ruta_cache=os.path.join(base_path, 'modelo_ranking.pkl')
+    )
+    return TablaRanking(modelo)
+
+def pronosticar_clientes(n_dias, base_path='BBDD'):
+    """Clientes esperados por dia segun el ARIMA de CES (ajustado una vez, ver CacheArima)"""
+    serie = cargar_datos(base_path)
+    cache = CacheArima(ruta=os.path.join(base_path, 'cache_arima.pkl'))
+    return cache.pronosticar(serie, n_steps=n_dias).to_numpy()
+
+def simular_mes(tasas_por_dia, n_replicas=1000, pronostico_clientes=None, modelo_ranking=None,
+                modelo_distribucion=None, columna_monto='RENTA', prob_venta_por_ranking=None,
+                venta_min=200, venta_max=500, cuantiles=CUANTILES, semilla=None, base_path='BBDD'):
+    """
+    Simula n_replicas meses completos de una vez.
+
+    Args:
+        tasas_por_dia (array): Tasa usada cada dia (define el largo del mes)
+        n_replicas (int): Numero de meses simulados
+        pronostico_clientes (array, opcional): Clientes esperados por dia; si no se pasa se usa el ARIMA de CES
+        modelo_ranking (opcional): Objeto con predict_proba(tasas) y rankings (RankingModel o TablaRanking)
+        modelo_distribucion (opcional): Modelo, ruta o ClientSampler de clientes_dist. Cada venta de cada
+            replica y dia tiene su propio perfil y su monto se escala por columna_monto / media.
+            Por defecto se usa modelo_distribucion_por_defecto(base_path); si no existe, o con
+            modelo_distribucion=False, los montos son U(venta_min, venta_max) sin perfiles
+        columna_monto (str): Columna numerica del perfil que escala el monto (por defecto RENTA)
+        prob_venta_por_ranking (array, opcional): Probabilidad de venta segun ranking (por defecto todos venden, como en mockup.py)
+        venta_min, venta_max (float): Monto de cada venta ~ U(venta_min, venta_max)
+        cuantiles (tuple): Cuantiles a reportar
+        semilla (int, SeedSequence o Generator, opcional): Para resultados reproducibles
+            (si modelo_distribucion es un ClientSampler, sus perfiles usan el generador del sampler)
+
+    Returns:
+        dict: 'ventas', 'clientes' (pd.Series de cuantiles y media), 'participacion_ranking'
+              (rankings x cuantiles) y los arreglos por replica
+    """
+    tasas = np.asarray(tasas_por_dia, dtype=float).reshape(-1)
+    n_dias = len(tasas)
+    rng = np.random.default_rng(semilla)
+
+    if pronostico_clientes is None:
+        pronostico_clientes = pronosticar_clientes(n_dias, base_path)
+    esperados = np.clip(np.asarray(pronostico_clientes, dtype=float)[:n_dias], 0, None)
+    if len(esperados) < n_dias:
+        raise ValueError(f"El pronostico tiene {len(esperados)} dias y se pidieron {n_dias}")
+
+    if modelo_ranking is None:
+        modelo_ranking = cargar_modelo_ranking(base_path)
+    rankings = np.asarray(modelo_ranking.rankings)
+    probs = modelo_ranking.predict_proba(tasas)
+    probs = probs / probs.sum(axis=1, keepdims=True)
+
+    # (replicas x dias) clientes, (replicas x dias x rankings) conteos por ranking
+    clientes = rng.poisson(esperados, size=(n_replicas, n_dias))
+    conteos = rng.multinomial(clientes, probs)
+
+    if prob_venta_por_ranking is None:
+        vendidos = clientes
+    else:
+        prob_venta = np.asarray(prob_venta_por_ranking, dtype=float)
+        if len(prob_venta) != len(rankings):
+            raise ValueError(f"prob_venta_por_ranking debe tener {len(rankings)} valores")
+        vendidos = rng.binomial(conteos, prob_venta).sum(axis=2)
+
+    if modelo_distribucion is None:
+        modelo_distribucion = modelo_distribucion_por_defecto(base_path)
+    if modelo_distribucion is None or modelo_distribucion is False:
+        ventas = _suma_uniformes(rng, vendidos, venta_min, venta_max)
+    else:
+        sampler = modelo_distribucion
+        if not isinstance(sampler, ClientSampler):
+            sampler = ClientSampler(modelo_distribucion, semilla=rng)
+        ventas = _ventas_con_perfiles(rng, vendidos, venta_min, venta_max, sampler, columna_monto)
+
+    ventas_mes = ventas.sum(axis=1)
+    clientes_mes = clientes.sum(axis=1)
+    conteos_mes = conteos.sum(axis=1)
+    participacion = conteos_mes / np.maximum(clientes_mes, 1)[:, None]
+
+    def resumir(valores):
+        resumen = pd.Series(np.quantile(valores, cuantiles), index=[f"q{int(q * 100):02d}" for q in cuantiles])
+        resumen['media'] = valores.mean()
+        return resumen
+
+    resultado = {
+        'ventas': resumir(ventas_mes),
+        'clientes': resumir(clientes_mes),
+        'participacion_ranking': pd.DataFrame(
+            np.quantile(participacion, cuantiles, axis=0).T,
+            index=pd.Index(rankings, name='ranking'),
+            columns=[f"q{int(q * 100):02d}" for q in cuantiles]
+        ).assign(media=participacion.mean(axis=0)),
+        'ventas_por_replica': ventas_mes,
+        'clientes_por_replica': clientes_mes,
+        'participacion_por_replica': participacion,
+        'rankings': rankings,
+    }
+
+    return resultado
+
+def _participacion_ranking_1(resultado):
+    """Columna del ranking 1 (o el mejor ranking disponible) en participacion_por_replica"""
+    rankings = resultado['rankings']
+    posicion = np.flatnonzero(rankings == 1)
+    j = posicion[0] if len(posicion) else int(np.argmin(rankings))
+    return resultado['participacion_por_replica'][:, j]
+
+def metricas_escenario(resultado, nivel_riesgo=0.05):
+    """Resume una simulacion: ventas esperadas, participacion del ranking 1 y riesgo de cola"""
+    ventas = resultado['ventas_por_replica']
+    p_riesgo = np.quantile(ventas, nivel_riesgo)
+    return {
+        'VENTAS_ESPERADAS': ventas.mean(),
+        'VENTAS_DESV': ventas.std(),
+        'VENTAS_P50': np.median(ventas),
+        'VENTAS_P_RIESGO': p_riesgo,
+        # CVaR: promedio de las replicas en la cola inferior
+        'VENTAS_CVAR': ventas[ventas <= p_riesgo].mean(),
+        'PARTICIPACION_RANKING_1': _participacion_ranking_1(resultado).mean(),
+    }
+
+# Contexto de cada proceso del pool: se envia una sola vez en el initializer
+_contexto = {}
+
+def _inicializar_proceso(pronostico_clientes, modelo_ranking, kwargs_simulacion):
+    _contexto.update(pronostico=pronostico_clientes, modelo=modelo_ranking, kwargs=kwargs_simulacion)
+
+def _simular_esquema(nombre, tasas, n_replicas, semilla, nivel_riesgo):
+    """Tarea del pool: simula un esquema de tasas con su propio stream aleatorio"""
+    resultado = simular_mes(
+        tasas, n_replicas=n_replicas,
+        pronostico_clientes=_contexto['pronostico'],
+        modelo_ranking=_contexto['modelo'],
+        semilla=semilla,
+        **_contexto['kwargs']
+    )
+    fila = {'ESQUEMA': nombre, 'TASA_PROMEDIO': float(np.mean(tasas))}
+    fila.update(metricas_escenario(resultado, nivel_riesgo))
+    return fila
+
+def grilla_tasas(valores, n_dias=30):
+    """Esquemas de tasa constante durante el mes, uno por valor"""
+    return {f"{v:.4f}": np.full(n_dias, v, dtype=float) for v in valores}
+
+def barrer_escenarios(esquemas, n_replicas=1000, pronostico_clientes=None, modelo_ranking=None,
+                      n_jobs=None, semilla=None, nivel_riesgo=0.05, base_path='BBDD', **kwargs_simulacion):
+    """
+    Evalua muchos esquemas de tasas diarias con simular_mes en un pool de procesos.
+
+    El pronostico de clientes, el modelo de ranking y el de clientes (modelo_distribucion,
+    por defecto el de base_path) se cargan una vez y se comparten con cada proceso al
+    iniciarlo. Cada esquema recibe su propio SeedSequence hijo de semilla, asi el resultado
+    es reproducible y no depende de n_jobs ni del orden de ejecucion (tambien los perfiles:
+    si se pasa un ClientSampler se usa solo su modelo, con el stream de cada esquema).
+
+    Args:
+        esquemas (dict, list o array): {nombre: tasas_por_dia}, lista de esquemas o matriz (esquemas x dias)
+        n_replicas (int): Replicas por esquema
+        pronostico_clientes, modelo_ranking: Igual que en simular_mes (se cargan de base_path si faltan)
+        n_jobs (int, opcional): Procesos a usar (por defecto todos los nucleos; 1 corre sin pool)
+        semilla (int, opcional): Semilla raiz
+        nivel_riesgo (float): Cuantil inferior para P_RIESGO y CVaR
+        **kwargs_simulacion: Argumentos extra para simular_mes (venta_min, prob_venta_por_ranking, ...)
+
+    Returns:
+        pd.DataFrame: Una fila por esquema ordenada por VENTAS_ESPERADAS (columna PUESTO)
+    """
+    if isinstance(esquemas, dict):
+        nombres, tasas = list(esquemas.keys()), list(esquemas.values())
+    else:
+        tasas = list(esquemas)
+        nombres = list(range(len(tasas)))
+    tasas = [np.asarray(t, dtype=float).reshape(-1) for t in tasas]
+    if not tasas:
+        raise ValueError("No hay esquemas que evaluar")
+
+    n_dias = max(len(t) for t in tasas)
+    if pronostico_clientes is None:
+        pronostico_clientes = pronosticar_clientes(n_dias, base_path)
+    if modelo_ranking is None:
+        modelo_ranking = cargar_modelo_ranking(base_path)
+    modelo_distribucion = kwargs_simulacion.get('modelo_distribucion')
+    if modelo_distribucion is None:
+        modelo_distribucion = modelo_distribucion_por_defecto(base_path) or False
+    if isinstance(modelo_distribucion, str):
+        modelo_distribucion = joblib.load(modelo_distribucion)
+    elif isinstance(modelo_distribucion, ClientSampler):
+        # Solo viaja el modelo: cada tarea arma su sampler con su propio stream (ver simular_mes).
+        # Con el generador del sampler copiado en cada proceso el resultado dependeria de n_jobs
+        modelo_distribucion = modelo_distribucion.modelo
+    kwargs_simulacion['modelo_distribucion'] = modelo_distribucion
+
+    semillas = np.random.SeedSequence(semilla).spawn(len(tasas))
+    tareas = [(nombre, t, n_replicas, s, nivel_riesgo) for nombre, t, s in zip(nombres, tasas, semillas)]
+    contexto = (pronostico_clientes, modelo_ranking, kwargs_simulacion)
+
+    n_jobs = n_jobs or os.cpu_count()
+    if n_jobs == 1:
+        _inicializar_proceso(*contexto)
+        filas = [_simular_esquema(*tarea) for tarea in tareas]
+    else:
+        with multiprocessing.Pool(processes=min(n_jobs, len(tareas)),
+                                  initializer=_inicializar_proceso, initargs=contexto) as pool:
+            filas = pool.starmap(_simular_esquema, tareas, chunksize=max(1, len(tareas) // (4 * n_jobs)))
+
+    tabla = pd.DataFrame(filas).sort_values('VENTAS_ESPERADAS', ascending=False, kind='stable')
+    tabla.insert(0, 'PUESTO', np.arange(1, len(tabla) + 1))
+    return tabla.reset_index(drop=True)
+
+def procesar_flujo_cotizantes(flujo, modelo_ranking=None, tasa=None, prob_venta_por_ranking=None,
+                              venta_min=200, venta_max=500, semilla=None, base_path='BBDD'):
+    """
+    Consume bloques de clientes_dist.generar_cotizantes y acumula rankings y ventas por segmento.
+
+    Solo se guardan los totales: la memoria queda acotada por el tamano de bloque del flujo.
+
+    Args:
+        flujo (iterable): Bloques pd.DataFrame de cotizantes (con SEGMENTO_ASIGNADO si se asignaron)
+        modelo_ranking (opcional): Como en simular_mes
+        tasa (float, opcional): Tasa ofrecida a todos; si es None se usa TASA_VENTA de cada cotizante
+        prob_venta_por_ranking (array, opcional): Probabilidad de venta segun ranking (por defecto todos venden)
+        venta_min, venta_max (float): Monto de cada venta ~ U(venta_min, venta_max)
+
+    Returns:
+        pd.DataFrame: Por segmento CLIENTES, VENTAS, MONTO y una columna RANKING_<r> por ranking
+    """
+    rng = np.random.default_rng(semilla)
+    if modelo_ranking is None:
+        modelo_ranking = cargar_modelo_ranking(base_path)
+    rankings = np.asarray(modelo_ranking.rankings)
+    prob_venta = None if prob_venta_por_ranking is None else np.asarray(prob_venta_por_ranking, dtype=float)
+
+    totales = {}
+    for bloque in flujo:
+        n = len(bloque)
+        if n == 0:
+            continue
+        tasas = np.full(n, tasa, dtype=float) if tasa is not None else bloque['TASA_VENTA'].to_numpy(dtype=float)
+
+        # Ranking de cada cotizante por inversa de la distribucion acumulada
+        acumulada = np.cumsum(modelo_ranking.predict_proba(tasas), axis=1)
+        u = rng.random(n) * acumulada[:, -1]
+        posicion = np.minimum((u[:, None] > acumulada).sum(axis=1), len(rankings) - 1)
+
+        vende = np.ones(n, dtype=bool) if prob_venta is None else rng.random(n) < prob_venta[posicion]
+        monto = np.where(vende, rng.uniform(venta_min, venta_max, n), 0.0)
+
+        if 'SEGMENTO_ASIGNADO' in bloque.columns:
+            codigos, segmentos = pd.factorize(bloque['SEGMENTO_ASIGNADO'], use_na_sentinel=False)
+        else:
+            codigos, segmentos = np.zeros(n, dtype=np.int64), pd.Index([None])
+
+        conteo = np.zeros((len(segmentos), len(rankings)), dtype=np.int64)
+        np.add.at(conteo, (codigos, posicion), 1)
+        ventas = np.bincount(codigos, weights=vende, minlength=len(segmentos))
+        montos = np.bincount(codigos, weights=monto, minlength=len(segmentos))
+
+        for i, segmento in enumerate(segmentos):
+            acumulado = totales.setdefault(segmento, [0, 0.0, np.zeros(len(rankings), dtype=np.int64)])
+            acumulado[0] += ventas[i]
+            acumulado[1] += montos[i]
+            acumulado[2] += conteo[i]
+
+    filas = []
+    for segmento, (ventas, monto, conteo) in totales.items():
+        fila = {'SEGMENTO': segmento, 'CLIENTES': int(conteo.sum()), 'VENTAS': int(ventas), 'MONTO': monto}
+        fila.update({f"RANKING_{r}": int(c) for r, c in zip(rankings, conteo)})
+        filas.append(fila)
+    columnas = ['SEGMENTO', 'CLIENTES', 'VENTAS', 'MONTO'] + [f"RANKING_{r}" for r in rankings]
+    return pd.DataFrame(filas, columns=columnas).sort_values('CLIENTES', ascending=False).reset_index(drop=True)
+
+if __name__ == "__main__":
+    tasas = np.full(30, 0.035)
+    resultado = simular_mes(tasas, n_replicas=5000, semilla=42)
+    print("Ventas del mes:")
+    print(resultado['ventas'])
+    print("\nParticipacion por ranking:")
+    print(resultado['participacion_ranking'])
+
+    print("\nBarrido de tasas constantes:")
+    print(barrer_escenarios(grilla_tasas(np.linspace(0.02, 0.06, 17)), n_replicas=2000, semilla=42))
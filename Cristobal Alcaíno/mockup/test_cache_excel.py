@@ -0,0 +1,27 @@
+import os
+import warnings
+import pandas as pd
+import polars as pl
+import pytest
+
+from cache_excel import leer_excel, ruta_parquet
+
+def test_un_parquet_por_hoja_para_ambos_motores(tmp_path):
+    ruta = str(tmp_path / 'libro.xlsx')
+    df = pd.DataFrame({'A': [1, 2, 3], 'B': ['x', 'y', None], 'MIXTA': [1, 'dos', 3]})
+    df.to_excel(ruta, index=False)
+
+    with pytest.warns(UserWarning, match="MIXTA"):
+        como_pandas = leer_excel(ruta)
+    with warnings.catch_warnings():
+        # La segunda lectura sale del cache: no se vuelve a convertir ni a avisar
+        warnings.simplefilter('error')
+        como_polars = leer_excel(ruta, motor='polars')
+
+    assert len([f for f in os.listdir(tmp_path / '.cache_parquet') if f.endswith('.parquet')]) == 1
+    esperado = pd.read_excel(ruta)
+    pd.testing.assert_frame_equal(como_pandas[['A', 'B']], esperado[['A', 'B']])
+    assert como_pandas['MIXTA'].tolist() == ['1', 'dos', '3']
+    assert isinstance(como_polars, pl.DataFrame)
+    assert como_polars.to_pandas().equals(como_pandas)
+    assert ruta_parquet(ruta) == ruta_parquet(ruta)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from clientes_dist import (aprender_distribucion, aprender_distribucion_incremental, actualizar_distribucion,
+                           samplear_distribucion)
+
+def _datos(n, semilla):
+    # Columnas correlacionadas para que las componentes del PCA esten bien separadas
+    rng = np.random.default_rng(semilla)
+    z = rng.standard_normal((n, 3)) @ np.array([[1.0, 0.8, 0.5], [0.0, 0.6, 0.4], [0.0, 0.0, 0.3]])
+    return pd.DataFrame({
+        'TASA_VENTA': 0.03 + 0.005 * z[:, 0],
+        'RENTA': 400 + 100 * z[:, 1],
+        'MESES_GARANTIZADOS': 60 + 30 * z[:, 2],
+        'INVALIDA': np.where(z[:, 0] + rng.standard_normal(n) > 1, 'S', 'N'),
+    })
+
+def _transformar(modelo, df):
+    pipeline = modelo['pipeline']
+    return pipeline.named_steps['pca'].transform(pipeline.named_steps['preprocessor'].transform(df))
+
+def test_actualizar_misma_distribucion_mantiene_transform(tmp_path):
+    numericas, categoricas = ['TASA_VENTA', 'RENTA', 'MESES_GARANTIZADOS'], ['INVALIDA']
+    ruta = str(tmp_path / 'modelo.pkl')
+    modelo = aprender_distribucion_incremental(_datos(20000, 0), numericas, categoricas, ruta,
+                                               capacidad_reservorio=5000)
+    prueba = _datos(2000, 1)
+    antes = _transformar(modelo, prueba)
+    dtypes = modelo['incremental']['reservorio'].dtypes.copy()
+
+    modelo = actualizar_distribucion(_datos(20000, 2), ruta)
+    despues = _transformar(modelo, prueba)
+
+    # Misma distribucion: las componentes pueden cambiar de signo, el resto casi no se mueve
+    signos = np.sign((antes * despues).sum(axis=0))
+    np.testing.assert_allclose(despues * signos, antes, atol=0.05 * antes.std())
+    pd.testing.assert_series_equal(modelo['incremental']['reservorio'].dtypes, dtypes)
+
+def test_samplear_distribucion_reproducible(tmp_path):
+    ruta = str(tmp_path / 'modelo.pkl')
+    aprender_distribucion(_datos(3000, 0), ['TASA_VENTA', 'RENTA', 'MESES_GARANTIZADOS'], ['INVALIDA'], ruta)
+    pd.testing.assert_frame_equal(samplear_distribucion(ruta, 100), samplear_distribucion(ruta, 100))
+    assert not samplear_distribucion(ruta, 100, semilla=None).equals(samplear_distribucion(ruta, 100, semilla=None))
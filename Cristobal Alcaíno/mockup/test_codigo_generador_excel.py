@@ -0,0 +1,67 @@
+import importlib.util
+import os
+import numpy as np
+import pandas as pd
+
+_ruta = os.path.join(os.path.dirname(__file__), 'codigo_generador_excel 4.py')
+_spec = importlib.util.spec_from_file_location('codigo_generador_excel', _ruta)
+generador = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(generador)
+
+def _resumen_por_bloques(df_detalle):
+    """generar_hoja_resumen original: un bloque de 7 columnas por día y un groupby por bloque"""
+    filas = []
+    for i in range(0, len(df_detalle.columns) // 7 * 7, 7):
+        df_dia = df_detalle.iloc[:, i:i + 7].copy()
+        df_dia.columns = generador.COLUMNAS_BLOQUE
+        df_dia = df_dia[
+            df_dia['Cliente'].notna() &
+            df_dia['Segmento'].notna() &
+            (df_dia['Segmento'] != '') &
+            (pd.to_numeric(df_dia['Segmento'], errors='coerce') > 0)
+        ]
+        if df_dia.empty:
+            continue
+        for columna in ['Tasa', 'Ranking', 'Venta']:
+            df_dia[columna] = pd.to_numeric(df_dia[columna], errors='coerce')
+        fecha = df_dia['Fecha'].iloc[0]
+
+        for segmento, grupo in df_dia.groupby('Segmento'):
+            segmento = int(segmento)
+            if segmento <= 0:
+                continue
+            n = len(grupo)
+            tasa = round(grupo['Tasa'].mean(), 2) if not grupo['Tasa'].isna().all() else 0
+            conteos = grupo['Ranking'].dropna().astype(int).value_counts().to_dict()
+            porcentaje = {r: round(conteos.get(r, 0) / n * 100, 2) for r in range(1, 11)}
+            venta = round(grupo['Venta'].sum(), 2) if not grupo['Venta'].isna().all() else 0
+            filas.append([fecha, segmento, n, tasa] + [porcentaje[r] for r in range(1, 6)]
+                         + [sum(porcentaje[r] for r in range(6, 11)), venta])
+    return pd.DataFrame(filas, columns=generador.COLUMNAS_RESUMEN)
+
+def _detalle(n_dias, n_filas, semilla):
+    rng = np.random.default_rng(semilla)
+    bloques = []
+    for dia in range(n_dias):
+        con_cliente = rng.random(n_filas) < 0.8
+        vacio = lambda valores, p: np.where(rng.random(n_filas) < p, np.nan, valores)
+        bloques.append(pd.DataFrame({
+            'Fecha': np.where(con_cliente, f"{dia + 1:02d}-03-2025", None),
+            'Cliente': np.where(con_cliente, 'C', None),
+            'Cotizacion': np.arange(n_filas),
+            'Segmento': vacio(rng.integers(0, 6, n_filas), 0.05),
+            'Tasa': vacio(np.round(rng.uniform(0.02, 0.05, n_filas), 4), 0.1),
+            'Ranking': vacio(rng.integers(1, 11, n_filas), 0.1),
+            'Venta': vacio(rng.integers(50, 201, n_filas), 0.1),
+        }))
+    return pd.concat(bloques, axis=1)
+
+def test_resumen_igual_a_recorrer_bloques():
+    df_detalle = _detalle(8, 40, 0)
+    esperado = _resumen_por_bloques(df_detalle)
+    resumen = generador.generar_hoja_resumen(df_detalle)
+
+    # "6 y más" era la suma de cinco porcentajes ya redondeados: difiere a lo más en 5 * 0.005
+    otras = [c for c in generador.COLUMNAS_RESUMEN if c != "Ranking 6 y más %"]
+    pd.testing.assert_frame_equal(resumen[otras], esperado[otras], check_dtype=False)
+    np.testing.assert_allclose(resumen["Ranking 6 y más %"], esperado["Ranking 6 y más %"], atol=0.025 + 1e-9)
@@ -0,0 +1,68 @@
+import os
+import random
+import numpy as np
+import openpyxl
+
+import excel_gen
+from escenario import abrir_escenario, ruta_escenario
+
+def _libro(tmp_path, procesar=True):
+    """Libro de excel_gen; con procesar, con tasas, rankings y ventas en todos los dias con perfiles"""
+    random.seed(0)
+    archivo = str(tmp_path / 'datos_clientes.xlsx')
+    excel_gen.generar_excel('03-03-2025', 4, archivo)
+    if not procesar:
+        return archivo
+    df = excel_gen.leer_excel(archivo)
+    for j in range(1, len(df.columns), 4):
+        df.iloc[:, j] = np.where(df.iloc[:, j - 1].notna(), 0.03, np.nan)
+    df, _, _ = excel_gen.procesar_rankings(df)
+    df, _ = excel_gen.procesar_ventas_ponderadas(df)
+    excel_gen.guardar_excel(df, archivo)
+    return archivo
+
+def _editar(archivo, celda, valor):
+    libro = openpyxl.load_workbook(archivo)
+    libro.active[celda] = valor
+    libro.save(archivo)
+
+def _abrir(archivo):
+    return abrir_escenario(archivo, excel_gen.COLUMNAS_BLOQUE, excel_gen.COLUMNAS_NUMERICAS)
+
+def test_ida_y_vuelta_sin_parquet(tmp_path):
+    # Recien generado: los encabezados de cada dia se repiten ('Tasa', 'Ranking', ...)
+    archivo = _libro(tmp_path, procesar=False)
+    os.remove(ruta_escenario(archivo))
+
+    escenario = _abrir(archivo)
+    assert escenario.cambios is None
+    primera_fila = [c.value for c in next(openpyxl.load_workbook(archivo).active.iter_rows(max_row=1))]
+    assert [h for bloque in escenario.encabezados for h in bloque] == primera_fila
+
+    # F2: Tasa del segundo dia, primera fila
+    _editar(archivo, 'F2', 0.05)
+    escenario = _abrir(archivo)
+    assert escenario.cambios[['Dia', 'Fila', 'Columna', 'Nuevo']].values.tolist() == [[1, 0, 'Tasa', 0.05]]
+    assert _abrir(archivo).cambios.empty
+
+def test_recalcular_cambios_solo_toca_lo_editado(tmp_path):
+    archivo = _libro(tmp_path)
+    antes = _abrir(archivo).largo.copy()
+    fila = int(np.flatnonzero(antes['Ranking'].notna())[0])
+    dia, posicion = antes.loc[fila, ['Dia', 'Fila']]
+    columna = openpyxl.utils.get_column_letter(dia * 4 + 3)
+    _editar(archivo, f"{columna}{posicion + 2}", antes.loc[fila, 'Ranking'] % 10 + 1)
+
+    random.seed(1)
+    excel_gen.recalcular_cambios(archivo)
+    despues = _abrir(archivo).largo
+
+    assert despues.loc[fila, 'Ranking'] == antes.loc[fila, 'Ranking'] % 10 + 1
+    otras = despues.index != fila
+    assert despues.loc[otras, 'Venta'].equals(antes.loc[otras, 'Venta'])
+    assert despues.loc[otras, 'Ranking'].equals(antes.loc[otras, 'Ranking'])
+
+    # Sin ediciones no se reescribe el libro
+    mtime = os.stat(archivo).st_mtime_ns
+    excel_gen.recalcular_cambios(archivo)
+    assert os.stat(archivo).st_mtime_ns == mtime
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from functions import unir_cotizaciones
+
+def _unir_pandas(cotizaciones, sc_cotizaciones):
+    """unir_cotizaciones antes del plan de polars (mismo filtro, cruce y limpieza en pandas)"""
+    ids_con_aceptada = cotizaciones[cotizaciones['ACEPTADA'] == 1]['COTIZANTE'].unique()
+    cotizaciones['ACEPTADA'] = cotizaciones['ACEPTADA'].replace(-1, 1)
+    renta_ig = (cotizaciones['TIPO_RENTA'] == "I") & (cotizaciones['MODALIDAD_RENTA'] == "G")
+    con_aceptada = cotizaciones['COTIZANTE'].isin(ids_con_aceptada)
+    filtro = (con_aceptada & (cotizaciones['ACEPTADA'] == 1) & renta_ig) | (~con_aceptada & renta_ig)
+
+    datos = pd.merge(cotizaciones[filtro], sc_cotizaciones[['COTIZANTE', 'COTIZACION', 'POSICION_RELATIVA']],
+                     on=['COTIZANTE', 'COTIZACION'], how='left')
+    datos['POSICION_RELATIVA'] = pd.to_numeric(datos['POSICION_RELATIVA'], errors='coerce')
+
+    numericas = datos[datos.select_dtypes(include=np.number).columns]
+    resultado = numericas.loc[:, numericas.nunique() > 1].copy()
+    if 'POSICION_RELATIVA' not in resultado.columns:
+        resultado['POSICION_RELATIVA'] = datos['POSICION_RELATIVA']
+    if 'ACEPTADA' not in resultado.columns:
+        resultado['ACEPTADA'] = numericas['ACEPTADA']
+    return resultado.dropna()
+
+def test_unir_cotizaciones_igual_a_pandas(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 400
+    cotizaciones = pd.DataFrame({
+        'COTIZANTE': rng.integers(0, 80, n),
+        'COTIZACION': np.arange(n),
+        'TIPO_RENTA': rng.choice(['I', 'D'], n, p=[0.8, 0.2]),
+        'MODALIDAD_RENTA': rng.choice(['G', 'S'], n, p=[0.8, 0.2]),
+        'ACEPTADA': rng.choice([-1, 0, 1], n, p=[0.05, 0.85, 0.1]),
+        'TASA_VENTA': np.round(rng.uniform(0.02, 0.05, n), 4),
+        'RENTA': rng.integers(100, 900, n),
+        'MONEDA': 1,
+    })
+    # Algunas cotizaciones sin posicion en SC_COTIZACIONES
+    sc_cotizaciones = cotizaciones[['COTIZANTE', 'COTIZACION']].sample(frac=0.9, random_state=1)
+    sc_cotizaciones['POSICION_RELATIVA'] = rng.integers(1, 11, len(sc_cotizaciones))
+    cotizaciones.to_excel(tmp_path / 'COTIZACIONES.xlsx', index=False)
+    sc_cotizaciones.to_excel(tmp_path / 'SC_COTIZACIONES.xlsx', index=False)
+
+    esperado = _unir_pandas(pd.read_excel(tmp_path / 'COTIZACIONES.xlsx'),
+                            pd.read_excel(tmp_path / 'SC_COTIZACIONES.xlsx'))
+    resultado = unir_cotizaciones('COTIZACIONES.xlsx', 'SC_COTIZACIONES.xlsx', base_path=str(tmp_path))
+    pd.testing.assert_frame_equal(resultado, esperado)
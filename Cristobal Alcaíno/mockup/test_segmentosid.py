@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from segmentosid import asignar_segmento, asignar_segmentos_batch, IndiceSegmentos
+
+def _catalogo(n, semilla):
+    rng = np.random.default_rng(semilla)
+    segmentos = pd.DataFrame({
+        'SEGMENTO': [f"S{i}" for i in range(n)],
+        'TIPO_RENTA': rng.choice(['I', 'D', None], n),
+        'MODALIDAD_RENTA': rng.choice(['G', 'S', None], n),
+        'SALDO_MINIMO': rng.integers(0, 500, n).astype(float),
+        'MESES_GARANTIZADOS_MINIMO': rng.choice([0, 60, 120, np.nan], n),
+    })
+    segmentos['SALDO_MAXIMO'] = segmentos['SALDO_MINIMO'] + rng.integers(0, 500, n)
+    segmentos['MESES_GARANTIZADOS_MAXIMO'] = segmentos['MESES_GARANTIZADOS_MINIMO'] + rng.choice([60, np.nan], n)
+    return segmentos
+
+def _cotizantes(n, semilla):
+    rng = np.random.default_rng(semilla)
+    return pd.DataFrame({
+        'RENTA': np.where(rng.random(n) < 0.05, np.nan, rng.integers(0, 1000, n)),
+        'TIPO_RENTA': rng.choice(['I', 'D', 'X'], n),
+        'MODALIDAD_RENTA': rng.choice(['G', 'S'], n),
+        'MESES_GARANTIZADOS': rng.choice([0, 30, 60, 120, 200], n).astype(float),
+    })
+
+def test_batch_igual_a_asignar_segmento():
+    segmentos, cotizantes = _catalogo(40, 0), _cotizantes(300, 1)
+    lote = asignar_segmentos_batch(cotizantes, segmentos, con_motivo=True, tamano_bloque=64)
+    for i, fila in cotizantes.iterrows():
+        esperado = asignar_segmento(fila.to_dict(), segmentos)
+        assert lote.loc[i, 'SEGMENTO_ASIGNADO'] == esperado['SEGMENTO_ASIGNADO']
+        assert lote.loc[i, 'COINCIDENCIA'] == esperado['COINCIDENCIA']
+        assert lote.loc[i, 'MOTIVO'] == esperado['MOTIVO']
+
+def test_indice_igual_a_asignar_segmento():
+    segmentos, cotizantes = _catalogo(60, 2), _cotizantes(300, 3)
+    indice = IndiceSegmentos(segmentos)
+    lote = indice.asignar_lote(cotizantes)
+    for i, fila in cotizantes.iterrows():
+        esperado = asignar_segmento(fila.to_dict(), segmentos)
+        assert indice.asignar(fila.to_dict()) == esperado
+        assert lote.loc[i, 'SEGMENTO_ASIGNADO'] == esperado['SEGMENTO_ASIGNADO']
+        assert lote.loc[i, 'COINCIDENCIA'] == esperado['COINCIDENCIA']
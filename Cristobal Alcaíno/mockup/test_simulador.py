@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from clientes_dist import aprender_distribucion, ClientSampler
+from simulador import simular_mes, barrer_escenarios, grilla_tasas
+
+class _RankingFijo:
+    rankings = np.array([1, 2, 3])
+
+    def predict_proba(self, tasas):
+        return np.tile([0.5, 0.3, 0.2], (len(tasas), 1))
+
+@pytest.fixture(scope='module')
+def base_path(tmp_path_factory):
+    # Modelo de clientes chico con RENTA correlacionada, como lo deja clientes_dist en BBDD
+    base = tmp_path_factory.mktemp('BBDD')
+    rng = np.random.default_rng(0)
+    z = rng.standard_normal((3000, 2)) @ np.array([[1.0, 0.6], [0.0, 0.8]])
+    datos = pd.DataFrame({
+        'TASA_VENTA': 0.03 + 0.005 * z[:, 0],
+        'RENTA': 400 + 100 * z[:, 1],
+        'INVALIDA': np.where(z[:, 0] > 1, 'S', 'N'),
+    })
+    aprender_distribucion(datos, ['TASA_VENTA', 'RENTA'], ['INVALIDA'], str(base / 'modelo_distribucion.pkl'))
+    return str(base)
+
+def _simular(base_path, **kwargs):
+    return simular_mes(np.full(5, 0.035), n_replicas=50, pronostico_clientes=np.full(5, 20.0),
+                       modelo_ranking=_RankingFijo(), semilla=7, base_path=base_path, **kwargs)
+
+def test_simular_mes_usa_el_modelo_de_base_path(base_path, tmp_path, monkeypatch):
+    # sin modelo_distribucion.pkl en el directorio de trabajo (el de mockup/ tiene uno)
+    monkeypatch.chdir(tmp_path)
+    por_defecto = _simular(base_path)['ventas_por_replica']
+    con_modelo = _simular(base_path, modelo_distribucion=f"{base_path}/modelo_distribucion.pkl")['ventas_por_replica']
+    uniforme = _simular(base_path, modelo_distribucion=False)['ventas_por_replica']
+    sin_modelo = _simular(str(tmp_path))['ventas_por_replica']
+
+    np.testing.assert_array_equal(por_defecto, con_modelo)
+    np.testing.assert_array_equal(uniforme, sin_modelo)
+    assert not np.array_equal(por_defecto, uniforme)
+
+def test_barrer_escenarios_no_depende_de_n_jobs(base_path):
+    sampler = ClientSampler(f"{base_path}/modelo_distribucion.pkl", semilla=1)
+    kwargs = dict(n_replicas=30, pronostico_clientes=np.full(5, 20.0), modelo_ranking=_RankingFijo(),
+                  semilla=3, modelo_distribucion=sampler)
+    esquemas = grilla_tasas([0.03, 0.035, 0.04, 0.045], n_dias=5)
+    en_serie = barrer_escenarios(esquemas, n_jobs=1, **kwargs)
+    en_paralelo = barrer_escenarios(esquemas, n_jobs=2, **kwargs)
+    pd.testing.assert_frame_equal(en_serie, en_paralelo)